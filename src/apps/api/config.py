@@ -4,6 +4,7 @@
 """
 
 from pathlib import Path
+from typing import Literal
 
 from pydantic import Field, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -17,6 +18,9 @@ class Settings(BaseSettings):
 
     # 数据库配置
     DATABASE_URL: str = Field(..., min_length=1)
+    DB_POOL_SIZE: int = 10  # 常驻连接数（每个 worker）
+    DB_MAX_OVERFLOW: int = 20  # 高峰期允许的额外连接数
+    DB_POOL_TIMEOUT: float = 30.0  # 等待空闲连接的超时（秒）
 
     # MinIO 配置
     MINIO_ENDPOINT: str = Field(..., min_length=1)
@@ -31,14 +35,123 @@ class Settings(BaseSettings):
     LLM_TIMEOUT: int = 60  # 请求超时时间（秒）
     LLM_MAX_TOKENS: int = 500  # 最大生成 token 数
     LLM_TEMPERATURE: float = 0.7
+    # 流式对话请求 stream_options.include_usage，按 vLLM 报告的 token 用量记账
+    LLM_STREAM_INCLUDE_USAGE: bool = True
     # 模型最大上下文长度（需要与 vLLM 启动参数 --max-model-len 一致）
     LLM_MAX_CONTEXT_LEN: int = 1024
+    # 所部署模型的本地 tokenizer 路径（模型目录或 tokenizer.json）；
+    # 未配置时若 LLM_MODEL 为本地目录则复用，否则回退启发式估算
+    LLM_TOKENIZER_PATH: str | None = None
+    TOKENIZER_CACHE_SIZE: int = 4096  # 按文本缓存 token 数的条目上限
+    # 每轮对话从数据库加载的最近历史消息条数上限（实际入选由 token 预算决定）
+    CHAT_HISTORY_WINDOW: int = 40
+    # 打包历史时为回复预留的最少 token 数
+    CHAT_RESERVED_OUTPUT_TOKENS: int = 200
+
+    # 病例编译缓存（开发者提示词、检查结果文本等）的条目上限
+    COMPILED_CASE_CACHE_SIZE: int = 512
+
+    # 长会话滚动摘要（较早问答压缩为“患者已透露的信息”）
+    CHAT_SUMMARY_ENABLED: bool = True
+    CHAT_SUMMARY_TRIGGER_TOKENS: int = 400  # 未摘要原文历史超过该值时触发后台摘要
+    CHAT_SUMMARY_KEEP_RECENT: int = 6  # 摘要时保留的最近原文消息条数
+    CHAT_SUMMARY_MAX_TOKENS: int = 200  # 摘要生成的最大 token 数
+    CHAT_SUMMARY_BATCH_SIZE: int = 40  # 单次增量摘要最多处理的消息条数
+    CHAT_SUMMARY_CACHE_SIZE: int = 1024  # 进程内缓存的会话摘要数量
+
+    # LLM HTTP 连接池配置（应用级共享客户端）
+    LLM_HTTP2: bool = False  # 需要安装 h2，未安装时自动回退 HTTP/1.1
+    LLM_POOL_MAX_CONNECTIONS: int = 200
+    LLM_POOL_MAX_KEEPALIVE: int = 50
+    LLM_POOL_KEEPALIVE_EXPIRY: float = 30.0  # 空闲连接保活时间（秒）
+    LLM_CONNECT_TIMEOUT: float = 5.0  # 建连超时（秒）
+    LLM_POOL_TIMEOUT: float = 10.0  # 等待连接池空闲连接的超时（秒）
+    # 多副本 vLLM 地址列表（为空时仅使用 LLM_BASE_URL）
+    LLM_BACKEND_URLS: list[str] = []
+    # 按静态前缀哈希把同一病例的对话固定路由到同一副本（复用 vLLM 前缀缓存）
+    LLM_PREFIX_AFFINITY: bool = True
+    LLM_PREFIX_STATS_SIZE: int = 1024  # 每个副本记录的最近前缀数（用于估算命中率）
+    # 亲和副本的在途请求数最多可比最空闲副本多出的数量，超出则改走最空闲副本
+    LLM_AFFINITY_MAX_SKEW: int = 4
+    # 副本健康检查与摘除
+    LLM_HEALTH_CHECK_PATH: str = "/health"  # vLLM 提供 /health；其他兼容服务可用 /v1/models
+    LLM_HEALTH_CHECK_INTERVAL: float = 5.0  # 主动健康检查间隔（秒），<= 0 关闭
+    LLM_HEALTH_CHECK_TIMEOUT: float = 2.0  # 单次健康检查超时（秒）
+    LLM_EJECT_FAILURES: int = 3  # 连续失败多少次后摘除副本
+    LLM_EJECT_COOLDOWN: float = 30.0  # 摘除后多久允许再次试探（秒）
+    # LLM 准入控制与公平排队
+    LLM_MAX_IN_FLIGHT_PER_BACKEND: int = 8  # 每个健康副本允许的最大在途请求数
+    LLM_QUEUE_MAX: int = 100  # 等待队列总长度上限，超出返回 503
+    LLM_QUEUE_MAX_PER_USER: int = 2  # 单个用户最多排队的请求数
+    LLM_QUEUE_TIMEOUT: float = 30.0  # 最长排队时间（秒）
+    LLM_QUEUE_POSITION_INTERVAL: float = 2.0  # 排队位置推送的最长间隔（秒）
+    # 流式对话期间检测客户端断开的轮询间隔（秒）
+    CHAT_DISCONNECT_POLL_INTERVAL: float = 0.5
+    # 单个客户端允许积压的事件数上限及客户端落后过多时的策略：
+    # coalesce 合并积压为一段发送；disconnect 停止推送，上游生成完后完整保存
+    CHAT_STREAM_BUFFER_SIZE: int = 64
+    CHAT_SLOW_CLIENT_POLICY: Literal["coalesce", "disconnect"] = "coalesce"
+    # 上游读取缓冲（尚未被合并取走的回复增量）的字节上限，达到后上游读取暂停等待取走
+    CHAT_RELAY_BUFFER_BYTES: int = 65536
+    # SSE 帧合并：首个增量到达后最多等待 N 毫秒或累积到 M 字节再发送（N=0 关闭等待）
+    CHAT_SSE_FLUSH_MS: int = 30
+    CHAT_SSE_FLUSH_BYTES: int = 256
+    # 上游流解析方式：json 逐行完整解析；passthrough 在原始字节上扫描 content 字段
+    # （CPU 开销更低，结构不符合预期时自动回退 json）
+    CHAT_STREAM_PARSER: Literal["json", "passthrough"] = "json"
+    # 可恢复的对话流：每个流在内存中保留最近 N 个事件，客户端可带 Last-Event-ID 重连
+    CHAT_RESUME_BUFFER_EVENTS: int = 512
+    # 无客户端连接超过该秒数的生成视为被放弃并中止（0 表示断开即中止）
+    CHAT_RESUME_GRACE: float = 10.0
+    CHAT_RESUME_TTL: float = 60.0  # 生成结束后流保留多久以供重连（秒）
+    # 未结束的流最长保留多久（秒）：生成任务异常退出、未调用 finish() 的流到期后清理
+    CHAT_RESUME_MAX_AGE: float = 1800.0
+    # 对话请求幂等键（Idempotency-Key）：TTL 内的重复请求回放同一次生成
+    CHAT_IDEMPOTENCY_TTL: float = 600.0  # 幂等键有效期（秒）
+    CHAT_IDEMPOTENCY_MAX_KEYS: int = 2000  # 进程内最多保留的幂等键（连同其完成的流）
+    CHAT_IDEMPOTENCY_WAIT: float = 10.0  # 重复请求等待首个请求产生结果的最长时间（秒）
+    # 同一会话同时只进行一轮对话；会话正忙时：reject 返回 409，queue 等待上一轮结束，
+    # cancel_replace 取消上一轮（部分回答按 truncated 保存）后接手
+    CHAT_SESSION_BUSY_POLICY: Literal["reject", "queue", "cancel_replace"] = "reject"
+    CHAT_SESSION_LOCK_TIMEOUT: float = 30.0  # queue/cancel_replace 等待上一轮结束的最长时间（秒）
+    # memory 仅进程内互斥；postgres 另持有咨询锁以跨 worker 互斥
+    # （每轮对话占用一个独立的数据库连接，不占用应用连接池）
+    CHAT_SESSION_LOCK_BACKEND: Literal["memory", "postgres"] = "memory"
+
+    # 对话消息异步落库（write-behind）：后台攒批，一次 Core 批量插入一个事务
+    MESSAGE_WRITER_ENABLED: bool = True
+    MESSAGE_WRITER_BATCH_SIZE: int = 200  # 单批最多写入的消息条数
+    MESSAGE_WRITER_FLUSH_MS: int = 50  # 首条消息入队后最多等待多久凑批（毫秒），0 不等待
+    MESSAGE_WRITER_QUEUE_MAX: int = 10000  # 待写消息上限，超出时提交方等待
+    MESSAGE_WRITER_RETRY_BACKOFF: float = 0.5  # 写入失败后的首次重试间隔（秒），指数退避
+    MESSAGE_WRITER_RETRY_MAX_BACKOFF: float = 10.0  # 重试间隔上限（秒）
+    MESSAGE_WRITER_MAX_RETRIES: int = 8  # 连接 / 超时类错误的最大重试次数，耗尽后记死信日志
+    MESSAGE_WRITER_SHUTDOWN_TIMEOUT: float = 10.0  # 应用关闭时写完队列的最长等待（秒）
+
+    # Prometheus 指标（/metrics）；多 worker 部署时需设置环境变量 PROMETHEUS_MULTIPROC_DIR
+    METRICS_ENABLED: bool = True
+    METRICS_POOL_SAMPLE_INTERVAL: float = 5.0  # 数据库连接池指标的采样间隔（秒）
 
     # LLM 病例随机生成配置（独立于对话生成，避免被 LLM_MAX_TOKENS 过小限制）
     # 注意：最终请求会被按 LLM_MAX_CONTEXT_LEN 自动截断，避免 vLLM 因超出上下文而 400。
     LLM_CASE_GEN_MAX_TOKENS: int = 1200
     LLM_CASE_GEN_TEMPERATURE: float = 0.8
     LLM_CASE_GEN_RETRIES: int = 2
+    # 按病例 JSON Schema 引导解码（vLLM 结构化输出）；后端不支持时关闭，退回 json_object
+    LLM_CASE_GEN_GUIDED_JSON: bool = True
+    # 流式生成并增量校验：结构错误、枚举取值错误、失控输出一出现就中止该次请求并重试
+    LLM_CASE_GEN_STREAM: bool = True
+    LLM_CASE_GEN_MAX_STRING_CHARS: int = 800  # 单个字符串字段的最大字符数（超出视为失控输出）
+    LLM_CASE_GEN_MAX_ARRAY_ITEMS: int = 30  # 单个数组的最大元素数（超出视为失控输出）
+
+    # 随机病例池（后台预生成，随机模式建会话时直接领取）
+    CASE_POOL_SIZE: int = 20  # 池中保持的病例数，0 关闭（随机模式同步生成）
+    CASE_POOL_IDLE_UTILIZATION: float = 0.5  # 在途请求低于准入容量的该比例且无排队时才补充
+    CASE_POOL_POLL_INTERVAL: float = 5.0  # 池满或 GPU 繁忙时的检查间隔（秒）
+    CASE_POOL_RETRY_BACKOFF: float = 30.0  # 补充失败后的重试间隔（秒）
+    # 病例池为空时随机会话异步生成病例（POST 返回 202，轮询进度）
+    SESSION_JOB_TTL: float = 300.0  # 生成任务结束后在内存中保留的时间（秒，含失败原因）
+    SESSION_JOB_STALE_AFTER: float = 600.0  # pending 会话超过该时间无任务跟踪则视为中断（秒）
 
     # JWT 配置
     JWT_SECRET: str = Field(..., min_length=1)
@@ -68,5 +181,6 @@ class Settings(BaseSettings):
                 raise ValueError("JWT_SECRET is too weak for production")
         return self
 
+
 # 全局配置实例
 settings = Settings()
@@ -9,6 +9,7 @@ from typing import Annotated
 import jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from .config import settings
@@ -24,6 +25,9 @@ engine = create_async_engine(
     async_db_url,
     echo=settings.DEBUG,
     pool_pre_ping=True,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
 )
 
 # 创建会话工厂
@@ -47,14 +51,11 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
             await session.close()
 
 
-async def get_current_user(
-    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
-    db: Annotated[AsyncSession, Depends(get_db)],
-) -> User:
-    """获取当前认证用户。
+async def _load_current_user(token: str, db: AsyncSession) -> User:
+    """校验 JWT 并加载当前用户。
 
     Args:
-        credentials: JWT token
+        token: JWT token
         db: 数据库会话
 
     Returns:
@@ -63,8 +64,6 @@ async def get_current_user(
     Raises:
         HTTPException: 401 如果 token 无效或过期
     """
-    token = credentials.credentials
-
     try:
         # 解码 JWT
         payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
@@ -91,8 +90,6 @@ async def get_current_user(
         ) from e
 
     # 从数据库加载用户
-    from sqlalchemy import select
-
     result = await db.execute(select(User).where(User.id == user_id))
     user = result.scalar_one_or_none()
 
@@ -111,6 +108,48 @@ async def get_current_user(
     return user
 
 
+async def get_current_user(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    db: Annotated[AsyncSession, Depends(get_db)],
+) -> User:
+    """获取当前认证用户。
+
+    Args:
+        credentials: JWT token
+        db: 数据库会话
+
+    Returns:
+        当前用户对象
+
+    Raises:
+        HTTPException: 401 如果 token 无效或过期
+    """
+    return await _load_current_user(credentials.credentials, db)
+
+
+async def get_stream_user(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+) -> User:
+    """获取当前认证用户（不持有请求级数据库会话）。
+
+    供 SSE 等长连接接口使用：yield 依赖（get_db）的清理可能要等到响应发送完毕，
+    若复用请求级会话，连接会在整个流式生成期间被占用。
+    这里使用独立的短生命周期会话，查询完成后立即归还连接。
+
+    Args:
+        credentials: JWT token
+
+    Returns:
+        当前用户对象（已脱离会话，仅可读取已加载字段）
+
+    Raises:
+        HTTPException: 401 如果 token 无效或过期
+    """
+    async with AsyncSessionLocal() as db:
+        return await _load_current_user(credentials.credentials, db)
+
+
 # 依赖注入类型别名
 DbSession = Annotated[AsyncSession, Depends(get_db)]
 CurrentUser = Annotated[User, Depends(get_current_user)]
+StreamUser = Annotated[User, Depends(get_stream_user)]
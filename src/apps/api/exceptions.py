@@ -73,6 +73,7 @@ def setup_exception_handlers(app: FastAPI) -> None:
                 detail=str(exc.detail),
                 trace_id=trace_id,
             ).model_dump(),
+            headers=exc.headers,
         )
 
     @app.exception_handler(Exception)
@@ -3,19 +3,80 @@
 提供核心 API 路由和中间件配置。
 """
 
-from fastapi import FastAPI
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any
+
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from slowapi.errors import RateLimitExceeded
 
 from .config import settings
+from .dependencies import engine
 from .exceptions import setup_exception_handlers
 from .logging_config import logger, setup_logging
 from .middleware import AuthContextMiddleware, RequestLoggingMiddleware, TraceIdMiddleware
 from .rate_limit import limiter, rate_limit_exceeded_handler
+from .services import generation_stats
+from .services.admission import get_admission
+from .services.case_pool import get_case_pool
+from .services.chat_stream import drain_background, stream_stats
+from .services.compiled_case import preload_fixed_cases
+from .services.idempotency import idempotency_store
+from .services.llm_client import close_llm_client, get_llm_client, init_llm_client
+from .services.message_writer import get_message_writer
+from .services.metrics import (
+    CONTENT_TYPE_LATEST,
+    mark_process_dead,
+    render_latest,
+    run_pool_sampler,
+)
+from .services.session_jobs import session_jobs
+from .services.session_lock import get_session_guard
+from .services.stream_registry import stream_registry
+from .services.summarizer import shutdown_summarizer
+from .services.tokenizer import get_tokenizer
 
 # 初始化日志系统
 setup_logging()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """应用生命周期：创建与释放进程级共享资源。"""
+    await init_llm_client()
+    get_message_writer().start()
+    pool_sampler = asyncio.create_task(
+        run_pool_sampler(engine.pool, settings.METRICS_POOL_SAMPLE_INTERVAL)
+    )
+    # tokenizer 加载涉及磁盘 IO，放到线程中，避免阻塞事件循环
+    await asyncio.to_thread(get_tokenizer().load)
+    # 预热固定病例的编译缓存；失败不影响启动，首次对话时会按需编译
+    try:
+        await preload_fixed_cases()
+    except Exception as e:
+        logger.warning("固定病例编译缓存预热失败", error=str(e))
+    # 随机病例池在后台补充，不阻塞启动
+    get_case_pool().start()
+    try:
+        yield
+    finally:
+        await get_case_pool().stop()
+        await session_jobs.shutdown()
+        await drain_background()
+        # 后台保存任务提交完毕后再写完消息队列
+        await get_message_writer().stop()
+        await shutdown_summarizer()
+        await close_llm_client()
+        pool_sampler.cancel()
+        try:
+            await pool_sampler
+        except asyncio.CancelledError:
+            pass
+        mark_process_dead()
+
+
 # 创建 FastAPI 应用
 app = FastAPI(
     title="Clinic Simulation API",
@@ -23,6 +84,7 @@ app = FastAPI(
     description="临床医学模拟问诊系统 API",
     docs_url="/docs" if settings.ENV == "dev" else None,  # 生产环境禁用文档
     redoc_url="/redoc" if settings.ENV == "dev" else None,
+    lifespan=lifespan,
 )
 
 # 配置限流器
@@ -63,6 +125,45 @@ async def health_check() -> dict[str, str]:
     return {"status": "ok", "env": settings.ENV}
 
 
+@app.get("/health/llm", tags=["system"])
+async def llm_health() -> dict[str, Any]:
+    """LLM 相关组件的运行状态。
+
+    Returns:
+        各组件快照：
+        - backends / prefix_affinity / prefix_cache：后端健康与在途请求、前缀命中率（估算）
+        - admission：准入与排队
+        - streams / resumable_streams：流式转发、断开取消与断线重连
+        - idempotency / session_turns：幂等去重、会话单飞
+        - message_writer：消息写入队列
+        - generation_latency：按后端的生成延迟分布（排队/建连/TTFT/ITL/吞吐）
+        - case_pool / session_jobs：随机病例池、随机会话生成任务
+    """
+    client = get_llm_client()
+    return {
+        "backends": client.pool.snapshot(),
+        "prefix_affinity": settings.LLM_PREFIX_AFFINITY,
+        "prefix_cache": client.prefix_stats.snapshot(),
+        "admission": get_admission().snapshot(),
+        "streams": stream_stats.snapshot(),
+        "resumable_streams": stream_registry.snapshot(),
+        "idempotency": idempotency_store.snapshot(),
+        "session_turns": get_session_guard().snapshot(),
+        "message_writer": get_message_writer().snapshot(),
+        "generation_latency": generation_stats.snapshot(),
+        "case_pool": get_case_pool().snapshot(),
+        "session_jobs": session_jobs.snapshot(),
+    }
+
+
+if settings.METRICS_ENABLED:
+
+    @app.get("/metrics", tags=["system"], include_in_schema=False)
+    async def metrics() -> Response:
+        """Prometheus 指标（设置 PROMETHEUS_MULTIPROC_DIR 时汇总所有 worker）。"""
+        return Response(render_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 # 根路径
 @app.get("/", tags=["system"])
 async def root() -> dict[str, str]:
@@ -2,7 +2,7 @@
 
 提供：
 - Trace ID 中间件：为每个请求生成唯一标识
-- 请求日志中间件：记录请求/响应信息
+- 请求日志中间件：记录请求/响应信息与按路由的耗时指标
 """
 
 import time
@@ -16,6 +16,7 @@ from starlette.middleware.base import BaseHTTPMiddleware
 
 from .config import settings
 from .logging_config import logger, trace_id_var
+from .services.metrics import http_request_duration, route_label
 
 
 class TraceIdMiddleware(BaseHTTPMiddleware):
@@ -55,7 +56,7 @@ class RequestLoggingMiddleware(BaseHTTPMiddleware):
     记录每个请求的：
     - 方法、路径
     - 响应状态码
-    - 处理耗时
+    - 处理耗时（同时按路由模板写入 http_request_duration_seconds）
     """
 
     async def dispatch(
@@ -75,10 +76,21 @@ class RequestLoggingMiddleware(BaseHTTPMiddleware):
                 client=request.client.host if request.client else "-",
             )
 
-        response = await call_next(request)
+        try:
+            response = await call_next(request)
+        except Exception:
+            # 未处理异常由外层转为 500，这里只计入指标
+            http_request_duration.labels(request.method, route_label(request), "500").observe(
+                time.perf_counter() - start_time
+            )
+            raise
+        elapsed = time.perf_counter() - start_time
+        http_request_duration.labels(
+            request.method, route_label(request), str(response.status_code)
+        ).observe(elapsed)
 
         if should_log:
-            duration_ms = (time.perf_counter() - start_time) * 1000
+            duration_ms = elapsed * 1000
             log_func = logger.info if response.status_code < 400 else logger.warning
             log_func(
                 "请求完成",
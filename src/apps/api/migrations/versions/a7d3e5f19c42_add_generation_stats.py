@@ -0,0 +1,99 @@
+"""Add generation stats table
+
+Revision ID: a7d3e5f19c42
+Revises: f4c9d2e8a1b7
+Create Date: 2026-10-16
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "a7d3e5f19c42"
+down_revision: str | Sequence[str] | None = "f4c9d2e8a1b7"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "generation_stats",
+        sa.Column("id", sa.Integer(), nullable=False, comment="统计ID"),
+        sa.Column("session_id", sa.Integer(), nullable=False, comment="会话ID"),
+        sa.Column("case_id", sa.Integer(), nullable=False, comment="病例ID"),
+        sa.Column("backend", sa.String(length=255), nullable=True, comment="vLLM 后端地址"),
+        sa.Column("model", sa.String(length=100), nullable=False, comment="模型名称"),
+        sa.Column(
+            "finish_reason",
+            sa.String(length=20),
+            nullable=True,
+            comment="结束原因：stop/length/truncated",
+        ),
+        sa.Column("completion_tokens", sa.Integer(), nullable=False, comment="生成的 token 数量"),
+        sa.Column("queue_wait_ms", sa.Integer(), nullable=False, comment="准入排队耗时（毫秒）"),
+        sa.Column(
+            "connect_ms", sa.Integer(), nullable=True, comment="上游建连到响应头耗时（毫秒）"
+        ),
+        sa.Column(
+            "ttft_ms",
+            sa.Integer(),
+            nullable=True,
+            comment="首 token 延迟（毫秒，自发起上游请求起）",
+        ),
+        sa.Column("itl_mean_ms", sa.Float(), nullable=True, comment="token 间隔均值（毫秒）"),
+        sa.Column("itl_p95_ms", sa.Float(), nullable=True, comment="token 间隔 p95（毫秒）"),
+        sa.Column(
+            "tokens_per_s", sa.Float(), nullable=True, comment="解码吞吐（首 token 之后，token/秒）"
+        ),
+        sa.Column("total_ms", sa.Integer(), nullable=False, comment="上游生成总耗时（毫秒）"),
+        sa.Column(
+            "created_at",
+            sa.DateTime(),
+            server_default=sa.text("now()"),
+            nullable=False,
+            comment="创建时间",
+        ),
+        sa.ForeignKeyConstraint(
+            ["case_id"],
+            ["cases.id"],
+            name=op.f("fk_generation_stats_case_id_cases"),
+            ondelete="CASCADE",
+        ),
+        sa.ForeignKeyConstraint(
+            ["session_id"],
+            ["sessions.id"],
+            name=op.f("fk_generation_stats_session_id_sessions"),
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_generation_stats")),
+    )
+    op.create_index(
+        op.f("ix_generation_stats_session_id"),
+        "generation_stats",
+        ["session_id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_generation_stats_backend_created_at",
+        "generation_stats",
+        ["backend", "created_at"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_generation_stats_case_id_created_at",
+        "generation_stats",
+        ["case_id", "created_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_generation_stats_case_id_created_at", table_name="generation_stats")
+    op.drop_index("ix_generation_stats_backend_created_at", table_name="generation_stats")
+    op.drop_index(op.f("ix_generation_stats_session_id"), table_name="generation_stats")
+    op.drop_table("generation_stats")
@@ -0,0 +1,37 @@
+"""Add prompt_tokens to generation stats
+
+Revision ID: b2e6f8a4c913
+Revises: a7d3e5f19c42
+Create Date: 2026-10-16
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "b2e6f8a4c913"
+down_revision: str | Sequence[str] | None = "a7d3e5f19c42"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # vLLM 报告的提示词 token 数（stream_options.include_usage；流被中止时为空）
+    op.add_column(
+        "generation_stats",
+        sa.Column(
+            "prompt_tokens",
+            sa.Integer(),
+            nullable=True,
+            comment="提示词 token 数量（vLLM 报告）",
+        ),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("generation_stats", "prompt_tokens")
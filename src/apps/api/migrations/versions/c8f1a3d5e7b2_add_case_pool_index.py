@@ -0,0 +1,56 @@
+"""Add random case pool index
+
+Revision ID: c8f1a3d5e7b2
+Revises: b2e6f8a4c913
+Create Date: 2026-10-16
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c8f1a3d5e7b2"
+down_revision: str | Sequence[str] | None = "b2e6f8a4c913"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+OLD_SOURCE_COMMENT = "病例来源：fixed（库内病例）/random（LLM 随机生成）"
+NEW_SOURCE_COMMENT = "病例来源：fixed（库内病例）/random（LLM 随机生成）/pool（随机病例池，未领取）"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.alter_column(
+        "cases",
+        "source",
+        existing_type=sa.String(length=20),
+        existing_nullable=False,
+        comment=NEW_SOURCE_COMMENT,
+        existing_comment=OLD_SOURCE_COMMENT,
+    )
+    # 随机病例池领取（部分索引：只包含未领取的池中病例）
+    op.create_index(
+        "ix_cases_pool_id",
+        "cases",
+        ["id"],
+        unique=False,
+        postgresql_where=sa.text("source = 'pool'"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_cases_pool_id", table_name="cases")
+    # 未领取的池中病例没有会话引用，随索引一并移除
+    op.execute("DELETE FROM cases WHERE source = 'pool'")
+    op.alter_column(
+        "cases",
+        "source",
+        existing_type=sa.String(length=20),
+        existing_nullable=False,
+        comment=OLD_SOURCE_COMMENT,
+        existing_comment=NEW_SOURCE_COMMENT,
+    )
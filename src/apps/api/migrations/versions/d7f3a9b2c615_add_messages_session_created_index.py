@@ -0,0 +1,33 @@
+"""Add composite index on messages (session_id, created_at)
+
+Revision ID: d7f3a9b2c615
+Revises: c4a1e8d93f22
+Create Date: 2026-10-16
+
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "d7f3a9b2c615"
+down_revision: str | Sequence[str] | None = "c4a1e8d93f22"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 对话历史窗口查询：WHERE session_id = ? ORDER BY created_at DESC LIMIT N
+    op.create_index(
+        "ix_messages_session_id_created_at",
+        "messages",
+        ["session_id", "created_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_messages_session_id_created_at", table_name="messages")
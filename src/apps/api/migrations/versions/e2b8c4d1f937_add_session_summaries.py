@@ -0,0 +1,68 @@
+"""Add session summaries table
+
+Revision ID: e2b8c4d1f937
+Revises: d7f3a9b2c615
+Create Date: 2026-10-16
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e2b8c4d1f937"
+down_revision: str | Sequence[str] | None = "d7f3a9b2c615"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "session_summaries",
+        sa.Column("id", sa.Integer(), nullable=False, comment="摘要ID"),
+        sa.Column("session_id", sa.Integer(), nullable=False, comment="会话ID（唯一）"),
+        sa.Column("content", sa.Text(), nullable=False, comment="摘要内容（患者已透露的信息）"),
+        sa.Column("tokens", sa.Integer(), nullable=False, comment="摘要 token 数量"),
+        sa.Column(
+            "watermark_message_id",
+            sa.Integer(),
+            nullable=False,
+            comment="已并入摘要的最后一条消息ID",
+        ),
+        sa.Column(
+            "created_at",
+            sa.DateTime(),
+            server_default=sa.text("now()"),
+            nullable=False,
+            comment="创建时间",
+        ),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(),
+            server_default=sa.text("now()"),
+            nullable=False,
+            comment="更新时间",
+        ),
+        sa.ForeignKeyConstraint(
+            ["session_id"],
+            ["sessions.id"],
+            name=op.f("fk_session_summaries_session_id_sessions"),
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_session_summaries")),
+    )
+    op.create_index(
+        op.f("ix_session_summaries_session_id"),
+        "session_summaries",
+        ["session_id"],
+        unique=True,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f("ix_session_summaries_session_id"), table_name="session_summaries")
+    op.drop_table("session_summaries")
@@ -0,0 +1,68 @@
+"""Allow pending random sessions without a case
+
+Revision ID: e9a2c6f4b8d1
+Revises: c8f1a3d5e7b2
+Create Date: 2026-10-16
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e9a2c6f4b8d1"
+down_revision: str | Sequence[str] | None = "c8f1a3d5e7b2"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+OLD_CASE_COMMENT = "病例ID"
+NEW_CASE_COMMENT = "病例ID（随机会话在病例生成完成前为空）"
+OLD_STATUS_COMMENT = "状态：in_progress/submitted/scored"
+NEW_STATUS_COMMENT = (
+    "状态：pending（随机病例生成中）/in_progress/submitted/scored/failed（病例生成失败）"
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 随机会话先创建（pending），病例在后台生成完成后再关联
+    op.alter_column(
+        "sessions",
+        "case_id",
+        existing_type=sa.Integer(),
+        nullable=True,
+        comment=NEW_CASE_COMMENT,
+        existing_comment=OLD_CASE_COMMENT,
+    )
+    op.alter_column(
+        "sessions",
+        "status",
+        existing_type=sa.String(length=20),
+        existing_nullable=False,
+        comment=NEW_STATUS_COMMENT,
+        existing_comment=OLD_STATUS_COMMENT,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # 没有病例的会话（生成中 / 生成失败）无法保留
+    op.execute("DELETE FROM sessions WHERE case_id IS NULL")
+    op.alter_column(
+        "sessions",
+        "status",
+        existing_type=sa.String(length=20),
+        existing_nullable=False,
+        comment=OLD_STATUS_COMMENT,
+        existing_comment=NEW_STATUS_COMMENT,
+    )
+    op.alter_column(
+        "sessions",
+        "case_id",
+        existing_type=sa.Integer(),
+        nullable=False,
+        comment=OLD_CASE_COMMENT,
+        existing_comment=NEW_CASE_COMMENT,
+    )
@@ -0,0 +1,37 @@
+"""Add finish_reason to messages
+
+Revision ID: f4c9d2e8a1b7
+Revises: e2b8c4d1f937
+Create Date: 2026-10-16
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "f4c9d2e8a1b7"
+down_revision: str | Sequence[str] | None = "e2b8c4d1f937"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 助手回复的结束原因：stop / length / truncated（客户端断开，回复不完整）
+    op.add_column(
+        "messages",
+        sa.Column(
+            "finish_reason",
+            sa.String(length=20),
+            nullable=True,
+            comment="结束原因：stop/length/truncated",
+        ),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("messages", "finish_reason")
@@ -6,8 +6,10 @@
 from .audit_logs import AuditLog
 from .base import Base, TimestampMixin, to_dict
 from .cases import Case
+from .generation_stats import GenerationStat
 from .messages import Message
 from .scores import Score
+from .session_summaries import SessionSummary
 from .sessions import Session
 from .test_requests import TestRequest
 from .users import User
@@ -19,7 +21,9 @@ __all__ = [
     "User",
     "Case",
     "Session",
+    "SessionSummary",
     "Message",
+    "GenerationStat",
     "TestRequest",
     "Score",
     "AuditLog",
@@ -2,7 +2,7 @@
 
 from typing import TYPE_CHECKING
 
-from sqlalchemy import JSON, String, Text
+from sqlalchemy import JSON, Index, String, Text, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .base import Base, TimestampMixin
@@ -18,6 +18,10 @@ class Case(Base, TimestampMixin):
     """
 
     __tablename__ = "cases"
+    __table_args__ = (
+        # 随机病例池领取（只索引池中病例，领取后即移出索引）
+        Index("ix_cases_pool_id", "id", postgresql_where=text("source = 'pool'")),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, comment="病例ID")
     title: Mapped[str] = mapped_column(String(200), comment="病例标题")
@@ -56,7 +60,7 @@ class Case(Base, TimestampMixin):
     source: Mapped[str] = mapped_column(
         String(20),
         default="fixed",
-        comment="病例来源：fixed（库内病例）/random（LLM 随机生成）",
+        comment="病例来源：fixed（库内病例）/random（LLM 随机生成）/pool（随机病例池，未领取）",
     )
     generation_meta: Mapped[dict | None] = mapped_column(
         JSON,
@@ -0,0 +1,70 @@
+"""生成延迟统计模型。"""
+
+from datetime import datetime
+
+from sqlalchemy import Float, ForeignKey, Index, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+
+
+class GenerationStat(Base):
+    """单次 LLM 生成的延迟统计表。
+
+    每次对话生成一行，记录排队、建连、首 token、token 间隔与吞吐，
+    按后端与病例聚合用于容量规划（如：TTFT 随并发的变化、哪些病例生成偏慢）。
+    """
+
+    __tablename__ = "generation_stats"
+    __table_args__ = (
+        # 按后端 / 病例统计时间段内的延迟分布
+        Index("ix_generation_stats_backend_created_at", "backend", "created_at"),
+        Index("ix_generation_stats_case_id_created_at", "case_id", "created_at"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, comment="统计ID")
+    session_id: Mapped[int] = mapped_column(
+        ForeignKey("sessions.id", ondelete="CASCADE"), index=True, comment="会话ID"
+    )
+    case_id: Mapped[int] = mapped_column(
+        ForeignKey("cases.id", ondelete="CASCADE"), comment="病例ID"
+    )
+
+    # 生成来源
+    backend: Mapped[str | None] = mapped_column(String(255), nullable=True, comment="vLLM 后端地址")
+    model: Mapped[str] = mapped_column(String(100), comment="模型名称")
+    finish_reason: Mapped[str | None] = mapped_column(
+        String(20), nullable=True, comment="结束原因：stop/length/truncated"
+    )
+    prompt_tokens: Mapped[int | None] = mapped_column(
+        nullable=True, comment="提示词 token 数量（vLLM 报告）"
+    )
+    completion_tokens: Mapped[int] = mapped_column(default=0, comment="生成的 token 数量")
+
+    # 延迟分解（毫秒）
+    queue_wait_ms: Mapped[int] = mapped_column(default=0, comment="准入排队耗时（毫秒）")
+    connect_ms: Mapped[int | None] = mapped_column(
+        nullable=True, comment="上游建连到响应头耗时（毫秒）"
+    )
+    ttft_ms: Mapped[int | None] = mapped_column(
+        nullable=True, comment="首 token 延迟（毫秒，自发起上游请求起）"
+    )
+    itl_mean_ms: Mapped[float | None] = mapped_column(
+        Float, nullable=True, comment="token 间隔均值（毫秒）"
+    )
+    itl_p95_ms: Mapped[float | None] = mapped_column(
+        Float, nullable=True, comment="token 间隔 p95（毫秒）"
+    )
+    tokens_per_s: Mapped[float | None] = mapped_column(
+        Float, nullable=True, comment="解码吞吐（首 token 之后，token/秒）"
+    )
+    total_ms: Mapped[int] = mapped_column(comment="上游生成总耗时（毫秒）")
+
+    # 时间戳
+    created_at: Mapped[datetime] = mapped_column(server_default="now()", comment="创建时间")
+
+    def __repr__(self) -> str:
+        return (
+            f"<GenerationStat(id={self.id}, session_id={self.session_id}, "
+            f"backend={self.backend}, ttft_ms={self.ttft_ms})>"
+        )
@@ -3,7 +3,7 @@
 from datetime import datetime
 from typing import TYPE_CHECKING
 
-from sqlalchemy import ForeignKey, String, Text
+from sqlalchemy import ForeignKey, Index, String, Text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .base import Base
@@ -19,6 +19,10 @@ class Message(Base):
     """
 
     __tablename__ = "messages"
+    __table_args__ = (
+        # 对话历史窗口查询（按会话取最近 N 条）
+        Index("ix_messages_session_id_created_at", "session_id", "created_at"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, comment="消息ID")
     session_id: Mapped[int] = mapped_column(
@@ -32,6 +36,9 @@ class Message(Base):
     # 统计信息
     tokens: Mapped[int | None] = mapped_column(nullable=True, comment="token 数量")
     latency_ms: Mapped[int | None] = mapped_column(nullable=True, comment="响应延迟（毫秒）")
+    finish_reason: Mapped[str | None] = mapped_column(
+        String(20), nullable=True, comment="结束原因：stop/length/truncated"
+    )
 
     # 时间戳
     created_at: Mapped[datetime] = mapped_column(server_default="now()", comment="创建时间")
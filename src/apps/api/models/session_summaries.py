@@ -0,0 +1,43 @@
+"""会话摘要模型。"""
+
+from typing import TYPE_CHECKING
+
+from sqlalchemy import ForeignKey, Text
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+
+from .base import Base, TimestampMixin
+
+if TYPE_CHECKING:
+    from .sessions import Session
+
+
+class SessionSummary(Base, TimestampMixin):
+    """会话滚动摘要表。
+
+    长会话中较早的问答被压缩为“患者已透露的信息”摘要，
+    watermark_message_id 之前（含）的消息已并入摘要。
+    """
+
+    __tablename__ = "session_summaries"
+
+    id: Mapped[int] = mapped_column(primary_key=True, comment="摘要ID")
+    session_id: Mapped[int] = mapped_column(
+        ForeignKey("sessions.id", ondelete="CASCADE"),
+        unique=True,
+        index=True,
+        comment="会话ID（唯一）",
+    )
+
+    # 摘要内容
+    content: Mapped[str] = mapped_column(Text, comment="摘要内容（患者已透露的信息）")
+    tokens: Mapped[int] = mapped_column(default=0, comment="摘要 token 数量")
+    watermark_message_id: Mapped[int] = mapped_column(comment="已并入摘要的最后一条消息ID")
+
+    # 关系
+    session: Mapped["Session"] = relationship(back_populates="summary")
+
+    def __repr__(self) -> str:
+        return (
+            f"<SessionSummary(id={self.id}, session_id={self.session_id}, "
+            f"watermark_message_id={self.watermark_message_id})>"
+        )
@@ -12,6 +12,7 @@ if TYPE_CHECKING:
     from .cases import Case
     from .messages import Message
     from .scores import Score
+    from .session_summaries import SessionSummary
     from .test_requests import TestRequest
     from .users import User
 
@@ -28,15 +29,18 @@ class Session(Base, TimestampMixin):
     user_id: Mapped[int] = mapped_column(
         ForeignKey("users.id", ondelete="CASCADE"), index=True, comment="用户ID"
     )
-    case_id: Mapped[int] = mapped_column(
-        ForeignKey("cases.id", ondelete="CASCADE"), index=True, comment="病例ID"
+    case_id: Mapped[int | None] = mapped_column(
+        ForeignKey("cases.id", ondelete="CASCADE"),
+        nullable=True,
+        index=True,
+        comment="病例ID（随机会话在病例生成完成前为空）",
     )
 
     # 会话状态
     status: Mapped[str] = mapped_column(
         String(20),
         default="in_progress",
-        comment="状态：in_progress/submitted/scored",
+        comment="状态：pending（随机病例生成中）/in_progress/submitted/scored/failed（病例生成失败）",
     )
 
     # 诊断提交
@@ -60,6 +64,9 @@ class Session(Base, TimestampMixin):
     score: Mapped["Score | None"] = relationship(
         back_populates="session", cascade="all, delete-orphan", uselist=False
     )
+    summary: Mapped["SessionSummary | None"] = relationship(
+        back_populates="session", cascade="all, delete-orphan", uselist=False
+    )
 
     def __repr__(self) -> str:
         return (
@@ -10,6 +10,7 @@ from slowapi.util import get_remote_address
 from starlette.responses import JSONResponse
 
 from .logging_config import logger
+from .services.metrics import rate_limit_rejections, route_label
 
 
 def get_user_identifier(request: Request) -> str:
@@ -31,6 +32,7 @@ limiter = Limiter(key_func=get_user_identifier)
 async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded) -> JSONResponse:
     """限流超限处理器"""
     trace_id = getattr(request.state, "trace_id", "-")
+    rate_limit_rejections.labels(route_label(request)).inc()
     logger.warning(
         "请求限流",
         path=request.url.path,
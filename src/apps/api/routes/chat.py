@@ -4,178 +4,97 @@
 核心实现：学生问诊，LLM 扮演病人回答。
 """
 
-import json
+import asyncio
 import time
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, AsyncIterator, Sequence
+from typing import Annotated, Any
 
-import httpx
-from fastapi import APIRouter, HTTPException, Request, status
+from fastapi import APIRouter, Header, HTTPException, Request, status
 from fastapi.responses import StreamingResponse
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
 from src.apps.api.config import settings
-from src.apps.api.dependencies import CurrentUser, DbSession
+from src.apps.api.dependencies import AsyncSessionLocal, StreamUser
 from src.apps.api.logging_config import logger
-from src.apps.api.models import Case, Message, Session
+from src.apps.api.models import Session, TestRequest
 from src.apps.api.rate_limit import limiter
 from src.apps.api.schemas.chat import ChatRequest
-from src.apps.api.services.test_intents import extract_test_intent, format_test_result_text
+from src.apps.api.services.admission import (
+    AdmissionRejectedError,
+    AdmissionTimeoutError,
+    Ticket,
+    get_admission,
+)
+from src.apps.api.services.chat_history import (
+    HistoryRow,
+    history_row_tokens,
+    load_history_window,
+    pack_history,
+)
+from src.apps.api.services.chat_stream import (
+    FINISH_TRUNCATED,
+    ChatStreamRelay,
+    spawn_background,
+    stream_stats,
+)
+from src.apps.api.services.compiled_case import CompiledCase, get_compiled_case
+from src.apps.api.services.generation_stats import record_generation
+from src.apps.api.services.idempotency import (
+    IdempotencyClaim,
+    idempotency_store,
+    request_fingerprint,
+)
+from src.apps.api.services.message_writer import PendingMessage, get_message_writer
+from src.apps.api.services.session_lock import SessionBusyError, SessionTurn, get_session_guard
+from src.apps.api.services.sse import DONE_FRAME, sse_frame
+from src.apps.api.services.stream_registry import ResumableStream, stream_registry
+from src.apps.api.services.summarizer import (
+    SummaryState,
+    build_summary_message,
+    get_summary,
+    plan_summary_update,
+    schedule_summary_update,
+    unsummarized_history,
+)
+from src.apps.api.services.test_intents import (
+    TestIntent,
+    extract_test_intent,
+    format_test_result_text,
+)
+from src.apps.api.services.tokenizer import count_message_tokens, count_tokens
 
 router = APIRouter()
 
-# 系统提示词模板（固定角色约束）
-SYSTEM_PROMPT = """你是一名正在看病的普通患者，医生正在给你问诊。
-
-【身份铁律 - 绝对不可违反】
-- 你是患者，不是医生、护士或任何医疗人员
-- 你来看病是因为身体不舒服，你不懂医学
-- 你绝对不能：开药、给建议、做诊断、说"我帮你"、说"给你开药"
-- 医生说什么你就听着，最多问"那我该怎么办"或"严重吗"
-
-【回答原则】
-1. 只描述自己的症状和感受，不给任何医学意见
-2. 只回答医生问的问题，不主动提供信息
-3. 用普通人的话说症状，比如"肚子疼"而不是"腹痛"
-4. 回答简短自然，一两句话即可
-5. 如果医生问你该怎么治，回答"我不懂，您是医生您说了算"
-6. 如果医生让你吃药/检查，回答"好的"或"行"即可
-【首次回复规则】
-- 在你的第一次回答的末尾，附上格式为「（病例序号：XX）」的病例编号（XX 为实际序号）。
-- 仅第一次回复需要附带序号，后续回复不再重复。
-
-【诊断终止规则】
-- 当用户明确给出最终诊断时，你必须：
-  （触发词示例："我的诊断是…"、"最终诊断：…"、"诊断为…"、"初步诊断…"）
-  1. 立即退出患者角色扮演
-  2. 判断用户的诊断是否与你预设的「初步诊断」一致
-     给出判断结果（✔ 正确 / ✖ 不正确，并说明正确诊断）
-  3. 完整展示预先生成的病历，格式如下：
-     ---
-     【预设病历】
-     性别：XX
-     年龄：XX岁
-     职业：XX
-     主诉：XX
-     现病史：XX
-     既往史：XX
-     婚育个人史：XX
-     家族史：XX
-     初步诊断：XX
-     ---"""
-
-
-def build_developer_prompt(case: Case) -> str:
-    """构建开发者提示词（包含病例信息）。
-
-    Args:
-        case: 病例对象
-
-    Returns:
-        开发者提示词字符串
-    """
-    # 提取体格检查中可透露的信息
-    physical_exam = case.physical_exam or {}
-    visible_signs = physical_exam.get("visible", {})
-    on_request_signs = physical_exam.get("on_request", {})
-
-    # 格式化可见体征
-    visible_str = (
-        "\n".join(f"  - {k}: {v}" for k, v in visible_signs.items())
-        if visible_signs
-        else "  - 无明显异常"
-    )
-
-    # 格式化按需体征（医生检查时才显示）
-    on_request_str = (
-        "\n".join(f"  - {k}: {v}" for k, v in on_request_signs.items())
-        if on_request_signs
-        else "  - 无特殊发现"
-    )
-
-    # 提取患者信息
-    patient_info = case.patient_info or {}
-    age = patient_info.get("age", "未知")
-    gender = patient_info.get("gender", "未知")
-    occupation = patient_info.get("occupation", "未知")
-
-    # 既往史
-    past_history = case.past_history or {}
-    diseases = past_history.get("diseases", [])
-    allergies = past_history.get("allergies", [])
-    medications = past_history.get("medications", [])
-
-    # 婚育个人史和家族史
-    marriage_history = getattr(case, "marriage_childbearing_history", None) or "未提供"
-    fam_history = getattr(case, "family_history", None) or "未提供"
-
-    # 病例序号
-    case_num = getattr(case, "case_number", None)
-    case_number_line = f"\n病例序号：{case_num}" if case_num else ""
-
-    # 初步诊断（隐藏信息，仅供终止判断使用）
-    std_diag = case.standard_diagnosis or {}
-    primary_diag = std_diag.get("primary", "未知")
-    differential = std_diag.get("differential", [])
-
-    return f"""你扮演的患者信息：
-- 年龄：{age}岁
-- 性别：{"男" if gender == "male" else "女" if gender == "female" else gender}
-- 职业：{occupation}{case_number_line}
-
-主诉：{case.chief_complaint}
-
-现病史：{case.present_illness}
-
-既往史：
-- 疾病史：{", ".join(diseases) if diseases else "无"}
-- 过敏史：{", ".join(allergies) if allergies else "无"}
-- 用药史：{", ".join(medications) if medications else "无"}
-
-婚育个人史：{marriage_history}
-
-家族史：{fam_history}
-
-可见体征（医生一眼能看到的）：
-{visible_str}
-
-体格检查结果（医生检查时你要描述的感受）：
-{on_request_str}
-
-【隐藏信息 - 仅用于诊断终止时的比对，不要主动提及】
-初步诊断：{primary_diag}
-鉴别诊断：{", ".join(differential) if differential else "无"}
-
-【再次强调】你只是一个普通患者：
-- 绝对禁止说"我给你开药"、"你需要吃xx药"、"建议你xxx"这类话
-- 医生说吃药就说"好的"，医生说检查就说"行"
-- 你来看病是求助的，不是给建议的
-"""
-
 
 def build_messages(
-    case: Case,
-    history: list[Message],
+    compiled: CompiledCase,
+    history: Sequence[HistoryRow],
     user_message: str,
+    summary: SummaryState | None = None,
 ) -> list[dict]:
     """构建发送给 LLM 的消息列表。
 
     Args:
-        case: 病例对象
-        history: 历史消息列表
+        compiled: 病例编译产物（提供静态前缀消息）
+        history: 历史消息（按时间正序，已按 token 预算打包，见 pack_history）
         user_message: 用户当前消息
+        summary: 可选的前文摘要（覆盖 history 之前的问答）
 
     Returns:
         OpenAI 格式的消息列表
     """
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "system", "content": build_developer_prompt(case)},
-    ]
+    # 静态前缀（系统提示词 + 开发者提示词）逐字节稳定，便于 vLLM 复用前缀 KV 缓存；
+    # 摘要、历史等动态内容一律追加在其后
+    messages: list[dict] = list(compiled.prefix_messages)
+
+    # 前文摘要（较早问答的压缩）
+    if summary is not None:
+        messages.append(build_summary_message(summary))
 
-    # 添加历史消息（最近 20 条）
-    recent_history = history[-20:] if len(history) > 20 else history
-    for msg in recent_history:
+    # 添加历史消息（窗口与预算由调用方控制）
+    for msg in history:
         messages.append(
             {
                 "role": msg.role,
@@ -194,70 +113,43 @@ def build_messages(
     return messages
 
 
-def estimate_tokens(text: str) -> int:
-    """估算文本的 token 数量。
-
-    简单估算：中文约 1.5 字符/token，英文约 4 字符/token
-    混合文本取中间值
-
-    Args:
-        text: 输入文本
-
-    Returns:
-        估算的 token 数
-    """
-    # 简单方法：字符数 / 2
-    return max(1, len(text) // 2)
-
-
-def estimate_prompt_tokens(messages: list[dict]) -> int:
-    """保守估算 prompt token 数。
-
-    Args:
-        messages: OpenAI 格式消息列表
-
-    Returns:
-        估算的 token 数（偏保守）
-    """
-    return sum(max(1, len(str(m.get("content", "")))) for m in messages)
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",  # 禁用 Nginx 缓冲
+}
 
 
-@router.post("/")
-@limiter.limit("20/minute")
-async def chat_stream(
-    request: Request,
-    data: ChatRequest,
-    db: DbSession,
-    current_user: CurrentUser,
+def sse_response(
+    generator: AsyncIterator[bytes],
+    headers: dict[str, str] | None = None,
 ) -> StreamingResponse:
-    """SSE 流式对话接口。
+    """包装 SSE 流式响应。"""
+    return StreamingResponse(
+        generator,
+        media_type="text/event-stream",
+        headers={**SSE_HEADERS, **(headers or {})},
+    )
 
-    学生（医生角色）发送问诊消息，LLM（病人角色）流式返回回答。
-    限流：每用户每分钟最多 20 次请求。
+
+async def load_chat_session(db: AsyncSession, session_id: int, user_id: int) -> Session:
+    """加载可继续对话的会话（包含病例）。
 
     Args:
-        request: FastAPI Request 对象（限流需要）
-        data: 聊天请求（session_id, message）
         db: 数据库会话
-        current_user: 当前用户
+        session_id: 会话ID
+        user_id: 当前用户ID
 
     Returns:
-        StreamingResponse: SSE 流式响应
+        会话对象
 
     Raises:
-        HTTPException: 403 如果用户无权访问会话
         HTTPException: 404 如果会话不存在
+        HTTPException: 403 如果用户无权访问会话
         HTTPException: 400 如果会话已结束
     """
-    # 1. 查询会话（包含病例和历史消息）
     result = await db.execute(
-        select(Session)
-        .options(
-            selectinload(Session.case),
-            selectinload(Session.messages),
-            selectinload(Session.test_requests),
-        )
-        .where(Session.id == data.session_id)
+        select(Session).options(selectinload(Session.case)).where(Session.id == session_id)
     )
     session = result.scalar_one_or_none()
 
@@ -267,135 +159,435 @@ async def chat_stream(
             detail="Session not found",
         )
 
-    # 2. 权限检查
-    if session.user_id != current_user.id:
+    # 权限检查
+    if session.user_id != user_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Access denied",
         )
 
-    # 3. 检查会话状态
+    # 检查会话状态
     if session.status != "in_progress":
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Session is {session.status}, cannot continue chat",
         )
 
-    # 3.5 检查意图（下检查单/要结果）：用确定性逻辑处理，保证可审计和稳定体验
-    case = session.case
-    available_tests = case.available_tests or []
-    available_test_types = {
-        str(t.get("type")) for t in available_tests if isinstance(t, dict) and t.get("type")
-    }
-    intent = extract_test_intent(data.message, available_test_types)
+    return session
 
-    if intent is not None:
-        # Always persist the doctor's message.
-        user_tokens = estimate_tokens(data.message)
-        db.add(
-            Message(
-                session_id=data.session_id,
-                role="user",
-                content=data.message,
-                tokens=user_tokens,
-            )
+
+async def apply_test_intent(
+    db: AsyncSession,
+    session: Session,
+    compiled: CompiledCase,
+    message: str,
+    intent: TestIntent,
+) -> tuple[str, str | None]:
+    """确定性处理检查意图（下检查单/要结果）并落库。
+
+    Args:
+        db: 数据库会话
+        session: 会话对象
+        compiled: 会话病例的编译产物
+        message: 医生消息
+        intent: 检查意图
+
+    Returns:
+        (患者确认回复, 检查结果系统消息或 None)
+    """
+    # Build a deterministic patient ack.
+    if intent.kind == "order":
+        ack = "好的，我去做检查。"
+    else:
+        ack = "好的，我把检查报告单内容给您。"
+
+    # Only the requested test types are relevant; avoid loading the whole list.
+    result = await db.execute(
+        select(TestRequest).where(
+            TestRequest.session_id == session.id,
+            TestRequest.test_type.in_(intent.test_types),
         )
+    )
+    requested = {tr.test_type: tr for tr in result.scalars()}
+
+    # For each requested test type, either create/find the TestRequest then expose result.
+    system_texts: list[str] = []
+    created = False
+    for test_type in intent.test_types:
+        # Find existing request
+        existing = requested.get(test_type)
+
+        if intent.kind == "order" and existing is None:
+            test_info = compiled.test_index.get(test_type)
+            if test_info is None:
+                continue
+            new_req = TestRequest(
+                session_id=session.id,
+                test_type=test_type,
+                test_name=str(test_info.get("name", test_type)),
+                result=dict(test_info.get("result", {}) or {}),
+            )
+            db.add(new_req)
+            requested[test_type] = new_req
+            created = True
+            # 新申请的检查直接使用预格式化的结果文本
+            system_texts.append(compiled.test_result_texts[test_type])
+            continue
 
-        # Build a deterministic patient ack.
-        if intent.kind == "order":
-            ack = "好的，我去做检查。"
-        else:
-            ack = "好的，我把检查报告单内容给您。"
+        if existing is None:
+            system_texts.append(f"[检查结果] {test_type}: 尚未完成（需要先申请检查）")
+            continue
 
-        assistant_msg = Message(
-            session_id=data.session_id,
+        system_texts.append(format_test_result_text(existing.test_name, existing.result or {}))
+
+    # 检查申请同步提交（后续轮次依赖其存在）；对话消息交给写入队列，无新申请时不再提交事务
+    if created:
+        await db.commit()
+
+    # Always persist the doctor's message, the ack and (for replay) the system message.
+    messages = [
+        PendingMessage(
+            session_id=session.id,
+            role="user",
+            content=message,
+            tokens=count_tokens(message),
+        ),
+        PendingMessage(
+            session_id=session.id,
             role="assistant",
             content=ack,
-            tokens=estimate_tokens(ack),
+            tokens=count_tokens(ack),
             latency_ms=0,
+        ),
+    ]
+    system_content: str | None = None
+    if system_texts:
+        system_content = "\n\n".join(system_texts)
+        messages.append(
+            PendingMessage(
+                session_id=session.id,
+                role="system",
+                content=system_content,
+                tokens=count_tokens(system_content),
+                latency_ms=0,
+            )
         )
-        db.add(assistant_msg)
+    await get_message_writer().submit(messages)
+
+    return ack, system_content
 
-        # For each requested test type, either create/find the TestRequest then expose result.
-        from src.apps.api.models import TestRequest
 
-        system_texts: list[str] = []
-        for test_type in intent.test_types:
-            # Find existing request
-            existing = next(
-                (tr for tr in (session.test_requests or []) if tr.test_type == test_type),
-                None,
+async def save_chat_turn(
+    session_id: int,
+    user_message: str,
+    user_tokens: int,
+    reply: str,
+    latency_ms: int,
+    finish_reason: str,
+    stats: dict[str, Any] | None = None,
+    reply_tokens: int | None = None,
+) -> None:
+    """保存一轮对话（用户消息 + 助手回复）。
+
+    消息提交到写入队列后立即返回，由后台批量落库（见 message_writer）。
+
+    Args:
+        session_id: 会话ID
+        user_message: 用户消息
+        user_tokens: 用户消息 token 数
+        reply: 助手回复（可能是部分回复）
+        latency_ms: 生成耗时（毫秒）
+        finish_reason: 结束原因（stop/length/truncated）
+        stats: 可选的生成延迟统计（与消息同事务写入 generation_stats）
+        reply_tokens: 回复的 token 数（vLLM 报告的 usage；None 时按本地 tokenizer 计数）
+    """
+    messages = [
+        PendingMessage(
+            session_id=session_id,
+            role="user",
+            content=user_message,
+            tokens=user_tokens,
+        )
+    ]
+    if reply:
+        messages.append(
+            PendingMessage(
+                session_id=session_id,
+                role="assistant",
+                content=reply,
+                tokens=reply_tokens if reply_tokens is not None else count_tokens(reply),
+                latency_ms=latency_ms,
+                finish_reason=finish_reason,
             )
+        )
 
-            if intent.kind == "order" and existing is None:
-                test_info = next(
-                    (
-                        t
-                        for t in available_tests
-                        if isinstance(t, dict) and t.get("type") == test_type
-                    ),
-                    None,
-                )
-                if test_info is None:
-                    continue
-                new_req = TestRequest(
-                    session_id=data.session_id,
-                    test_type=test_type,
-                    test_name=str(test_info.get("name", test_type)),
-                    result=test_info.get("result", {}) or {},
-                )
-                db.add(new_req)
-                session.test_requests.append(new_req)
-                existing = new_req
-
-            if existing is None:
-                system_texts.append(f"[检查结果] {test_type}: 尚未完成（需要先申请检查）")
-                continue
+    try:
+        await get_message_writer().submit(messages, stats)
+        logger.debug(
+            "对话消息已提交保存",
+            session_id=session_id,
+            latency_ms=latency_ms,
+            finish_reason=finish_reason,
+        )
+    except Exception as e:
+        logger.error(
+            "保存对话消息失败",
+            session_id=session_id,
+            error=str(e),
+        )
+
+
+async def run_generation(
+    stream: ResumableStream,
+    relay: ChatStreamRelay,
+    ticket: Ticket,
+    turn: SessionTurn,
+    session_id: int,
+    case_id: int,
+    user_message: str,
+) -> None:
+    """在后台完成一次生成：排队、转发增量到可恢复流、结束后保存并释放会话占用。
 
-            system_texts.append(format_test_result_text(existing.test_name, existing.result or {}))
-
-        # Persist system message for replay.
-        if system_texts:
-            system_content = "\n\n".join(system_texts)
-            db.add(
-                Message(
-                    session_id=data.session_id,
-                    role="system",
-                    content=system_content,
-                    tokens=estimate_tokens(system_content),
-                    latency_ms=0,
-                )
+    与 HTTP 连接解耦：客户端断线重连期间生成继续进行，
+    只有无人订阅超过 CHAT_RESUME_GRACE 时才中止上游（部分回答按 truncated 保存）。
+    被同一会话的新一轮对话取代（cancel_replace）时任务被取消，同样按 truncated 保存。
+    每次上游生成的延迟分解（见 generation_stats）随回答一起保存。
+    """
+    admission = get_admission()
+    start_time = time.time()
+    user_tokens = count_tokens(user_message)
+    send_done = False
+    task = asyncio.current_task()
+    if task is not None:
+        turn.set_cancel(task.cancel)
+
+    try:
+        # 排队期间推送当前位置（前端据此展示“排队中”）
+        async for position in admission.wait(ticket):
+            stream.publish({"queued": True, "position": position, "done": False})
+        start_time = time.time()
+        if ticket.admitted_at is not None:
+            relay.timing.queue_wait = ticket.admitted_at - ticket.enqueued_at
+        if await stream.is_abandoned():
+            return
+
+        async for content in relay.deltas():
+            stream.publish_content(content)
+
+        if relay.error is not None:
+            stream.publish({"error": relay.error})
+            record_generation(relay.timing, session_id, case_id, None, relay.usage)
+            return
+        if relay.disconnected:
+            # 客户端已放弃：部分回答在 finally 中保存
+            return
+
+        # 生成已完整结束，不再允许被取代（避免丢失完整回答）
+        turn.set_cancel(None)
+        # 流式结束，发送完成信号
+        latency_ms = int((time.time() - start_time) * 1000)
+        stream.publish({"content": "", "done": True, "latency_ms": latency_ms})
+        # 落库：用户消息和助手回复提交到写入队列（不等待数据库往返）
+        await save_chat_turn(
+            session_id,
+            user_message,
+            user_tokens,
+            relay.content,
+            latency_ms,
+            relay.finish_reason,
+            record_generation(relay.timing, session_id, case_id, relay.finish_reason, relay.usage),
+            relay.completion_tokens,
+        )
+        send_done = True
+    except AdmissionTimeoutError:
+        stream.publish({"error": "排队超时，请稍后重试"})
+    except asyncio.CancelledError:
+        # 被新一轮对话取代：以 truncated 结束本轮，客户端保留已收到的部分回答
+        stream.publish({"content": "", "done": True, "truncated": True})
+        send_done = True
+        raise
+    finally:
+        turn.set_cancel(None)
+        # LLM 调用结束（含放弃）立即中止上游并归还名额
+        relay.abort()
+        admission.release(ticket)
+        if relay.truncated:
+            await save_chat_turn(
+                session_id,
+                user_message,
+                user_tokens,
+                relay.content,
+                int((time.time() - start_time) * 1000),
+                FINISH_TRUNCATED,
+                record_generation(relay.timing, session_id, case_id, FINISH_TRUNCATED, relay.usage),
+                relay.completion_tokens,
             )
+        stream.finish(send_done=send_done)
+        # 消息提交到写入队列后再释放：下一轮加载历史时可以读到本轮
+        await turn.release()
+
+
+def stream_response(
+    request: Request,
+    stream: ResumableStream,
+    last_event_id: int = 0,
+) -> StreamingResponse:
+    """以当前请求订阅可恢复流。"""
+    return sse_response(
+        stream.subscribe(request.is_disconnected, last_event_id),
+        headers={"X-Stream-Id": stream.stream_id},
+    )
+
+
+@router.post("/")
+@limiter.limit("20/minute")
+async def chat_stream(
+    request: Request,
+    data: ChatRequest,
+    current_user: StreamUser,
+    idempotency_key: Annotated[
+        str | None, Header(alias="Idempotency-Key", min_length=1, max_length=255)
+    ] = None,
+) -> StreamingResponse:
+    """SSE 流式对话接口。
+
+    学生（医生角色）发送问诊消息，LLM（病人角色）流式返回回答。
+    限流：每用户每分钟最多 20 次请求。
+
+    数据库连接只在准备阶段短暂持有：所有读写在开始流式生成前完成并归还连接池，
+    生成结束后的消息交给写入队列批量落库，避免长时间的 vLLM 流占满连接池。
+
+    携带 Idempotency-Key 时，TTL 内的重复请求回放同一次生成（进行中则挂到同一个流上），
+    不会再次调用 LLM 或重复保存消息。
+
+    Args:
+        request: FastAPI Request 对象（限流需要）
+        data: 聊天请求（session_id, message）
+        current_user: 当前用户
+        idempotency_key: 可选幂等键（客户端为每条消息生成）
+
+    Returns:
+        StreamingResponse: SSE 流式响应
+
+    Raises:
+        HTTPException: 403 如果用户无权访问会话
+        HTTPException: 404 如果会话不存在
+        HTTPException: 400 如果会话已结束
+        HTTPException: 409 如果相同请求仍在准备中且等待超时
+        HTTPException: 422 如果幂等键已用于不同的消息
+        HTTPException: 503 如果 LLM 等待队列已满
+    """
+    claim = await idempotency_store.claim(
+        current_user.id,
+        idempotency_key,
+        request_fingerprint(data.session_id, data.message),
+    )
+    if claim.replay is not None:
+        return stream_response(request, claim.replay)
+    try:
+        return await start_chat_turn(request, data, current_user.id, claim)
+    finally:
+        # 未产生流（异常或无需生成）时释放幂等键，重复请求按新请求处理
+        claim.release()
 
-        await db.commit()
 
-        async def intent_generator() -> AsyncGenerator[str, None]:
-            yield f"data: {json.dumps({'content': ack, 'done': False}, ensure_ascii=False)}\n\n"
-            if system_texts:
-                system_chunk = {
-                    "role": "system",
-                    "content": system_content,
-                    "done": False,
-                }
-                yield (f"data: {json.dumps(system_chunk, ensure_ascii=False)}\n\n")
-            done_chunk = {"content": "", "done": True, "latency_ms": 0}
-            yield (f"data: {json.dumps(done_chunk, ensure_ascii=False)}\n\n")
-            yield "data: [DONE]\n\n"
-
-        return StreamingResponse(
-            intent_generator(),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no",
-            },
+async def start_chat_turn(
+    request: Request,
+    data: ChatRequest,
+    user_id: int,
+    claim: IdempotencyClaim,
+) -> StreamingResponse:
+    """处理一轮对话：校验会话并占用会话，再交给 dispatch_chat_turn。
+
+    Raises:
+        HTTPException: 409 如果会话已有一轮对话在进行（按 CHAT_SESSION_BUSY_POLICY）
+    """
+    async with AsyncSessionLocal() as db:
+        # 1-3. 查询会话（包含病例），并做权限与状态检查
+        session = await load_chat_session(db, data.session_id, user_id)
+
+    # 同一会话同时只进行一轮对话：按策略拒绝、等待或取代上一轮
+    try:
+        turn = await get_session_guard().acquire(data.session_id)
+    except SessionBusyError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e),
+        ) from e
+    try:
+        return await dispatch_chat_turn(request, data, user_id, claim, session, turn)
+    except BaseException:
+        await turn.release()
+        raise
+
+
+async def dispatch_chat_turn(
+    request: Request,
+    data: ChatRequest,
+    user_id: int,
+    claim: IdempotencyClaim,
+    session: Session,
+    turn: SessionTurn,
+) -> StreamingResponse:
+    """准备提示词并启动生成（或确定性回复）。
+
+    产生的可恢复流登记到幂等键上（claim.resolve）；会话占用在确定性回复后释放，
+    LLM 生成时交给后台生成任务，在回答保存后释放。
+    """
+    compiled = get_compiled_case(session.case)
+    async with AsyncSessionLocal() as db:
+        # 3.5 检查意图（下检查单/要结果）：用确定性逻辑处理，保证可审计和稳定体验
+        intent = extract_test_intent(data.message, compiled.test_types)
+        if intent is not None:
+            ack, system_content = await apply_test_intent(
+                db, session, compiled, data.message, intent
+            )
+        else:
+            history = await load_history_window(db, session.id, settings.CHAT_HISTORY_WINDOW)
+            summary = await get_summary(db, session.id)
+    # 此处会话已关闭，连接已归还连接池
+
+    if intent is not None:
+        # 确定性回复同样写成（已结束的）流，重复请求可回放
+        stream = stream_registry.create(user_id, data.session_id)
+        stream.publish_content(ack)
+        if system_content:
+            system_chunk = {
+                "role": "system",
+                "content": system_content,
+                "done": False,
+            }
+            stream.publish(system_chunk)
+        stream.publish({"content": "", "done": True, "latency_ms": 0})
+        stream.finish()
+        claim.resolve(stream)
+        await turn.release()
+        return stream_response(request, stream)
+
+    # 4. 构建消息：摘要之后的原文历史按 token 预算打包
+    #    （为回复至少预留 CHAT_RESERVED_OUTPUT_TOKENS）
+    raw_history = unsummarized_history(history, summary)
+    base_tokens = count_message_tokens(build_messages(compiled, [], data.message, summary))
+    history_budget = (
+        settings.LLM_MAX_CONTEXT_LEN - settings.CHAT_RESERVED_OUTPUT_TOKENS - base_tokens
+    )
+    packed_history = pack_history(raw_history, history_budget)
+    if len(packed_history) < len(raw_history):
+        logger.debug(
+            "历史消息超出预算，已截断",
+            session_id=data.session_id,
+            loaded=len(raw_history),
+            kept=len(packed_history),
+            history_budget=history_budget,
         )
 
-    # 4. 构建消息
-    history = sorted(session.messages, key=lambda m: m.created_at)
-    messages = build_messages(case, history, data.message)
-    prompt_tokens = estimate_prompt_tokens(messages)
+    # 较早的问答在后台压缩为摘要，下一轮起提示词大小保持稳定
+    summary_up_to = plan_summary_update(raw_history, packed_history, summary)
+    if summary_up_to is not None:
+        schedule_summary_update(data.session_id, summary_up_to)
+
+    messages = build_messages(compiled, packed_history, data.message, summary)
+    prompt_tokens = base_tokens + sum(history_row_tokens(row) for row in packed_history)
     available_tokens = settings.LLM_MAX_CONTEXT_LEN - prompt_tokens
     if available_tokens < 16:
         logger.warning(
@@ -405,129 +597,83 @@ async def chat_stream(
             max_context=settings.LLM_MAX_CONTEXT_LEN,
         )
 
-        async def over_limit_generator() -> AsyncGenerator[str, None]:
-            yield "data: " + json.dumps({"error": "上下文过长，请结束会话或减少消息"}) + "\n\n"
-            yield "data: [DONE]\n\n"
-
-        return StreamingResponse(
-            over_limit_generator(),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no",
-            },
-        )
+        async def over_limit_generator() -> AsyncGenerator[bytes, None]:
+            yield sse_frame({"error": "上下文过长，请结束会话或减少消息"})
+            yield DONE_FRAME
+
+        await turn.release()
+        return sse_response(over_limit_generator())
     max_tokens = min(settings.LLM_MAX_TOKENS, available_tokens)
 
-    # 5. 创建 SSE 生成器
-    async def event_generator() -> AsyncGenerator[str, None]:
-        full_response = ""
-        start_time = time.time()
-        user_tokens = estimate_tokens(data.message)
-
-        try:
-            async with httpx.AsyncClient(timeout=settings.LLM_TIMEOUT) as client:
-                async with client.stream(
-                    "POST",
-                    f"{settings.LLM_BASE_URL}/v1/chat/completions",
-                    json={
-                        "model": settings.LLM_MODEL,
-                        "messages": messages,
-                        "stream": True,
-                        "temperature": settings.LLM_TEMPERATURE,
-                        "max_tokens": max_tokens,
-                    },
-                ) as response:
-                    if response.status_code != 200:
-                        error_text = await response.aread()
-                        err_msg = f"LLM error: {error_text.decode()}"
-                        yield f"data: {json.dumps({'error': err_msg})}\n\n"
-                        return
-
-                    async for line in response.aiter_lines():
-                        if not line:
-                            continue
-
-                        if line.startswith("data: "):
-                            data_str = line[6:]
-
-                            if data_str.strip() == "[DONE]":
-                                break
-
-                            try:
-                                chunk = json.loads(data_str)
-                                content = (
-                                    chunk.get("choices", [{}])[0]
-                                    .get("delta", {})
-                                    .get("content", "")
-                                )
-                                if content:
-                                    full_response += content
-                                    chunk_data = {"content": content, "done": False}
-                                    yield f"data: {json.dumps(chunk_data)}\n\n"
-                            except json.JSONDecodeError:
-                                continue
-
-        except httpx.TimeoutException:
-            yield f"data: {json.dumps({'error': 'LLM request timeout'})}\n\n"
-            return
-        except httpx.RequestError as e:
-            yield f"data: {json.dumps({'error': f'LLM connection error: {str(e)}'})}\n\n"
-            return
+    # 5. 准入控制：有名额立即放行，否则排队；队列已满直接 503
+    admission = get_admission()
+    try:
+        ticket = admission.reserve(user_id)
+    except AdmissionRejectedError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="LLM 服务繁忙，请稍后重试",
+            headers={"Retry-After": str(e.retry_after)},
+        ) from e
+
+    # 6. 生成在后台任务中进行，结果写入可恢复流；当前响应只是它的第一个订阅者
+    payload = {
+        "model": settings.LLM_MODEL,
+        "messages": messages,
+        "stream": True,
+        "temperature": settings.LLM_TEMPERATURE,
+        "max_tokens": max_tokens,
+    }
+    if settings.LLM_STREAM_INCLUDE_USAGE:
+        # 最后一个数据块携带 vLLM 统计的 token 用量
+        payload["stream_options"] = {"include_usage": True}
+    stream = stream_registry.create(user_id, data.session_id)
+    relay = ChatStreamRelay(stream.is_abandoned, payload, affinity_key=compiled.prefix_hash)
+    # 首个事件告知流ID，断线后凭它和 Last-Event-ID 重连
+    stream.publish({"stream_id": stream.stream_id, "done": False})
+    spawn_background(
+        run_generation(stream, relay, ticket, turn, data.session_id, session.case_id, data.message)
+    )
+    claim.resolve(stream)
 
-        # 6. 流式结束，发送完成信号
-        latency_ms = int((time.time() - start_time) * 1000)
-        yield f"data: {json.dumps({'content': '', 'done': True, 'latency_ms': latency_ms})}\n\n"
-
-        # 7. 落库：保存用户消息和助手回复（尽量不丢用户输入）
-        from src.apps.api.dependencies import AsyncSessionLocal
-
-        async with AsyncSessionLocal() as save_db:
-            try:
-                save_db.add(
-                    Message(
-                        session_id=data.session_id,
-                        role="user",
-                        content=data.message,
-                        tokens=user_tokens,
-                    )
-                )
-
-                if full_response:
-                    save_db.add(
-                        Message(
-                            session_id=data.session_id,
-                            role="assistant",
-                            content=full_response,
-                            tokens=estimate_tokens(full_response),
-                            latency_ms=latency_ms,
-                        )
-                    )
-
-                await save_db.commit()
-                logger.debug(
-                    "对话消息已保存",
-                    session_id=data.session_id,
-                    latency_ms=latency_ms,
-                )
-            except Exception as e:
-                await save_db.rollback()
-                logger.error(
-                    "保存对话消息失败",
-                    session_id=data.session_id,
-                    error=str(e),
-                )
-
-        # 发送最终的 [DONE] 信号
-        yield "data: [DONE]\n\n"
+    return stream_response(request, stream)
 
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",  # 禁用 Nginx 缓冲
-        },
+
+@router.get("/streams/{stream_id}")
+@limiter.limit("60/minute")
+async def resume_stream(
+    request: Request,
+    stream_id: str,
+    current_user: StreamUser,
+    last_event_id: Annotated[int, Header(alias="Last-Event-ID", ge=0)] = 0,
+) -> StreamingResponse:
+    """断线重连：从 Last-Event-ID 之后继续接收仍在进行（或刚结束）的生成。
+
+    Args:
+        request: FastAPI Request 对象（限流、断开检测需要）
+        stream_id: 流ID（对话流首个事件中的 stream_id）
+        current_user: 当前用户
+        last_event_id: 客户端已收到的最后一个事件序号
+
+    Returns:
+        StreamingResponse: SSE 流式响应
+
+    Raises:
+        HTTPException: 404 如果流不存在、已过期或不属于当前用户
+    """
+    stream = stream_registry.get(stream_id, current_user.id)
+    if stream is None:
+        stream_stats.resume_misses += 1
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Stream not found or expired",
+        )
+    stream_stats.resumed += 1
+    logger.info(
+        "客户端重连对话流",
+        stream_id=stream_id,
+        session_id=stream.session_id,
+        last_event_id=last_event_id,
+        stream_last_event_id=stream.last_event_id,
     )
+    return stream_response(request, stream, last_event_id)
@@ -1,10 +1,11 @@
 from datetime import datetime
 from typing import Literal
 
-from fastapi import APIRouter, HTTPException, Query, status
+from fastapi import APIRouter, HTTPException, Query, Response, status
 from sqlalchemy import func, select
 from sqlalchemy.orm import selectinload
 
+from src.apps.api.config import settings
 from src.apps.api.dependencies import CurrentUser, DbSession
 from src.apps.api.logging_config import logger
 from src.apps.api.models import Case, Message, Score, Session, TestRequest
@@ -21,6 +22,7 @@ from src.apps.api.schemas.sessions import (
     SessionDetail,
     SessionListItem,
     SessionListResponse,
+    SessionProgress,
     SessionResponse,
 )
 from src.apps.api.schemas.tests import (
@@ -29,113 +31,73 @@ from src.apps.api.schemas.tests import (
     TestRequestListResponse,
     TestRequestResponse,
 )
-from src.apps.api.services.case_generation import generate_random_case_payload
+from src.apps.api.services.admission import AdmissionRejectedError, get_admission
+from src.apps.api.services.case_pool import get_case_pool
+from src.apps.api.services.message_writer import get_message_writer
 from src.apps.api.services.scoring import ScoringService
+from src.apps.api.services.session_jobs import (
+    SESSION_FAILED,
+    SESSION_PENDING,
+    STAGE_FAILED,
+    STAGE_GENERATING,
+    STAGE_READY,
+    mark_failed,
+    session_jobs,
+)
 
 router = APIRouter()
 
 
-@router.post("/", response_model=SessionResponse, status_code=status.HTTP_201_CREATED)
+@router.post(
+    "/",
+    response_model=SessionResponse,
+    status_code=status.HTTP_201_CREATED,
+    responses={
+        status.HTTP_202_ACCEPTED: {
+            "model": SessionResponse,
+            "description": "随机病例生成中（status=pending），轮询进度接口",
+        }
+    },
+)
 async def create_session(
     data: SessionCreate,
     db: DbSession,
     current_user: CurrentUser,
+    response: Response,
 ) -> SessionResponse:
     """创建新的问诊会话。
 
+    随机模式优先从病例池领取病例（201）；池为空时创建待定会话（status=pending）并立即返回 202，
+    病例在后台生成，客户端轮询 GET /api/sessions/{session_id}/progress 直到 ready。
+
     Args:
         data: 创建会话请求数据
         db: 数据库会话
         current_user: 当前用户
+        response: 响应对象（用于设置 202 状态码）
 
     Returns:
         新创建的会话信息
 
     Raises:
         HTTPException: 404 如果病例不存在或已禁用
+        HTTPException: 503 如果 LLM 繁忙（病例池为空且生成排队已满）
     """
+    ticket = None
     # 模式分流：fixed / random
     if data.mode == "random":
-        payload, meta = await generate_random_case_payload()
-
-        # normalize to avoid UnboundLocal in case of early validation failures
-        recommended_tests = payload.get("recommended_tests")
-
-        # 基础校验（尽量轻量，失败则返回 502）
-        required_fields = [
-            "title",
-            "difficulty",
-            "department",
-            "patient_info",
-            "chief_complaint",
-            "present_illness",
-            "past_history",
-            "physical_exam",
-            "available_tests",
-            "standard_diagnosis",
-            "key_points",
-        ]
-        missing = [f for f in required_fields if f not in payload]
-        if missing:
-            logger.warning(
-                "LLM 生成病例缺少字段",
-                missing=missing,
-                meta=meta,
-            )
-            raise HTTPException(
-                status_code=status.HTTP_502_BAD_GATEWAY,
-                detail=f"LLM 生成病例缺少字段: {', '.join(missing)}",
-            )
-
-        # recommended_tests 若存在，应与 available_tests.type 保持一致，否则检查申请会失败
-        available_test_types = {
-            str(t.get("type"))
-            for t in (payload.get("available_tests") or [])
-            if isinstance(t, dict) and t.get("type")
-        }
-        if recommended_tests is not None:
-            if not isinstance(recommended_tests, list):
-                recommended_tests = []
-            else:
-                # 过滤非字符串项
-                recommended_tests = [x for x in recommended_tests if isinstance(x, str) and x]
-            # 自动过滤不在 available_tests 中的项（小模型常产生不一致）
-            unknown = [t for t in recommended_tests if t not in available_test_types]
-            if unknown:
-                logger.info(
-                    "自动过滤不一致的 recommended_tests",
-                    unknown=unknown,
-                    available=available_test_types,
-                )
-                recommended_tests = [t for t in recommended_tests if t in available_test_types]
-
-        case = Case(
-            title=str(payload["title"]),
-            difficulty=str(payload["difficulty"]),
-            department=str(payload["department"]),
-            patient_info=payload["patient_info"],
-            chief_complaint=str(payload["chief_complaint"]),
-            present_illness=str(payload["present_illness"]),
-            past_history=payload["past_history"],
-            physical_exam=payload["physical_exam"],
-            available_tests=payload["available_tests"],
-            standard_diagnosis=payload["standard_diagnosis"],
-            key_points=payload["key_points"],
-            recommended_tests=recommended_tests,
-            marriage_childbearing_history=str(
-                payload.get("marriage_childbearing_history", "未提供")
-            ),
-            family_history=str(payload.get("family_history", "未提供")),
-            case_number=payload.get("case_number"),
-            is_active=True,
-            source="random",
-            generation_meta=meta,
-        )
-        db.add(case)
-        await db.commit()
-        await db.refresh(case)
-
-        case_id = case.id
+        # 优先从病例池领取（与会话插入同一事务）
+        case_id = await get_case_pool().claim(db)
+        if case_id is None:
+            # 池为空：先申请准入（排队已满时直接返回 503），再创建待定会话
+            try:
+                ticket = get_admission().reserve(current_user.id)
+            except AdmissionRejectedError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="LLM 服务繁忙，请稍后重试",
+                    headers={"Retry-After": str(e.retry_after)},
+                ) from e
     else:
         if data.case_id is None:
             raise HTTPException(
@@ -160,11 +122,23 @@ async def create_session(
     session = Session(
         user_id=current_user.id,
         case_id=case_id,
-        status="in_progress",
+        status="in_progress" if ticket is None else SESSION_PENDING,
     )
-    db.add(session)
-    await db.commit()
-    await db.refresh(session)
+    try:
+        db.add(session)
+        await db.commit()
+        await db.refresh(session)
+    except BaseException:
+        if ticket is not None:
+            get_admission().release(ticket)
+        raise
+
+    if ticket is not None:
+        session_jobs.spawn(session.id, current_user.id, ticket)
+        response.status_code = status.HTTP_202_ACCEPTED
+    elif data.mode == "random":
+        # 领取提交后唤醒补充任务（提交前补充任务仍会把该病例计入池中）
+        get_case_pool().wake()
 
     return SessionResponse(
         id=session.id,
@@ -174,6 +148,58 @@ async def create_session(
     )
 
 
+@router.get("/{session_id}/progress", response_model=SessionProgress)
+async def get_session_progress(
+    session_id: int,
+    db: DbSession,
+    current_user: CurrentUser,
+) -> SessionProgress:
+    """查询随机会话的病例生成进度（202 创建的会话轮询该接口直到 ready / failed）。
+
+    Args:
+        session_id: 会话ID
+        db: 数据库会话
+        current_user: 当前用户
+
+    Returns:
+        生成阶段、排队位置，以及就绪后的病例ID或失败原因
+
+    Raises:
+        HTTPException: 404 如果会话不存在
+        HTTPException: 403 如果用户无权访问
+    """
+    job = session_jobs.get(session_id, current_user.id)
+    if job is not None:
+        return SessionProgress(**job.progress())
+
+    # 任务不在本进程（其他 worker 或已过期）：按会话状态推断
+    session = await db.get(Session, session_id)
+    if session is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found",
+        )
+    if session.user_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied",
+        )
+
+    if session.status == SESSION_PENDING:
+        # 生成任务可能在其他 worker 上；超过 SESSION_JOB_STALE_AFTER 仍未完成视为随进程退出而丢失
+        if not await mark_failed(session_id, older_than=settings.SESSION_JOB_STALE_AFTER):
+            return SessionProgress(session_id=session_id, stage=STAGE_GENERATING)
+        logger.warning("随机会话病例生成中断", session_id=session_id)
+        return SessionProgress(
+            session_id=session_id, stage=STAGE_FAILED, error="病例生成中断，请重新创建"
+        )
+    if session.status == SESSION_FAILED:
+        return SessionProgress(
+            session_id=session_id, stage=STAGE_FAILED, error="病例生成失败，请重新创建"
+        )
+    return SessionProgress(session_id=session_id, stage=STAGE_READY, case_id=session.case_id)
+
+
 @router.get("/", response_model=SessionListResponse)
 async def list_sessions(
     db: DbSession,
@@ -194,8 +220,10 @@ async def list_sessions(
     Returns:
         会话列表（分页）
     """
-    # 构建基础查询
-    base_query = select(Session).where(Session.user_id == current_user.id)
+    # 构建基础查询（不含尚无病例的随机会话：生成中或生成失败）
+    base_query = select(Session).where(
+        Session.user_id == current_user.id, Session.case_id.is_not(None)
+    )
 
     if status_filter:
         base_query = base_query.where(Session.status == status_filter)
@@ -270,6 +298,9 @@ async def get_session(
         HTTPException: 404 如果会话不存在
         HTTPException: 403 如果用户无权访问
     """
+    # 写入队列中的消息先落库，保证返回完整的对话记录
+    await get_message_writer().wait_persisted(session_id)
+
     # 查询会话（包含病例和消息）
     result = await db.execute(
         select(Session)
@@ -300,8 +331,8 @@ async def get_session(
     return SessionDetail(
         id=session.id,
         case_id=session.case_id,
-        case_title=session.case.title,
-        case_difficulty=session.case.difficulty,
+        case_title=session.case.title if session.case else None,
+        case_difficulty=session.case.difficulty if session.case else None,
         status=session.status,
         submitted_diagnosis=session.submitted_diagnosis,
         started_at=session.started_at,
@@ -313,6 +344,7 @@ async def get_session(
                 content=msg.content,
                 tokens=msg.tokens,
                 latency_ms=msg.latency_ms,
+                finish_reason=msg.finish_reason,
                 created_at=msg.created_at,
             )
             for msg in sorted_messages
@@ -520,6 +552,9 @@ async def submit_diagnosis(
         HTTPException: 400 如果会话已提交
         HTTPException: 409 如果已有评分记录
     """
+    # 评分基于完整对话：写入队列中的消息先落库
+    await get_message_writer().wait_persisted(session_id)
+
     # 查询会话（包含病例、消息、检查申请）
     result = await db.execute(
         select(Session)
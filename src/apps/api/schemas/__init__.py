@@ -16,6 +16,7 @@ from src.apps.api.schemas.sessions import (
     SessionDetail,
     SessionListItem,
     SessionListResponse,
+    SessionProgress,
     SessionResponse,
 )
 from src.apps.api.schemas.tests import (
@@ -39,6 +40,7 @@ __all__ = [
     "SessionListItem",
     "SessionListResponse",
     "SessionDetail",
+    "SessionProgress",
     "MessageItem",
     "ChatRequest",
     "ChatChunk",
@@ -25,13 +25,25 @@ class SessionResponse(BaseModel):
     """创建会话响应。"""
 
     id: int = Field(..., description="会话ID")
-    case_id: int = Field(..., description="病例ID")
-    status: str = Field(..., description="会话状态")
+    case_id: int | None = Field(..., description="病例ID（pending 时为空）")
+    status: str = Field(..., description="会话状态（随机病例生成中为 pending）")
     started_at: datetime = Field(..., description="开始时间")
 
     model_config = {"from_attributes": True}
 
 
+class SessionProgress(BaseModel):
+    """随机会话的病例生成进度。"""
+
+    session_id: int = Field(..., description="会话ID")
+    stage: Literal["queued", "generating", "validating", "ready", "failed"] = Field(
+        ..., description="阶段"
+    )
+    position: int | None = Field(None, description="排队位置（queued 时）")
+    case_id: int | None = Field(None, description="病例ID（ready 时）")
+    error: str | None = Field(None, description="失败原因（failed 时）")
+
+
 class SessionListItem(BaseModel):
     """会话列表项（用于历史列表）。"""
 
@@ -53,6 +65,9 @@ class MessageItem(BaseModel):
     content: str = Field(..., description="消息内容")
     tokens: int | None = Field(None, description="token数量")
     latency_ms: int | None = Field(None, description="响应延迟（毫秒）")
+    finish_reason: str | None = Field(
+        None, description="结束原因：stop/length/truncated（客户端中途断开，回复不完整）"
+    )
     created_at: datetime = Field(..., description="创建时间")
 
     model_config = {"from_attributes": True}
@@ -62,9 +77,9 @@ class SessionDetail(BaseModel):
     """会话详情（包含消息历史）。"""
 
     id: int = Field(..., description="会话ID")
-    case_id: int = Field(..., description="病例ID")
-    case_title: str = Field(..., description="病例标题")
-    case_difficulty: str = Field(..., description="病例难度")
+    case_id: int | None = Field(..., description="病例ID（病例生成中或失败时为空）")
+    case_title: str | None = Field(..., description="病例标题")
+    case_difficulty: str | None = Field(..., description="病例难度")
     status: str = Field(..., description="会话状态")
     submitted_diagnosis: str | None = Field(None, description="提交的诊断")
     started_at: datetime = Field(..., description="开始时间")
@@ -0,0 +1,253 @@
+"""LLM 准入控制与公平排队。
+
+整班同时提问时，让所有请求直接打到 vLLM 只会让每个请求一起变慢直至超时。这里在
+LLM 前增加准入控制：
+- 同时在途的 LLM 请求数不超过 LLM_MAX_IN_FLIGHT_PER_BACKEND × 健康副本数；
+  放行后由副本池选择后端，亲和路由不会选择已达单副本上限的副本（见 llm_pool），
+  因此每个副本的在途数同样不超过 LLM_MAX_IN_FLIGHT_PER_BACKEND
+- 所有 LLM 调用都经过准入：对话、病例生成、病例池补充与后台摘要
+- 超出的请求进入有界等待队列，按用户轮转出队（每个用户一个 FIFO，用户之间轮询），
+  单个用户的连续提问不会挤占其他人的位置
+- 队列已满（总量或单用户上限）时立即拒绝，由路由返回 503 + Retry-After
+- 排队超过 LLM_QUEUE_TIMEOUT 视为超时
+
+所有状态只在事件循环线程中读写，无需加锁。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from typing import Any
+
+from src.apps.api.config import settings
+from src.apps.api.logging_config import logger
+from src.apps.api.services.llm_client import get_llm_client
+
+
+class AdmissionRejectedError(Exception):
+    """等待队列已满，请求被拒绝。"""
+
+    def __init__(self, retry_after: int) -> None:
+        super().__init__("LLM 服务繁忙，请稍后重试")
+        self.retry_after = retry_after
+
+
+class AdmissionTimeoutError(Exception):
+    """排队超时。"""
+
+
+class Ticket:
+    """一次 LLM 调用的准入凭证。"""
+
+    __slots__ = ("user_id", "enqueued_at", "admitted_at", "granted", "released", "_event")
+
+    def __init__(self, user_id: int) -> None:
+        self.user_id = user_id
+        self.enqueued_at = time.monotonic()
+        self.admitted_at: float | None = None
+        self.granted = False
+        self.released = False
+        self._event = asyncio.Event()
+
+    def _grant(self) -> None:
+        self.granted = True
+        self._event.set()
+
+
+class AdmissionController:
+    """进程级准入控制器。
+
+    Args:
+        capacity: 返回当前允许的最大在途请求数（随健康副本数变化）
+    """
+
+    def __init__(self, capacity: Callable[[], int]) -> None:
+        self._capacity = capacity
+        self._queues: OrderedDict[int, deque[Ticket]] = OrderedDict()
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        # 单次 LLM 调用耗时的指数滑动平均（秒），用于估算 Retry-After
+        self._service_time = 5.0
+
+    @property
+    def capacity(self) -> int:
+        return max(1, self._capacity())
+
+    def reserve(self, user_id: int) -> Ticket:
+        """申请准入：有空闲名额时立即放行，否则入队。
+
+        Raises:
+            AdmissionRejectedError: 等待队列已满
+        """
+        ticket = Ticket(user_id)
+        if not self._queues and self.in_flight < self.capacity:
+            self._admit(ticket)
+            return ticket
+
+        user_queue = self._queues.get(user_id)
+        if self.queued >= settings.LLM_QUEUE_MAX or (
+            user_queue is not None and len(user_queue) >= settings.LLM_QUEUE_MAX_PER_USER
+        ):
+            self.rejected += 1
+            retry_after = self.retry_after()
+            logger.warning(
+                "LLM 等待队列已满，拒绝请求",
+                user_id=user_id,
+                queued=self.queued,
+                in_flight=self.in_flight,
+                retry_after=retry_after,
+            )
+            raise AdmissionRejectedError(retry_after)
+
+        if user_queue is None:
+            user_queue = self._queues[user_id] = deque()
+        user_queue.append(ticket)
+        self.queued += 1
+        # 副本恢复后容量可能已增大
+        self._dispatch()
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        """排队位置（从 1 开始，按轮转出队顺序计算）；已放行返回 0。"""
+        if ticket.granted:
+            return 0
+        user_queue = self._queues.get(ticket.user_id)
+        if user_queue is None or ticket not in user_queue:
+            return 0
+        # 第 rank 轮出队；本轮中排在前面的用户各领先一个
+        rank = user_queue.index(ticket)
+        ahead = 0
+        before_me = True
+        for user_id, queue in self._queues.items():
+            if user_id == ticket.user_id:
+                before_me = False
+                ahead += rank
+                continue
+            ahead += min(len(queue), rank + 1 if before_me else rank)
+        return ahead + 1
+
+    async def wait(self, ticket: Ticket) -> AsyncIterator[int]:
+        """等待放行，排队期间周期性产出当前排队位置。
+
+        Raises:
+            AdmissionTimeoutError: 超过 LLM_QUEUE_TIMEOUT 仍未放行
+        """
+        deadline = ticket.enqueued_at + settings.LLM_QUEUE_TIMEOUT
+        last_position = -1
+        while not ticket.granted:
+            self._dispatch()
+            if ticket.granted:
+                break
+            position = self.position(ticket)
+            if position != last_position:
+                last_position = position
+                yield position
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.timeouts += 1
+                self.release(ticket)
+                raise AdmissionTimeoutError
+            try:
+                await asyncio.wait_for(
+                    ticket._event.wait(),
+                    timeout=min(remaining, settings.LLM_QUEUE_POSITION_INTERVAL),
+                )
+            except TimeoutError:
+                continue
+
+    def release(self, ticket: Ticket) -> None:
+        """归还名额或撤出队列（幂等）。"""
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.granted:
+            self.in_flight -= 1
+            elapsed = time.monotonic() - (ticket.admitted_at or ticket.enqueued_at)
+            self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+        else:
+            user_queue = self._queues.get(ticket.user_id)
+            if user_queue is not None and ticket in user_queue:
+                user_queue.remove(ticket)
+                self.queued -= 1
+                if not user_queue:
+                    del self._queues[ticket.user_id]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_id: int) -> AsyncIterator[None]:
+        """非流式调用的准入：等待名额（不产出排队位置），结束后归还。"""
+        ticket = self.reserve(user_id)
+        try:
+            async for _position in self.wait(ticket):
+                pass
+            yield
+        finally:
+            self.release(ticket)
+
+    def retry_after(self) -> int:
+        """估算客户端重试前应等待的秒数。"""
+        waves = (self.queued + self.in_flight) / self.capacity
+        return max(1, math.ceil(waves * self._service_time))
+
+    def _admit(self, ticket: Ticket) -> None:
+        self.in_flight += 1
+        self.admitted += 1
+        ticket.admitted_at = time.monotonic()
+        ticket._grant()
+
+    def _dispatch(self) -> None:
+        # 按用户轮转：取队首用户的第一个请求，该用户若仍有请求则移到队尾
+        while self._queues and self.in_flight < self.capacity:
+            user_id, user_queue = next(iter(self._queues.items()))
+            ticket = user_queue.popleft()
+            self.queued -= 1
+            if user_queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            self._admit(ticket)
+
+    def snapshot(self) -> dict[str, Any]:
+        """导出准入统计。"""
+        return {
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "queued_users": len(self._queues),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
+
+
+def _default_capacity() -> int:
+    healthy = sum(1 for backend in get_llm_client().pool.backends if backend.healthy)
+    return settings.LLM_MAX_IN_FLIGHT_PER_BACKEND * max(1, healthy)
+
+
+_admission: AdmissionController | None = None
+
+
+def get_admission() -> AdmissionController:
+    """获取进程级准入控制器。"""
+    global _admission
+    if _admission is None:
+        _admission = AdmissionController(_default_capacity)
+    return _admission
+
+
+__all__ = [
+    "AdmissionController",
+    "AdmissionRejectedError",
+    "AdmissionTimeoutError",
+    "Ticket",
+    "get_admission",
+]
@@ -20,6 +20,25 @@ import httpx
 
 from src.apps.api.config import settings
 from src.apps.api.exceptions import BusinessError
+from src.apps.api.logging_config import logger
+from src.apps.api.models import Case
+from src.apps.api.services.chat_stream import parse_chunk_json, parse_usage
+from src.apps.api.services.json_stream import (
+    ITEM,
+    IncrementalJsonValidator,
+    StreamValidationError,
+)
+from src.apps.api.services.llm_client import get_llm_client
+from src.apps.api.services.metrics import (
+    OUTCOME_CONNECTION_ERROR,
+    OUTCOME_HTTP_ERROR,
+    OUTCOME_INVALID,
+    OUTCOME_OK,
+    OUTCOME_TIMEOUT,
+    llm_requests,
+    llm_tokens,
+)
+from src.apps.api.services.tokenizer import count_message_tokens, count_tokens
 
 CASE_GENERATION_PROMPT_VERSION = "2.0"
 
@@ -143,6 +162,81 @@ _CASE_TEST_TYPES = [
     "ct",
 ]
 
+# 随机病例必须包含的字段（缺失时无法问诊或评分）
+REQUIRED_CASE_FIELDS = (
+    "title",
+    "difficulty",
+    "department",
+    "patient_info",
+    "chief_complaint",
+    "present_illness",
+    "past_history",
+    "physical_exam",
+    "available_tests",
+    "standard_diagnosis",
+    "key_points",
+)
+
+
+_STRING_LIST: dict[str, Any] = {"type": "array", "items": {"type": "string"}}
+_TEST_TYPE: dict[str, Any] = {"type": "string", "enum": _CASE_TEST_TYPES}
+
+
+def _object(properties: dict[str, Any]) -> dict[str, Any]:
+    # 所有字段均为必需
+    return {"type": "object", "properties": properties, "required": list(properties)}
+
+
+# 病例载荷的 JSON Schema（与生成提示词中的字段说明一致），用于 vLLM 引导解码：
+# 解码时直接约束字段、类型与 test_type 取值，输出必然可解析且字段齐全（被 max_tokens 截断除外）
+CASE_JSON_SCHEMA: dict[str, Any] = _object(
+    {
+        "title": {"type": "string"},
+        "difficulty": {"type": "string", "enum": ["easy", "medium", "hard"]},
+        "department": {"type": "string"},
+        "patient_info": _object(
+            {
+                "age": {"type": "integer"},
+                "gender": {"type": "string", "enum": ["male", "female"]},
+                "occupation": {"type": "string"},
+            }
+        ),
+        "chief_complaint": {"type": "string"},
+        "present_illness": {"type": "string"},
+        "past_history": _object(
+            {"diseases": _STRING_LIST, "allergies": _STRING_LIST, "medications": _STRING_LIST}
+        ),
+        "marriage_childbearing_history": {"type": "string"},
+        "family_history": {"type": "string"},
+        "physical_exam": _object(
+            {
+                "visible": _object(
+                    {
+                        "temperature": {"type": "string"},
+                        "pulse": {"type": "string"},
+                        "respiration": {"type": "string"},
+                        "blood_pressure": {"type": "string"},
+                        "general": {"type": "string"},
+                    }
+                ),
+                "on_request": {"type": "object"},
+            }
+        ),
+        "available_tests": {
+            "type": "array",
+            "minItems": 1,
+            "items": _object(
+                {"type": _TEST_TYPE, "name": {"type": "string"}, "result": {"type": "object"}}
+            ),
+        },
+        "standard_diagnosis": _object(
+            {"primary": {"type": "string"}, "differential": _STRING_LIST}
+        ),
+        "key_points": {**_STRING_LIST, "minItems": 1},
+        "recommended_tests": {"type": "array", "items": _TEST_TYPE},
+    }
+)
+
 
 def _extract_json(text: str) -> str:
     """从 LLM 输出中提取 JSON 对象。
@@ -175,32 +269,6 @@ def _extract_json(text: str) -> str:
     return s
 
 
-def _estimate_prompt_tokens(messages: list[dict[str, str]]) -> int:
-    """粗略估算 OpenAI 风格消息的 token 数。
-
-    这里仅需保守上界，用于避免 vLLM 因 `max_tokens` 超出剩余上下文窗口而拒绝请求。
-    """
-
-    # 若可用则使用 tiktoken 做更接近真实值的估算（尽力而为）。
-    try:
-        import tiktoken  # type: ignore
-
-        enc = tiktoken.get_encoding("cl100k_base")
-        total = 0
-        for m in messages:
-            total += len(enc.encode(str(m.get("content", ""))))
-            total += 4
-        return total
-    except Exception:
-        # 回退到启发式估算。
-        total = 0
-        for m in messages:
-            content = str(m.get("content", ""))
-            total += max(1, len(content) // 2)
-            total += 4
-        return total
-
-
 def _build_generation_messages(disease_name: str, case_number: int) -> list[dict[str, str]]:
     system = (
         "你是一个临床医学教学用病例生成器。你的任务是根据指定的疾病名称，"
@@ -248,20 +316,122 @@ def _build_generation_messages(disease_name: str, case_number: int) -> list[dict
     ]
 
 
-async def generate_random_case_payload() -> tuple[dict[str, Any], dict[str, Any]]:
-    """通过 LLM 生成随机病例载荷。
+# 未启用引导解码时，模型常把 test_type 写成中文名称
+_TEST_TYPE_ALIASES = {
+    "血常规": "blood_routine",
+    "全血细胞计数": "blood_routine",
+    "尿常规": "urine_routine",
+    "心电图": "ecg",
+    "胸片": "x_ray",
+    "胸部X光片": "x_ray",
+    "X光": "x_ray",
+    "X 线": "x_ray",
+    "超声": "ultrasound",
+    "B超": "ultrasound",
+    "CT": "ct",
+}
+
+
+def _normalize_unguided(payload: dict[str, Any]) -> None:
+    """未启用引导解码时的解析后归一化（引导解码已由 CASE_JSON_SCHEMA 保证这些约束）。"""
+    # 确保 past_history 为对象。
+    if not isinstance(payload.get("past_history"), dict):
+        payload["past_history"] = {"diseases": [], "allergies": [], "medications": []}
+
+    # 确保 available_tests / recommended_tests 使用允许的 test_type 字符串。
+    if isinstance(payload.get("available_tests"), list):
+        for t in payload["available_tests"]:
+            if not isinstance(t, dict):
+                continue
+            if isinstance(t.get("type"), str) and t["type"] not in _CASE_TEST_TYPES:
+                t["type"] = _TEST_TYPE_ALIASES.get(t["type"], t["type"])
+            # 确保 result 为对象（dict）；某些模型会输出短字符串，这里做包装处理。
+            result = t.get("result")
+            if result is None:
+                t["result"] = {}
+            elif not isinstance(result, dict):
+                t["result"] = {"summary": str(result)}
 
-    从 106 种疾病列表中随机选择一种疾病，再让 LLM 为该疾病生成完整病例。
+    if isinstance(payload.get("recommended_tests"), list):
+        payload["recommended_tests"] = [
+            _TEST_TYPE_ALIASES.get(r, r) for r in payload["recommended_tests"] if isinstance(r, str)
+        ]
+
+
+def parse_case_content(content: str, guided: bool) -> dict[str, Any]:
+    """解析并校验一次生成的输出。
+
+    Args:
+        content: LLM 返回的文本
+        guided: 是否使用了引导解码（CASE_JSON_SCHEMA）
 
     Returns:
-        (case_payload, generation_meta)
+        病例载荷
+
+    Raises:
+        json.JSONDecodeError: 输出不是合法 JSON（引导解码下只可能是被 max_tokens 截断）
+        BusinessError: 502 如果输出不是 JSON 对象或缺少必需字段
     """
-    case_number = random.randint(1, len(DISEASE_LIST))
-    disease_name = DISEASE_LIST[case_number]
-    messages = _build_generation_messages(disease_name, case_number)
-    start = datetime.utcnow()
+    payload = json.loads(content if guided else _extract_json(content))
+    if not isinstance(payload, dict):
+        raise BusinessError("LLM 返回的病例不是 JSON 对象", status_code=502)
+    if not guided:
+        _normalize_unguided(payload)
+    missing = [f for f in REQUIRED_CASE_FIELDS if f not in payload]
+    if missing:
+        raise BusinessError(f"LLM 生成病例缺少字段: {', '.join(missing)}", status_code=502)
+    return payload
+
+
+def _collect_enums(
+    schema: dict[str, Any],
+    path: tuple[str, ...],
+    out: dict[tuple[str, ...], list[str]],
+) -> None:
+    if "enum" in schema:
+        out[path] = list(schema["enum"])
+    for key, sub in (schema.get("properties") or {}).items():
+        _collect_enums(sub, (*path, key), out)
+    if "items" in schema:
+        _collect_enums(schema["items"], (*path, ITEM), out)
+
+
+def build_case_validator(guided: bool) -> IncrementalJsonValidator:
+    """构建流式生成时的增量校验器（枚举取值来自 CASE_JSON_SCHEMA）。
+
+    Args:
+        guided: 是否使用了引导解码
+
+    Returns:
+        增量校验器（每次请求新建一个）
+    """
+    enums: dict[tuple[str, ...], list[str]] = {}
+    _collect_enums(CASE_JSON_SCHEMA, (), enums)
+    if not guided:
+        # 未引导时 test_type 的中文名称在解析后归一化，也视为合法
+        for path in (("available_tests", ITEM, "type"), ("recommended_tests", ITEM)):
+            enums[path] = [*enums[path], *_TEST_TYPE_ALIASES]
+    return IncrementalJsonValidator(
+        enums,
+        max_string=settings.LLM_CASE_GEN_MAX_STRING_CHARS,
+        max_items=settings.LLM_CASE_GEN_MAX_ARRAY_ITEMS,
+        # 未引导时模型可能先输出 ```json 等代码块标记
+        skip_preamble=not guided,
+    )
+
+
+def build_case_request(disease_name: str, case_number: int) -> dict[str, Any]:
+    """构建病例生成请求体（LLM_CASE_GEN_GUIDED_JSON 决定是否按 CASE_JSON_SCHEMA 引导解码）。
+
+    Args:
+        disease_name: 疾病名称
+        case_number: 疾病序号（1-106）
 
-    prompt_tokens = _estimate_prompt_tokens(messages)
+    Returns:
+        /v1/chat/completions 请求体
+    """
+    messages = _build_generation_messages(disease_name, case_number)
+    prompt_tokens = count_message_tokens(messages)
     available_tokens = max(0, settings.LLM_MAX_CONTEXT_LEN - prompt_tokens)
 
     # 限制 max_tokens，避免触发 vLLM 400：max_tokens 必须适配剩余上下文。
@@ -269,102 +439,190 @@ async def generate_random_case_payload() -> tuple[dict[str, Any], dict[str, Any]
     # 而不是直接硬失败。
     max_tokens = max(16, min(settings.LLM_CASE_GEN_MAX_TOKENS, available_tokens))
 
+    if settings.LLM_CASE_GEN_GUIDED_JSON:
+        # vLLM 把 OpenAI 兼容的 json_schema 交给结构化输出后端（xgrammar 等）在解码时约束
+        response_format: dict[str, Any] = {
+            "type": "json_schema",
+            "json_schema": {"name": "clinic_case", "schema": CASE_JSON_SCHEMA},
+        }
+    else:
+        # 只保证输出为 JSON 对象，字段与取值依赖提示词和解析后归一化
+        response_format = {"type": "json_object"}
+    return {
+        "model": settings.LLM_MODEL,
+        "messages": messages,
+        "stream": False,
+        "temperature": settings.LLM_CASE_GEN_TEMPERATURE,
+        "max_tokens": max_tokens,
+        "response_format": response_format,
+    }
+
+
+def _record_usage(raw: Any) -> dict[str, int] | None:
+    """读取响应中的 usage 并计入 llm_tokens_total（每次请求都消耗 GPU，含失败重试及中止）。"""
+    if not isinstance(raw, dict):
+        return None
+    usage = {
+        "prompt_tokens": int(raw.get("prompt_tokens") or 0),
+        "completion_tokens": int(raw.get("completion_tokens") or 0),
+    }
+    llm_tokens.labels("case_generation", "prompt").inc(usage["prompt_tokens"])
+    llm_tokens.labels("case_generation", "completion").inc(usage["completion_tokens"])
+    return usage
+
+
+async def _post_case_attempt(
+    request: dict[str, Any],
+) -> tuple[int, str, str | None, dict[str, int] | None]:
+    """以非流式方式发起一次生成。
+
+    Returns:
+        (HTTP 状态码, 生成文本, finish_reason, vLLM 报告的 token 用量)
+    """
+    resp = await get_llm_client().post_chat(request)
+    if resp.status_code != 200:
+        return resp.status_code, "", None, None
+    data = resp.json()
+    usage = _record_usage(data.get("usage"))
+    choice = (data.get("choices") or [{}])[0]
+    content = (choice.get("message") or {}).get("content") or ""
+    return 200, content, choice.get("finish_reason"), usage
+
+
+async def _stream_case_attempt(
+    request: dict[str, Any],
+    validator: IncrementalJsonValidator,
+) -> tuple[int, str, str | None, dict[str, int] | None]:
+    """以流式方式发起一次生成，每个增量都交给校验器。
+
+    校验失败时异常穿出 stream_chat 上下文，响应随之关闭，vLLM 检测到断开后中止该请求，
+    不再为注定无效的输出占用 GPU。
+
+    Returns:
+        (HTTP 状态码, 已生成文本, finish_reason, vLLM 报告的 token 用量)
+
+    Raises:
+        StreamValidationError: 输出已不可能合法（已按中止时的输出量记账 token）
+    """
+    payload = {**request, "stream": True, "stream_options": {"include_usage": True}}
+    parts: list[str] = []
+    finish_reason: str | None = None
+    usage: dict[str, int] | None = None
+    try:
+        async with get_llm_client().stream_chat(payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return response.status_code, "", None, None
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = line[len("data: ") :].strip()
+                if data == "[DONE]":
+                    break
+                content, reason = parse_chunk_json(data)
+                if content:
+                    parts.append(content)
+                    validator.feed(content)
+                if reason:
+                    finish_reason = reason
+                if '"usage"' in data:
+                    usage = parse_usage(data) or usage
+    except StreamValidationError:
+        # 中止的请求没有 usage，按已生成文本本地计数
+        usage = {
+            "prompt_tokens": count_message_tokens(request["messages"]),
+            "completion_tokens": count_tokens("".join(parts)),
+        }
+        raise
+    finally:
+        _record_usage(usage)
+    return 200, "".join(parts), finish_reason, usage
+
+
+async def generate_random_case_payload(
+    case_number: int | None = None,
+) -> tuple[dict[str, Any], dict[str, Any]]:
+    """通过 LLM 生成随机病例载荷。
+
+    从 106 种疾病列表中随机选择一种疾病（或使用指定序号），再让 LLM 为该疾病生成完整病例。
+    LLM_CASE_GEN_STREAM 开启时以流式方式生成并增量校验（build_case_validator），
+    输出一旦不可能合法就中止该次请求并进入下一次重试。
+
+    Args:
+        case_number: 可选的疾病序号（1-106），未指定时随机选择
+
+    Returns:
+        (case_payload, generation_meta)
+    """
+    if case_number is None:
+        case_number = random.randint(1, len(DISEASE_LIST))
+    disease_name = DISEASE_LIST[case_number]
+    start = datetime.utcnow()
+
+    guided = settings.LLM_CASE_GEN_GUIDED_JSON
+    streamed = settings.LLM_CASE_GEN_STREAM
+    request = build_case_request(disease_name, case_number)
     last_err: Exception | None = None
+    usage: dict[str, int] | None = None
+    attempts = 0
+    aborted = 0
     for _attempt in range(settings.LLM_CASE_GEN_RETRIES + 1):
+        attempts += 1
         try:
-            async with httpx.AsyncClient(timeout=settings.LLM_TIMEOUT) as client:
-                resp = await client.post(
-                    f"{settings.LLM_BASE_URL}/v1/chat/completions",
-                    json={
-                        "model": settings.LLM_MODEL,
-                        "messages": messages,
-                        "stream": False,
-                        "temperature": settings.LLM_CASE_GEN_TEMPERATURE,
-                        "max_tokens": max_tokens,
-                        # vLLM 支持 OpenAI 兼容的 response_format；
-                        # 这有助于强制输出严格 JSON。
-                        "response_format": {"type": "json_object"},
-                    },
-                )
+            if streamed:
+                attempt = await _stream_case_attempt(request, build_case_validator(guided))
+            else:
+                attempt = await _post_case_attempt(request)
+        except StreamValidationError as e:
+            llm_requests.labels("case_generation", OUTCOME_INVALID).inc()
+            aborted += 1
+            logger.info(
+                "LLM 生成病例输出无效，已中止",
+                attempt=attempts,
+                reason=e.reason,
+                position=e.position,
+                error=str(e),
+            )
+            last_err = BusinessError(f"LLM 生成病例输出无效：{e}", status_code=502)
+            continue
         except httpx.TimeoutException as e:
+            llm_requests.labels("case_generation", OUTCOME_TIMEOUT).inc()
             last_err = e
             continue
         except httpx.RequestError as e:
+            llm_requests.labels("case_generation", OUTCOME_CONNECTION_ERROR).inc()
             last_err = e
             continue
 
-        if resp.status_code != 200:
+        status_code, content, finish_reason, usage = attempt
+        if status_code != 200:
+            llm_requests.labels("case_generation", OUTCOME_HTTP_ERROR).inc()
             last_err = BusinessError(
-                f"LLM 生成病例失败: HTTP {resp.status_code}",
+                f"LLM 生成病例失败: HTTP {status_code}",
                 status_code=502,
             )
             continue
 
-        data = resp.json()
-        content = (data.get("choices") or [{}])[0].get("message", {}).get("content", "").strip()
+        content = content.strip()
         if not content:
+            llm_requests.labels("case_generation", OUTCOME_INVALID).inc()
             last_err = BusinessError("LLM 返回为空，无法生成病例", status_code=502)
             continue
 
-        # 首次解析尝试
         try:
-            payload = json.loads(_extract_json(content))
-        except json.JSONDecodeError as e:
+            payload = parse_case_content(content, guided)
+        except (json.JSONDecodeError, BusinessError) as e:
+            # 引导解码下只剩被 max_tokens 截断一种情况（finish_reason=length）
+            llm_requests.labels("case_generation", OUTCOME_INVALID).inc()
+            logger.info(
+                "LLM 生成病例输出无效",
+                attempt=attempts,
+                finish_reason=finish_reason,
+                error=str(e),
+            )
             last_err = e
             continue
-
-        # 进行最小化的解析后归一化，提升下游成功率。
-        # 确保 past_history 为对象。
-        if not isinstance(payload.get("past_history"), dict):
-            payload["past_history"] = {"diseases": [], "allergies": [], "medications": []}
-
-        # 确保 available_tests / recommended_tests 使用允许的 test_type 字符串。
-        if isinstance(payload.get("available_tests"), list):
-            for t in payload["available_tests"]:
-                if isinstance(t, dict) and "type" in t and isinstance(t["type"], str):
-                    if t["type"] not in _CASE_TEST_TYPES:
-                        # 对常见中文标签做一小步映射
-                        mapping = {
-                            "血常规": "blood_routine",
-                            "尿常规": "urine_routine",
-                            "心电图": "ecg",
-                            "胸片": "x_ray",
-                            "X光": "x_ray",
-                            "X 线": "x_ray",
-                            "超声": "ultrasound",
-                            "B超": "ultrasound",
-                            "CT": "ct",
-                        }
-                        t["type"] = mapping.get(t["type"], t["type"])
-
-                # 确保 result 为对象（dict），满足下游 schema 要求。
-                # 某些模型会输出短字符串，这里做包装处理。
-                if isinstance(t, dict):
-                    result = t.get("result")
-                    if result is None:
-                        t["result"] = {}
-                    elif not isinstance(result, dict):
-                        t["result"] = {"summary": str(result)}
-
-        if "recommended_tests" in payload and isinstance(payload.get("recommended_tests"), list):
-            normalized: list[str] = []
-            mapping = {
-                "血常规": "blood_routine",
-                "全血细胞计数": "blood_routine",
-                "尿常规": "urine_routine",
-                "心电图": "ecg",
-                "胸片": "x_ray",
-                "胸部X光片": "x_ray",
-                "X光": "x_ray",
-                "超声": "ultrasound",
-                "B超": "ultrasound",
-                "CT": "ct",
-            }
-            for r in payload["recommended_tests"]:
-                if isinstance(r, str):
-                    normalized.append(mapping.get(r, r))
-            payload["recommended_tests"] = normalized
-
+        llm_requests.labels("case_generation", OUTCOME_OK).inc()
         break
     else:
         # 重试次数耗尽
@@ -398,5 +656,87 @@ async def generate_random_case_payload() -> tuple[dict[str, Any], dict[str, Any]
         "retries": settings.LLM_CASE_GEN_RETRIES,
         "case_number": case_number,
         "disease_name": disease_name,
+        "guided_decoding": guided,
+        # 本次生成实际发起的请求数（含失败重试），其中被增量校验提前中止的次数
+        "attempts": attempts,
+        "streamed": streamed,
+        "aborted": aborted,
+        # 成功那次请求的 token 用量（vLLM 报告）
+        "usage": usage,
     }
     return payload, generation_meta
+
+
+def build_random_case(
+    payload: dict[str, Any],
+    meta: dict[str, Any],
+    source: str = "random",
+) -> Case:
+    """校验生成的病例载荷并构建 Case（尚未加入数据库会话）。
+
+    Args:
+        payload: generate_random_case_payload 返回的病例载荷
+        meta: 生成元信息
+        source: 病例来源（random：直接用于会话；pool：放入随机病例池）
+
+    Returns:
+        病例对象
+
+    Raises:
+        BusinessError: 502 如果载荷缺少必需字段
+    """
+    missing = [f for f in REQUIRED_CASE_FIELDS if f not in payload]
+    if missing:
+        logger.warning(
+            "LLM 生成病例缺少字段",
+            missing=missing,
+            meta=meta,
+        )
+        raise BusinessError(
+            f"LLM 生成病例缺少字段: {', '.join(missing)}",
+            status_code=502,
+        )
+
+    # recommended_tests 若存在，应与 available_tests.type 保持一致，否则检查申请会失败
+    recommended_tests = payload.get("recommended_tests")
+    available_test_types = {
+        str(t.get("type"))
+        for t in (payload.get("available_tests") or [])
+        if isinstance(t, dict) and t.get("type")
+    }
+    if recommended_tests is not None:
+        if not isinstance(recommended_tests, list):
+            recommended_tests = []
+        else:
+            # 过滤非字符串项
+            recommended_tests = [x for x in recommended_tests if isinstance(x, str) and x]
+        # 自动过滤不在 available_tests 中的项（小模型常产生不一致）
+        unknown = [t for t in recommended_tests if t not in available_test_types]
+        if unknown:
+            logger.info(
+                "自动过滤不一致的 recommended_tests",
+                unknown=unknown,
+                available=available_test_types,
+            )
+            recommended_tests = [t for t in recommended_tests if t in available_test_types]
+
+    return Case(
+        title=str(payload["title"]),
+        difficulty=str(payload["difficulty"]),
+        department=str(payload["department"]),
+        patient_info=payload["patient_info"],
+        chief_complaint=str(payload["chief_complaint"]),
+        present_illness=str(payload["present_illness"]),
+        past_history=payload["past_history"],
+        physical_exam=payload["physical_exam"],
+        available_tests=payload["available_tests"],
+        standard_diagnosis=payload["standard_diagnosis"],
+        key_points=payload["key_points"],
+        recommended_tests=recommended_tests,
+        marriage_childbearing_history=str(payload.get("marriage_childbearing_history", "未提供")),
+        family_history=str(payload.get("family_history", "未提供")),
+        case_number=payload.get("case_number"),
+        is_active=True,
+        source=source,
+        generation_meta=meta,
+    )
@@ -0,0 +1,215 @@
+"""随机病例池：预先生成、校验好的随机病例，随机模式建会话时直接领取。
+
+随机模式建会话原本要在请求内同步调用 LLM 生成病例（最多 LLM_CASE_GEN_MAX_TOKENS，失败还会重试），
+会话创建耗时数秒到数十秒。病例池由后台任务维护：
+- 池中保持约 CASE_POOL_SIZE 个病例（cases.source = 'pool'），按疾病分散：
+  优先补充池中尚未出现的疾病，同一疾病不重复入池（池容量大于疾病数时才允许重复）
+- 只在 GPU 空闲时补充：准入队列为空且在途请求不超过容量的 CASE_POOL_IDLE_UTILIZATION，
+  对话生成始终优先；补充本身也占用一个准入名额
+- 领取是原子的：UPDATE ... WHERE id = (SELECT ... FOR UPDATE SKIP LOCKED) 把病例改为 random，
+  与会话插入在同一事务中，多 worker 并发领取不会拿到同一个病例，事务回滚时病例回到池中
+- 池为空时（冷启动、高峰期）由调用方回退为同步生成；调用方提交后唤醒补充任务
+
+多 worker 部署时各 worker 各自补充，池内数量可能短暂超出 CASE_POOL_SIZE（至多 worker 数个）。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+from collections import Counter
+from typing import Any
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.apps.api.config import settings
+from src.apps.api.dependencies import AsyncSessionLocal
+from src.apps.api.logging_config import logger
+from src.apps.api.models import Case
+from src.apps.api.services.admission import get_admission
+from src.apps.api.services.case_generation import (
+    DISEASE_LIST,
+    build_random_case,
+    generate_random_case_payload,
+)
+
+# 池中病例的 source；领取后改为 random
+POOL_SOURCE = "pool"
+# 病例池补充任务在准入控制中使用的用户ID（不对应真实用户）
+POOL_USER_ID = 0
+
+
+class CasePool:
+    """进程级随机病例池（补充任务与领取）。"""
+
+    def __init__(self) -> None:
+        self._task: asyncio.Task[None] | None = None
+        self._wakeup = asyncio.Event()
+        self.size: int | None = None
+        self.claimed = 0
+        self.misses = 0
+        self.generated = 0
+        self.failures = 0
+        self.busy_skips = 0
+        self.last_error: str | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return settings.CASE_POOL_SIZE > 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """启动后台补充任务（CASE_POOL_SIZE 为 0 时不启动）。"""
+        if not self.enabled or self.running:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止补充任务（进行中的生成被取消，未写入的病例丢弃）。"""
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def wake(self) -> None:
+        """唤醒补充任务（领取病例的事务提交后调用）。"""
+        self._wakeup.set()
+
+    async def claim(self, db: AsyncSession) -> int | None:
+        """从池中领取一个病例（改为 random），在调用方事务中执行。
+
+        调用方提交事务后领取才生效；回滚时病例留在池中。
+
+        Args:
+            db: 数据库会话
+
+        Returns:
+            病例ID；池为空或未启用时返回 None
+        """
+        if not self.enabled:
+            return None
+        candidate = (
+            select(Case.id)
+            .where(Case.source == POOL_SOURCE)
+            .order_by(Case.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        result = await db.execute(
+            update(Case)
+            .where(Case.id == candidate)
+            .values(source="random")
+            .returning(Case.id)
+            .execution_options(synchronize_session=False)
+        )
+        case_id = result.scalar_one_or_none()
+        if case_id is None:
+            self.misses += 1
+        else:
+            self.claimed += 1
+        return case_id
+
+    def _idle(self) -> bool:
+        admission = get_admission()
+        limit = admission.capacity * settings.CASE_POOL_IDLE_UTILIZATION
+        return admission.queued == 0 and admission.in_flight < limit
+
+    async def _pooled_diseases(self) -> Counter[int]:
+        async with AsyncSessionLocal() as db:
+            rows = await db.execute(
+                select(Case.case_number, func.count())
+                .where(Case.source == POOL_SOURCE)
+                .group_by(Case.case_number)
+            )
+            return Counter({number: count for number, count in rows.all() if number})
+
+    @staticmethod
+    def _pick_disease(pooled: Counter[int]) -> int:
+        # 优先选择池中最少出现的疾病，同等时随机
+        fewest = min(pooled.get(n, 0) for n in DISEASE_LIST)
+        return random.choice([n for n in DISEASE_LIST if pooled.get(n, 0) == fewest])
+
+    async def _refill_one(self, case_number: int) -> None:
+        async with get_admission().slot(POOL_USER_ID):
+            payload, meta = await generate_random_case_payload(case_number)
+        case = build_random_case(payload, meta, source=POOL_SOURCE)
+        async with AsyncSessionLocal() as db:
+            db.add(case)
+            await db.commit()
+        self.generated += 1
+        logger.info("随机病例已入池", case_id=case.id, case_number=case_number)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                pooled = await self._pooled_diseases()
+                self.size = sum(pooled.values())
+                if self.size < settings.CASE_POOL_SIZE:
+                    if self._idle():
+                        await self._refill_one(self._pick_disease(pooled))
+                        self.last_error = None
+                        continue
+                    self.busy_skips += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                logger.warning(
+                    "随机病例池补充失败",
+                    error=str(e),
+                    retry_in=settings.CASE_POOL_RETRY_BACKOFF,
+                )
+                # 退避期间不响应领取唤醒，避免 LLM 故障时反复重试
+                await asyncio.sleep(settings.CASE_POOL_RETRY_BACKOFF)
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), timeout=settings.CASE_POOL_POLL_INTERVAL
+                )
+            except TimeoutError:
+                pass
+
+    def snapshot(self) -> dict[str, Any]:
+        """导出病例池统计。"""
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "target": settings.CASE_POOL_SIZE,
+            "size": self.size,
+            "claimed": self.claimed,
+            "misses": self.misses,
+            "generated": self.generated,
+            "failures": self.failures,
+            "busy_skips": self.busy_skips,
+            "last_error": self.last_error,
+        }
+
+
+_case_pool: CasePool | None = None
+
+
+def get_case_pool() -> CasePool:
+    """获取进程级随机病例池。"""
+    global _case_pool
+    if _case_pool is None:
+        _case_pool = CasePool()
+    return _case_pool
+
+
+__all__ = [
+    "POOL_SOURCE",
+    "CasePool",
+    "get_case_pool",
+]
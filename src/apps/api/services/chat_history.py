@@ -0,0 +1,162 @@
+"""对话历史加载与打包。
+
+每轮对话只需要最近的一段历史来组装提示词。这里直接在数据库中按
+(session_id, created_at) 复合索引倒序取最近 N 条（或最近的 token 预算），
+返回轻量的行元组而非完整 ORM 对象，使单轮开销不随会话变长而线性增长。
+
+尚在写入队列中、未落库的消息（见 message_writer）追加在数据库结果之后一并返回。
+
+加载后的窗口再按 token 预算打包（pack_history）：取能放进预算的最长对话后缀，
+并固定保留携带检查结果的 system 消息，长会话逐步“遗忘”最早的问答而不是直接失败。
+"""
+
+from __future__ import annotations
+
+from collections.abc import Sequence
+from datetime import datetime
+
+from sqlalchemy import Row, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.apps.api.models import Message
+from src.apps.api.services.message_writer import PendingRow, get_message_writer
+from src.apps.api.services.tokenizer import MESSAGE_OVERHEAD_TOKENS, count_tokens
+
+# (id, role, content, tokens, created_at)
+HistoryRow = Row[tuple[int, str, str, int | None, datetime]] | PendingRow
+
+
+async def load_history_window(
+    db: AsyncSession,
+    session_id: int,
+    limit: int,
+    token_budget: int | None = None,
+) -> Sequence[HistoryRow]:
+    """加载会话最近的历史消息窗口（按时间正序）。
+
+    Args:
+        db: 数据库会话
+        session_id: 会话ID
+        limit: 最多返回的消息条数
+        token_budget: 可选 token 预算；按 Message.tokens 从最新一条往前累加，
+            只保留累计值不超过预算的后缀
+
+    Returns:
+        行元组列表，字段为 id / role / content / tokens / created_at；
+        未落库的消息排在最后，其 id 为临时 ID（大于任何已落库消息）
+    """
+    if limit <= 0:
+        return []
+
+    newest_first = (Message.created_at.desc(), Message.id.desc())
+    columns = [
+        Message.id,
+        Message.role,
+        Message.content,
+        Message.tokens,
+        Message.created_at,
+    ]
+    if token_budget is not None:
+        columns.append(
+            func.sum(func.coalesce(Message.tokens, 0))
+            .over(order_by=newest_first)
+            .label("running_tokens")
+        )
+
+    window = (
+        select(*columns)
+        .where(Message.session_id == session_id)
+        .order_by(*newest_first)
+        .limit(limit)
+        .subquery()
+    )
+
+    stmt = select(
+        window.c.id,
+        window.c.role,
+        window.c.content,
+        window.c.tokens,
+        window.c.created_at,
+    ).order_by(window.c.created_at, window.c.id)
+    if token_budget is not None:
+        stmt = stmt.where(window.c.running_tokens <= token_budget)
+
+    # 写入队列的快照须在查询之前读取：查询期间提交的批次会移出队列，
+    # 之后再读会让这些消息既不在查询结果（快照之前）也不在队列中
+    writer = get_message_writer()
+    pending = writer.pending_rows(session_id)
+    result = await db.execute(stmt)
+    rows: list[HistoryRow] = list(result.all())
+    if not pending:
+        return rows
+
+    # 合并写入队列中的消息（按提交顺序落库，必然比已落库的消息新）。
+    # 快照之后、查询之前落库的消息两边都有：按写入队列记录的真实消息 ID 去重
+    # （不能按角色和内容比较：学生连续两次问同一句话是两条不同的消息）
+    loaded = {row.id for row in rows}
+    pending = [row for row in pending if writer.persisted_id(row.id) not in loaded]
+    rows = (rows + pending)[-limit:]
+    if token_budget is not None:
+        running = 0
+        for idx in range(len(rows) - 1, -1, -1):
+            running += rows[idx].tokens or 0
+            if running > token_budget:
+                rows = rows[idx + 1 :]
+                break
+    return rows
+
+
+def history_row_tokens(row: HistoryRow) -> int:
+    """单条历史消息在提示词中占用的 token 数（优先使用已存储的 Message.tokens）。"""
+    tokens = row.tokens if row.tokens is not None else count_tokens(row.content)
+    return tokens + MESSAGE_OVERHEAD_TOKENS
+
+
+def pack_history(rows: Sequence[HistoryRow], budget: int) -> list[HistoryRow]:
+    """按 token 预算打包历史消息。
+
+    规则：
+    1. system 消息（检查结果）优先固定保留，从新到旧直到预算用尽
+    2. 其余预算从最新一条往前取最长的连续后缀，遇到放不下的消息即停止
+    3. 输出保持时间正序
+
+    时间复杂度 O(len(rows))，每条消息只计算一次 token 数。
+
+    Args:
+        rows: 按时间正序的历史窗口
+        budget: 可用于历史消息的 token 预算
+
+    Returns:
+        入选的历史消息（时间正序）
+    """
+    if budget <= 0 or not rows:
+        return []
+
+    costs = [history_row_tokens(row) for row in rows]
+
+    pinned: set[int] = set()
+    remaining = budget
+    for idx in range(len(rows) - 1, -1, -1):
+        if rows[idx].role == "system" and costs[idx] <= remaining:
+            pinned.add(idx)
+            remaining -= costs[idx]
+
+    start = len(rows)
+    for idx in range(len(rows) - 1, -1, -1):
+        if idx in pinned:
+            start = idx
+            continue
+        if costs[idx] > remaining:
+            break
+        remaining -= costs[idx]
+        start = idx
+
+    return [row for idx, row in enumerate(rows) if idx >= start or idx in pinned]
+
+
+__all__ = [
+    "HistoryRow",
+    "history_row_tokens",
+    "load_history_window",
+    "pack_history",
+]
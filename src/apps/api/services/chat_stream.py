@@ -0,0 +1,462 @@
+"""对话流式转发。
+
+把 vLLM 的流式响应转发给 SSE 客户端：
+- 上游读取在独立任务中进行（生产者），以 vLLM 的生成速度读完整个流，写入缓冲；
+  deltas() 按合并窗口取出增量，交给可恢复流（见 stream_registry）分发给客户端。
+  GPU 占用只取决于生成速度，与客户端带宽无关（慢客户端的处理在可恢复流中）。
+  缓冲字节数以 CHAT_RELAY_BUFFER_BYTES 为上限：消费方停滞时生产者暂停读取，内存有界
+- 后台轮询断开探测（可恢复流在宽限期内无客户端连接即视为断开），断开后立即取消上游任务，
+  httpx 流随之关闭，vLLM 检测到连接断开后释放该序列，不再为无人读取的输出占用 GPU
+- 被中止的流按“truncated”保存部分回答，并统计取消的流与 token
+- 记录建连、首 token、token 间隔等时间点（timing，见 generation_stats）
+- 请求 stream_options.include_usage 时，从最后一个数据块读取 vLLM 统计的
+  prompt / completion token 数（usage），用于精确记账；流被中止时没有 usage，回退本地计数
+- 上游解析方式由 CHAT_STREAM_PARSER 选择：json 逐行 json.loads；passthrough 直接在
+  原始字节上扫描 content 与 finish_reason 字段，不构建完整 dict（结构不符合预期时
+  自动回退 json 解析）
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Coroutine
+from dataclasses import dataclass
+from typing import Any
+
+import httpx
+
+from src.apps.api.config import settings
+from src.apps.api.logging_config import logger
+from src.apps.api.services.generation_stats import GenerationTiming
+from src.apps.api.services.llm_client import CHAT_COMPLETIONS_PATH, get_llm_client
+from src.apps.api.services.metrics import (
+    OUTCOME_CANCELLED,
+    OUTCOME_CONNECTION_ERROR,
+    OUTCOME_HTTP_ERROR,
+    OUTCOME_INVALID,
+    OUTCOME_OK,
+    OUTCOME_TIMEOUT,
+    llm_requests,
+)
+from src.apps.api.services.tokenizer import count_tokens
+
+# 助手回复的结束原因（Message.finish_reason）
+FINISH_STOP = "stop"
+FINISH_LENGTH = "length"
+FINISH_TRUNCATED = "truncated"
+
+
+@dataclass
+class StreamStats:
+    """进程内流式转发统计。"""
+
+    started: int = 0
+    completed: int = 0
+    cancelled: int = 0
+    # 单个客户端积压事件数的历史最大值
+    buffer_high_water: int = 0
+    # 上游读取缓冲的字节数历史最大值 / 缓冲已满、生产者等待的次数
+    relay_buffer_high_water: int = 0
+    relay_buffer_waits: int = 0
+    # 慢客户端积压被合并的次数 / 被断开推送的次数
+    coalesced: int = 0
+    slow_client_drops: int = 0
+    # 客户端通过 Last-Event-ID 重连成功的次数 / 流已过期或不存在的次数
+    resumed: int = 0
+    resume_misses: int = 0
+    # 被取消时已生成并保存的 token 数
+    cancelled_partial_tokens: int = 0
+    # 被取消时尚未生成的 token 预算（max_tokens - 已生成），即节省 GPU 工作量的上界
+    cancelled_tokens: int = 0
+
+    def snapshot(self) -> dict[str, int]:
+        return {
+            "started": self.started,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "buffer_high_water": self.buffer_high_water,
+            "relay_buffer_high_water": self.relay_buffer_high_water,
+            "relay_buffer_waits": self.relay_buffer_waits,
+            "coalesced": self.coalesced,
+            "slow_client_drops": self.slow_client_drops,
+            "resumed": self.resumed,
+            "resume_misses": self.resume_misses,
+            "cancelled_partial_tokens": self.cancelled_partial_tokens,
+            "cancelled_tokens": self.cancelled_tokens,
+        }
+
+
+stream_stats = StreamStats()
+
+
+_DATA_PREFIX = b"data: "
+_DONE_PAYLOAD = b"[DONE]"
+_DELTA_KEY = b'"delta":'
+_CONTENT_KEY = b'"content":'
+_FINISH_KEY = b'"finish_reason":'
+# 不带冒号的键名：紧凑形式找不到而键名存在时，说明不是紧凑 JSON
+_CONTENT_NAME = b'"content"'
+_FINISH_NAME = b'"finish_reason"'
+_USAGE_KEY = b'"usage"'
+
+
+def parse_chunk_json(payload: str | bytes) -> tuple[str | None, str | None]:
+    """完整解析一条 vLLM 流式数据，返回 (content, finish_reason)。"""
+    try:
+        chunk = json.loads(payload)
+    except ValueError:  # JSONDecodeError / UnicodeDecodeError
+        return None, None
+    choice = (chunk.get("choices") or [{}])[0]
+    return choice.get("delta", {}).get("content") or None, choice.get("finish_reason")
+
+
+def parse_usage(payload: str | bytes) -> dict[str, int] | None:
+    """解析携带 usage 的数据块，返回 {prompt_tokens, completion_tokens}（无 usage 时为 None）。"""
+    try:
+        usage = json.loads(payload).get("usage")
+    except (json.JSONDecodeError, AttributeError):
+        return None
+    if not isinstance(usage, dict):
+        return None
+    return {
+        "prompt_tokens": int(usage.get("prompt_tokens") or 0),
+        "completion_tokens": int(usage.get("completion_tokens") or 0),
+    }
+
+
+def _read_json_string(buf: bytes, start: int) -> tuple[str, int] | None:
+    """读取从 start（起始引号之后）开始的 JSON 字符串，返回 (值, 结束引号位置)。"""
+    end = buf.find(b'"', start)
+    while end > 0:
+        # 引号前连续反斜杠为奇数个时是转义引号
+        backslashes = 0
+        while buf[end - 1 - backslashes] == 0x5C:  # 反斜杠
+            backslashes += 1
+        if backslashes % 2 == 0:
+            break
+        end = buf.find(b'"', end + 1)
+    if end < 0:
+        return None
+    raw = buf[start:end]
+    if b"\\" not in raw:
+        return raw.decode("utf-8"), end
+    return json.loads(buf[start - 1 : end + 1]), end
+
+
+def scan_chunk(payload: bytes) -> tuple[str | None, str | None]:
+    """在原始字节上提取 (content, finish_reason)，不构建完整 dict。
+
+    适用于 vLLM 的紧凑 JSON 输出；遇到非预期结构（如带空格的 JSON）或无法解码的字符串
+    （非法转义、非 UTF-8 字节）回退 parse_chunk_json。
+    """
+    try:
+        return _scan_compact(payload)
+    except ValueError:
+        return parse_chunk_json(payload)
+
+
+def _scan_compact(payload: bytes) -> tuple[str | None, str | None]:
+    delta = payload.find(_DELTA_KEY)
+    if delta < 0:
+        return parse_chunk_json(payload)
+
+    content: str | None = None
+    idx = payload.find(_CONTENT_KEY, delta)
+    search_from = delta
+    if idx < 0 and _CONTENT_NAME in payload:
+        # 键名存在却不是紧凑形式
+        return parse_chunk_json(payload)
+    if idx >= 0:
+        value = idx + len(_CONTENT_KEY)
+        marker = payload[value : value + 1]
+        if marker == b'"':
+            result = _read_json_string(payload, value + 1)
+            if result is None:
+                return parse_chunk_json(payload)
+            content, search_from = result
+            content = content or None
+        elif marker != b"n":  # 非字符串也非 null
+            return parse_chunk_json(payload)
+
+    finish_reason: str | None = None
+    idx = payload.find(_FINISH_KEY, search_from)
+    if idx < 0:
+        # 键名存在却不是紧凑形式（如 "finish_reason" : "length"）时回退，漏读会错过截断
+        return parse_chunk_json(payload) if _FINISH_NAME in payload else (content, None)
+    value = idx + len(_FINISH_KEY)
+    marker = payload[value : value + 1]
+    if marker == b'"':
+        result = _read_json_string(payload, value + 1)
+        if result is None:
+            return parse_chunk_json(payload)
+        finish_reason = result[0]
+    elif marker != b"n":  # 冒号后有空格等非紧凑形式
+        return parse_chunk_json(payload)
+    return content, finish_reason
+
+
+async def _iter_data_payloads(response: httpx.Response) -> AsyncIterator[bytes]:
+    """按行切分原始字节流，产出 `data: ` 之后的载荷。"""
+    pending = b""
+    async for chunk in response.aiter_bytes():
+        pending += chunk
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line.startswith(_DATA_PREFIX):
+                yield line[len(_DATA_PREFIX) :].rstrip(b"\r")
+    if pending.startswith(_DATA_PREFIX):
+        yield pending[len(_DATA_PREFIX) :].rstrip(b"\r")
+
+
+class ChatStreamRelay:
+    """单次对话生成的上游读取与断开检测。
+
+    Args:
+        is_disconnected: 断开探测（返回 True 时中止上游生成）
+        payload: chat completions 请求体（stream=True）
+        affinity_key: 后端亲和键（静态前缀哈希）
+    """
+
+    def __init__(
+        self,
+        is_disconnected: Callable[[], Awaitable[bool]],
+        payload: dict[str, Any],
+        affinity_key: str | None = None,
+    ) -> None:
+        self._is_disconnected = is_disconnected
+        self._payload = payload
+        self._affinity_key = affinity_key
+        # 生产者写入后唤醒消费者；消费者取走后唤醒（因缓冲已满而等待的）生产者
+        self._buffer: deque[str] = deque()
+        self._buffered_bytes = 0
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._eof = False
+        self._parts: list[str] = []
+        self._producer: asyncio.Task[None] | None = None
+        self._watcher: asyncio.Task[None] | None = None
+        self._cancel_recorded = False
+        self.started = False
+        self.completed = False
+        self.disconnected = False
+        self.error: str | None = None
+        self.finish_reason = FINISH_STOP
+        self.timing = GenerationTiming()
+        # vLLM 报告的 token 用量（未请求 include_usage 或流被中止时为 None）
+        self.usage: dict[str, int] | None = None
+
+    @property
+    def content(self) -> str:
+        """已收到的回复内容。"""
+        return "".join(self._parts)
+
+    @property
+    def completion_tokens(self) -> int:
+        """回复的 token 数（优先使用 vLLM 报告的 usage）。"""
+        if self.usage is not None:
+            return self.usage["completion_tokens"]
+        return count_tokens(self.content)
+
+    @property
+    def truncated(self) -> bool:
+        """上游是否在完成前被中止（客户端断开或生成被取消）。"""
+        return self.started and (self.disconnected or not self.completed)
+
+    async def deltas(self) -> AsyncIterator[str]:
+        """启动上游读取并产出合并后的回复增量。
+
+        vLLM 往往每个增量只有一个汉字。首个增量到达后最多再等待 CHAT_SSE_FLUSH_MS 毫秒，
+        或积累到 CHAT_SSE_FLUSH_BYTES 字节，把期间的增量合并为一段产出，减少 SSE 帧数。
+
+        客户端断开或上游出错时迭代提前结束，调用方通过 disconnected / error 区分。
+        """
+        self.started = True
+        stream_stats.started += 1
+        self._producer = asyncio.create_task(self._produce())
+        self._watcher = asyncio.create_task(self._watch_disconnect())
+        loop = asyncio.get_running_loop()
+        flush_after = settings.CHAT_SSE_FLUSH_MS / 1000
+        try:
+            while True:
+                if not self._buffer:
+                    if self._eof:
+                        return
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+
+                # 合并窗口：等到超时、字节数达到阈值或上游结束
+                if flush_after > 0:
+                    deadline = loop.time() + flush_after
+                    while not self._eof and self._buffered_bytes < settings.CHAT_SSE_FLUSH_BYTES:
+                        remaining = deadline - loop.time()
+                        if remaining <= 0:
+                            break
+                        self._ready.clear()
+                        try:
+                            await asyncio.wait_for(self._ready.wait(), remaining)
+                        except TimeoutError:
+                            break
+
+                yield self._drain()
+        finally:
+            self._watcher.cancel()
+
+    def _drain(self) -> str:
+        merged = "".join(self._buffer)
+        self._buffer.clear()
+        self._buffered_bytes = 0
+        self._space.set()
+        return merged
+
+    async def _push(self, content: str) -> None:
+        self.timing.token()
+        self._parts.append(content)
+        while self._buffered_bytes >= settings.CHAT_RELAY_BUFFER_BYTES:
+            stream_stats.relay_buffer_waits += 1
+            self._space.clear()
+            await self._space.wait()
+        self._buffer.append(content)
+        self._buffered_bytes += len(content.encode("utf-8"))
+        stream_stats.relay_buffer_high_water = max(
+            stream_stats.relay_buffer_high_water, self._buffered_bytes
+        )
+        self._ready.set()
+
+    def _take_usage(self, payload: str | bytes) -> None:
+        usage = parse_usage(payload)
+        if usage is not None:
+            self.usage = usage
+
+    def abort(self) -> None:
+        """中止上游读取（幂等，可在已取消的上下文中同步调用）。"""
+        if self._watcher is not None:
+            self._watcher.cancel()
+        if self._producer is not None and not self._producer.done():
+            self._producer.cancel()
+            self._record_cancel()
+
+    async def _produce(self) -> None:
+        cancelled = False
+        outcome = OUTCOME_OK
+        self.timing.start()
+        try:
+            async with get_llm_client().stream_chat(
+                self._payload, affinity_key=self._affinity_key
+            ) as response:
+                backend = str(response.request.url).removesuffix(CHAT_COMPLETIONS_PATH)
+                self.timing.connected(backend)
+                if response.status_code != 200:
+                    error_text = await response.aread()
+                    self.error = f"LLM error: {error_text.decode()}"
+                    outcome = OUTCOME_HTTP_ERROR
+                    return
+
+                if settings.CHAT_STREAM_PARSER == "passthrough":
+                    async for payload in _iter_data_payloads(response):
+                        if payload.strip() == _DONE_PAYLOAD:
+                            break
+                        content, finish_reason = scan_chunk(payload)
+                        if content:
+                            await self._push(content)
+                        if finish_reason:
+                            self.finish_reason = finish_reason
+                        elif content is None and _USAGE_KEY in payload:
+                            self._take_usage(payload)
+                else:
+                    async for line in response.aiter_lines():
+                        if not line or not line.startswith("data: "):
+                            continue
+                        data_str = line[6:]
+                        if data_str.strip() == "[DONE]":
+                            break
+                        content, finish_reason = parse_chunk_json(data_str)
+                        if content:
+                            await self._push(content)
+                        if finish_reason:
+                            self.finish_reason = finish_reason
+                        elif content is None and '"usage"' in data_str:
+                            self._take_usage(data_str)
+            stream_stats.completed += 1
+        except asyncio.CancelledError:
+            cancelled = True
+            outcome = OUTCOME_CANCELLED
+            raise
+        except httpx.TimeoutException:
+            self.error = "LLM request timeout"
+            outcome = OUTCOME_TIMEOUT
+        except httpx.RequestError as e:
+            self.error = f"LLM connection error: {str(e)}"
+            outcome = OUTCOME_CONNECTION_ERROR
+        except Exception as e:
+            # 其他异常（如无法解析的上游输出）同样作为错误结束，避免部分回答被当作完整回答保存
+            logger.exception("读取 LLM 流式响应失败")
+            self.error = f"LLM stream error: {str(e)}"
+            outcome = OUTCOME_INVALID
+        finally:
+            llm_requests.labels("chat", outcome).inc()
+            self.timing.finish()
+            self.completed = not cancelled
+            self._eof = True
+            self._ready.set()
+
+    async def _watch_disconnect(self) -> None:
+        while True:
+            await asyncio.sleep(settings.CHAT_DISCONNECT_POLL_INTERVAL)
+            if await self._is_disconnected():
+                self.disconnected = True
+                if self._producer is not None and not self._producer.done():
+                    self._producer.cancel()
+                    self._record_cancel()
+                return
+
+    def _record_cancel(self) -> None:
+        if self._cancel_recorded:
+            return
+        self._cancel_recorded = True
+        self.finish_reason = FINISH_TRUNCATED
+        partial_tokens = count_tokens(self.content)
+        max_tokens = int(self._payload.get("max_tokens") or 0)
+        stream_stats.cancelled += 1
+        stream_stats.cancelled_partial_tokens += partial_tokens
+        stream_stats.cancelled_tokens += max(0, max_tokens - partial_tokens)
+        logger.info(
+            "客户端已断开，中止上游生成",
+            partial_tokens=partial_tokens,
+            max_tokens=max_tokens,
+        )
+
+
+# 脱离请求生命周期的后台任务（如断开后保存部分回答）
+_background: set[asyncio.Task[Any]] = set()
+
+
+def spawn_background(coro: Coroutine[Any, Any, Any]) -> None:
+    """在后台运行协程（持有引用直到完成，应用关闭时等待）。"""
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def drain_background() -> None:
+    """等待后台任务完成（应用关闭时调用）。"""
+    if _background:
+        await asyncio.gather(*_background, return_exceptions=True)
+
+
+__all__ = [
+    "FINISH_LENGTH",
+    "FINISH_STOP",
+    "FINISH_TRUNCATED",
+    "ChatStreamRelay",
+    "StreamStats",
+    "parse_chunk_json",
+    "parse_usage",
+    "scan_chunk",
+    "drain_background",
+    "spawn_background",
+    "stream_stats",
+]
@@ -0,0 +1,279 @@
+"""病例编译缓存。
+
+固定病例几乎不变，但对话、检查意图处理与评分每次都要从病例 JSON 字段
+重新渲染同样的内容。这里把病例“编译”为不可变的 CompiledCase：
+- 渲染好的开发者提示词及其 token 数
+- 静态前缀消息（系统提示词 + 开发者提示词）及其哈希，
+  同一病例的每轮对话前缀逐字节一致，vLLM 可复用前缀 KV 缓存
+- 可申请检查的 type 索引与预格式化的检查结果文本
+- 评分用的关键点匹配词
+
+编译结果按 (case.id, case.updated_at) 放入进程内 LRU 缓存，病例更新后自动失效；
+固定病例在应用启动时预热。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import dataclass
+from datetime import datetime
+from types import MappingProxyType
+from typing import Any
+
+from sqlalchemy import select
+
+from src.apps.api.config import settings
+from src.apps.api.dependencies import AsyncSessionLocal
+from src.apps.api.logging_config import logger
+from src.apps.api.models import Case
+from src.apps.api.services.test_intents import format_test_result_text
+from src.apps.api.services.tokenizer import count_tokens
+
+# 系统提示词模板（固定角色约束）
+SYSTEM_PROMPT = """你是一名正在看病的普通患者，医生正在给你问诊。
+
+【身份铁律 - 绝对不可违反】
+- 你是患者，不是医生、护士或任何医疗人员
+- 你来看病是因为身体不舒服，你不懂医学
+- 你绝对不能：开药、给建议、做诊断、说"我帮你"、说"给你开药"
+- 医生说什么你就听着，最多问"那我该怎么办"或"严重吗"
+
+【回答原则】
+1. 只描述自己的症状和感受，不给任何医学意见
+2. 只回答医生问的问题，不主动提供信息
+3. 用普通人的话说症状，比如"肚子疼"而不是"腹痛"
+4. 回答简短自然，一两句话即可
+5. 如果医生问你该怎么治，回答"我不懂，您是医生您说了算"
+6. 如果医生让你吃药/检查，回答"好的"或"行"即可
+【首次回复规则】
+- 在你的第一次回答的末尾，附上格式为「（病例序号：XX）」的病例编号（XX 为实际序号）。
+- 仅第一次回复需要附带序号，后续回复不再重复。
+
+【诊断终止规则】
+- 当用户明确给出最终诊断时，你必须：
+  （触发词示例："我的诊断是…"、"最终诊断：…"、"诊断为…"、"初步诊断…"）
+  1. 立即退出患者角色扮演
+  2. 判断用户的诊断是否与你预设的「初步诊断」一致
+     给出判断结果（✔ 正确 / ✖ 不正确，并说明正确诊断）
+  3. 完整展示预先生成的病历，格式如下：
+     ---
+     【预设病历】
+     性别：XX
+     年龄：XX岁
+     职业：XX
+     主诉：XX
+     现病史：XX
+     既往史：XX
+     婚育个人史：XX
+     家族史：XX
+     初步诊断：XX
+     ---"""
+
+
+def build_developer_prompt(case: Case) -> str:
+    """构建开发者提示词（包含病例信息）。
+
+    Args:
+        case: 病例对象
+
+    Returns:
+        开发者提示词字符串
+    """
+    # 提取体格检查中可透露的信息
+    physical_exam = case.physical_exam or {}
+    visible_signs = physical_exam.get("visible", {})
+    on_request_signs = physical_exam.get("on_request", {})
+
+    # 格式化可见体征
+    visible_str = (
+        "\n".join(f"  - {k}: {v}" for k, v in visible_signs.items())
+        if visible_signs
+        else "  - 无明显异常"
+    )
+
+    # 格式化按需体征（医生检查时才显示）
+    on_request_str = (
+        "\n".join(f"  - {k}: {v}" for k, v in on_request_signs.items())
+        if on_request_signs
+        else "  - 无特殊发现"
+    )
+
+    # 提取患者信息
+    patient_info = case.patient_info or {}
+    age = patient_info.get("age", "未知")
+    gender = patient_info.get("gender", "未知")
+    occupation = patient_info.get("occupation", "未知")
+
+    # 既往史
+    past_history = case.past_history or {}
+    diseases = past_history.get("diseases", [])
+    allergies = past_history.get("allergies", [])
+    medications = past_history.get("medications", [])
+
+    # 婚育个人史和家族史
+    marriage_history = getattr(case, "marriage_childbearing_history", None) or "未提供"
+    fam_history = getattr(case, "family_history", None) or "未提供"
+
+    # 病例序号
+    case_num = getattr(case, "case_number", None)
+    case_number_line = f"\n病例序号：{case_num}" if case_num else ""
+
+    # 初步诊断（隐藏信息，仅供终止判断使用）
+    std_diag = case.standard_diagnosis or {}
+    primary_diag = std_diag.get("primary", "未知")
+    differential = std_diag.get("differential", [])
+
+    return f"""你扮演的患者信息：
+- 年龄：{age}岁
+- 性别：{"男" if gender == "male" else "女" if gender == "female" else gender}
+- 职业：{occupation}{case_number_line}
+
+主诉：{case.chief_complaint}
+
+现病史：{case.present_illness}
+
+既往史：
+- 疾病史：{", ".join(diseases) if diseases else "无"}
+- 过敏史：{", ".join(allergies) if allergies else "无"}
+- 用药史：{", ".join(medications) if medications else "无"}
+
+婚育个人史：{marriage_history}
+
+家族史：{fam_history}
+
+可见体征（医生一眼能看到的）：
+{visible_str}
+
+体格检查结果（医生检查时你要描述的感受）：
+{on_request_str}
+
+【隐藏信息 - 仅用于诊断终止时的比对，不要主动提及】
+初步诊断：{primary_diag}
+鉴别诊断：{", ".join(differential) if differential else "无"}
+
+【再次强调】你只是一个普通患者：
+- 绝对禁止说"我给你开药"、"你需要吃xx药"、"建议你xxx"这类话
+- 医生说吃药就说"好的"，医生说检查就说"行"
+- 你来看病是求助的，不是给建议的
+"""
+
+
+@dataclass(frozen=True)
+class CompiledCase:
+    """病例编译产物（只读）。"""
+
+    case_id: int
+    updated_at: datetime | None
+    developer_prompt: str
+    developer_prompt_tokens: int
+    # 每轮对话共享的静态前缀消息（只读，调用方不得修改）
+    prefix_messages: tuple[dict[str, str], ...]
+    # 静态前缀的稳定哈希（用于后端亲和路由与前缀命中统计）
+    prefix_hash: str
+    # test_type -> 病例中的检查项（type/name/result）
+    test_index: Mapping[str, Mapping[str, Any]]
+    # test_type -> 预格式化的检查结果文本（format_test_result_text）
+    test_result_texts: Mapping[str, str]
+    # (关键点, 匹配词) 列表，供评分使用
+    key_point_keywords: tuple[tuple[str, tuple[str, ...]], ...]
+
+    @property
+    def test_types(self) -> frozenset[str]:
+        return frozenset(self.test_index)
+
+
+def prefix_hash(messages: tuple[dict[str, str], ...]) -> str:
+    """计算静态前缀消息的稳定哈希（与 JSON 序列化后发送的字节一一对应）。"""
+    raw = json.dumps(messages, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def compile_case(case: Case) -> CompiledCase:
+    """把病例编译为 CompiledCase（不使用缓存）。"""
+    from src.apps.api.services.scoring import ScoringService
+
+    test_index: dict[str, Mapping[str, Any]] = {}
+    for t in case.available_tests or []:
+        if isinstance(t, dict) and t.get("type"):
+            test_index.setdefault(str(t["type"]), MappingProxyType(dict(t)))
+
+    test_result_texts = {
+        test_type: format_test_result_text(
+            str(info.get("name", test_type)), info.get("result", {}) or {}
+        )
+        for test_type, info in test_index.items()
+    }
+
+    developer_prompt = build_developer_prompt(case)
+    prefix_messages = (
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "system", "content": developer_prompt},
+    )
+    return CompiledCase(
+        case_id=case.id,
+        updated_at=case.updated_at,
+        developer_prompt=developer_prompt,
+        developer_prompt_tokens=count_tokens(developer_prompt),
+        prefix_messages=prefix_messages,
+        prefix_hash=prefix_hash(prefix_messages),
+        test_index=MappingProxyType(test_index),
+        test_result_texts=MappingProxyType(test_result_texts),
+        key_point_keywords=tuple(
+            (point, tuple(ScoringService._extract_point_keywords(point)))
+            for point in (case.key_points or [])
+        ),
+    )
+
+
+# 进程内 LRU 缓存：(case_id, updated_at) -> CompiledCase
+_cache: OrderedDict[tuple[int, datetime | None], CompiledCase] = OrderedDict()
+
+
+def get_compiled_case(case: Case) -> CompiledCase:
+    """获取病例编译产物（命中缓存则直接返回）。"""
+    key = (case.id, case.updated_at)
+    compiled = _cache.get(key)
+    if compiled is not None:
+        _cache.move_to_end(key)
+        return compiled
+
+    compiled = compile_case(case)
+    _cache[key] = compiled
+    while len(_cache) > settings.COMPILED_CASE_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return compiled
+
+
+async def preload_fixed_cases() -> int:
+    """预热所有启用的固定病例（应用启动时调用）。
+
+    Returns:
+        预热的病例数量
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(Case).where(
+                Case.is_active == True,  # noqa: E712
+                Case.source == "fixed",
+            )
+        )
+        cases = result.scalars().all()
+
+    for case in cases:
+        get_compiled_case(case)
+    logger.info("固定病例编译缓存已预热", count=len(cases))
+    return len(cases)
+
+
+__all__ = [
+    "SYSTEM_PROMPT",
+    "CompiledCase",
+    "build_developer_prompt",
+    "compile_case",
+    "get_compiled_case",
+    "prefix_hash",
+    "preload_fixed_cases",
+]
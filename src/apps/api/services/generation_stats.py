@@ -0,0 +1,171 @@
+"""生成延迟统计：排队、建连、首 token（TTFT）、token 间隔（ITL）与吞吐。
+
+一次生成的各时间点由 ChatStreamRelay 记录在 GenerationTiming 中（time.perf_counter）：
+- 排队：准入 Ticket 的入队到放行
+- 建连：发起上游请求到收到响应头
+- TTFT：发起上游请求到首个回复增量
+- ITL：相邻回复增量的间隔（vLLM 流式输出通常每个增量一个 token）
+- 吞吐：首 token 之后的解码速度（token/秒）
+
+生成结束时 record_generation 把各项写入进程内直方图（按后端区分，见 /health/llm），
+并返回 generation_stats 表的一行，随本轮消息一起交给写入队列落库（带病例ID，按病例分析）。
+token 数优先使用 vLLM 报告的 usage（同时计入 llm_tokens_total），没有 usage 时按增量数计。
+病例ID基数高，不作为直方图标签。
+"""
+
+from __future__ import annotations
+
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+from src.apps.api.config import settings
+from src.apps.api.logging_config import logger
+from src.apps.api.services.metrics import LATENCY_MS_BUCKETS, Histogram, llm_tokens
+
+ITL_MS_BUCKETS = (5, 10, 15, 20, 30, 40, 50, 75, 100, 150, 200, 300, 500, 1000, 2000)
+TOKENS_PER_S_BUCKETS = (1, 2, 5, 10, 15, 20, 25, 30, 40, 50, 60, 80, 100, 150, 200)
+
+queue_wait_ms = Histogram(
+    "llm_queue_wait_ms", "准入排队耗时（毫秒）", LATENCY_MS_BUCKETS, ("backend",)
+)
+connect_ms = Histogram(
+    "llm_connect_ms", "上游建连到响应头耗时（毫秒）", LATENCY_MS_BUCKETS, ("backend",)
+)
+ttft_ms = Histogram("llm_ttft_ms", "首 token 延迟（毫秒）", LATENCY_MS_BUCKETS, ("backend",))
+itl_ms = Histogram("llm_itl_ms", "token 间隔（毫秒）", ITL_MS_BUCKETS, ("backend",))
+tokens_per_s = Histogram(
+    "llm_tokens_per_s", "解码吞吐（token/秒）", TOKENS_PER_S_BUCKETS, ("backend",)
+)
+total_ms = Histogram(
+    "llm_generation_ms", "上游生成总耗时（毫秒）", LATENCY_MS_BUCKETS, ("backend",)
+)
+
+HISTOGRAMS = (queue_wait_ms, connect_ms, ttft_ms, itl_ms, tokens_per_s, total_ms)
+
+
+def _ms(start: float | None, end: float | None) -> int | None:
+    if start is None or end is None:
+        return None
+    return int((end - start) * 1000)
+
+
+@dataclass
+class GenerationTiming:
+    """单次生成的时间点（time.perf_counter 秒）。"""
+
+    queue_wait: float = 0.0
+    started_at: float | None = None
+    connected_at: float | None = None
+    first_token_at: float | None = None
+    last_token_at: float | None = None
+    finished_at: float | None = None
+    tokens: int = 0
+    # 相邻回复增量的间隔（秒）
+    gaps: list[float] = field(default_factory=list)
+    backend: str | None = None
+
+    def start(self) -> None:
+        self.started_at = time.perf_counter()
+
+    def connected(self, backend: str) -> None:
+        self.connected_at = time.perf_counter()
+        self.backend = backend
+
+    def token(self) -> None:
+        now = time.perf_counter()
+        if self.last_token_at is None:
+            self.first_token_at = now
+        else:
+            self.gaps.append(now - self.last_token_at)
+        self.last_token_at = now
+        self.tokens += 1
+
+    def finish(self) -> None:
+        if self.finished_at is None:
+            self.finished_at = time.perf_counter()
+
+    def summary(self) -> dict[str, Any]:
+        """汇总为毫秒 / 吞吐指标（未发生的阶段为 None）。"""
+        itl_mean = itl_p95 = rate = None
+        if self.gaps:
+            ordered = sorted(self.gaps)
+            itl_mean = round(sum(ordered) / len(ordered) * 1000, 2)
+            itl_p95 = round(ordered[math.ceil(0.95 * len(ordered)) - 1] * 1000, 2)
+            span = (self.last_token_at or 0.0) - (self.first_token_at or 0.0)
+            if span > 0:
+                rate = round(len(self.gaps) / span, 2)
+        return {
+            "backend": self.backend,
+            "completion_tokens": self.tokens,
+            "queue_wait_ms": int(self.queue_wait * 1000),
+            "connect_ms": _ms(self.started_at, self.connected_at),
+            "ttft_ms": _ms(self.started_at, self.first_token_at),
+            "itl_mean_ms": itl_mean,
+            "itl_p95_ms": itl_p95,
+            "tokens_per_s": rate,
+            "total_ms": _ms(self.started_at, self.finished_at or time.perf_counter()) or 0,
+        }
+
+
+def record_generation(
+    timing: GenerationTiming,
+    session_id: int,
+    case_id: int,
+    finish_reason: str | None,
+    usage: dict[str, int] | None = None,
+) -> dict[str, Any]:
+    """把一次生成的延迟写入直方图，并返回 generation_stats 表的一行。
+
+    Args:
+        timing: 生成的时间点
+        session_id: 会话ID
+        case_id: 病例ID
+        finish_reason: 结束原因（出错时为 None）
+        usage: vLLM 报告的 token 用量（prompt_tokens / completion_tokens）
+
+    Returns:
+        generation_stats 插入参数
+    """
+    row = timing.summary()
+    # 部分后端的 usage 只带其中一项：缺的项保持本地计数（prompt 为 None）
+    usage = usage or {}
+    row["prompt_tokens"] = usage.get("prompt_tokens")
+    if row["prompt_tokens"] is not None:
+        llm_tokens.labels("chat", "prompt").inc(row["prompt_tokens"])
+    if usage.get("completion_tokens") is not None:
+        row["completion_tokens"] = usage["completion_tokens"]
+        llm_tokens.labels("chat", "completion").inc(row["completion_tokens"])
+    backend = row["backend"] or ""
+    queue_wait_ms.observe(row["queue_wait_ms"], backend=backend)
+    total_ms.observe(row["total_ms"], backend=backend)
+    if row["connect_ms"] is not None:
+        connect_ms.observe(row["connect_ms"], backend=backend)
+    if row["ttft_ms"] is not None:
+        ttft_ms.observe(row["ttft_ms"], backend=backend)
+    for gap in timing.gaps:
+        itl_ms.observe(gap * 1000, backend=backend)
+    if row["tokens_per_s"] is not None:
+        tokens_per_s.observe(row["tokens_per_s"], backend=backend)
+
+    logger.debug("生成延迟", session_id=session_id, case_id=case_id, **row)
+    row.update(
+        session_id=session_id,
+        case_id=case_id,
+        model=settings.LLM_MODEL,
+        finish_reason=finish_reason,
+    )
+    return row
+
+
+def snapshot() -> dict[str, list[dict[str, Any]]]:
+    """导出各延迟直方图（按后端）。"""
+    return {histogram.name: histogram.snapshot() for histogram in HISTOGRAMS}
+
+
+__all__ = [
+    "GenerationTiming",
+    "record_generation",
+    "snapshot",
+]
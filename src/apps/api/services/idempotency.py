@@ -0,0 +1,193 @@
+"""对话请求的幂等键（Idempotency-Key）。
+
+双击发送或前端超时重试会重复提交 POST /api/chat/，导致第二次 vLLM 生成和重复的用户消息。
+客户端为每条消息生成一个幂等键放在 Idempotency-Key 请求头中：
+- 首个请求占用该键，结果（可恢复流，见 stream_registry）登记到键上
+- TTL 内的重复请求不再调用 LLM：生成仍在进行时挂到同一个流上，已完成则回放该流的事件
+- 首个请求尚在准备阶段（查库、排队前）时，重复请求等待其结果
+- 首个请求未产生结果（如 4xx/503）时释放该键，重复请求按新请求处理
+- 同一个键配不同的请求体返回 422
+- 键按用户隔离；超过 CHAT_IDEMPOTENCY_TTL 秒过期，最多保留 CHAT_IDEMPOTENCY_MAX_KEYS 个
+  （超出时淘汰最早的）。完成的流随键一起保留，以便过期前都能回放
+
+键只保存在当前进程内：多 worker 部署时重复请求需要落到同一 worker 才能去重。
+所有状态只在事件循环线程中读写，无需加锁。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any
+
+from fastapi import HTTPException, status
+
+from src.apps.api.config import settings
+from src.apps.api.logging_config import logger
+from src.apps.api.services.stream_registry import ResumableStream
+
+
+def request_fingerprint(*parts: Any) -> str:
+    """请求体指纹（同一个键必须对应同一个请求）。"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "created_at", "result")
+
+    def __init__(self, fingerprint: str) -> None:
+        self.fingerprint = fingerprint
+        self.created_at = time.monotonic()
+        # 首个请求的结果：流（成功）或 None（失败，键已释放）
+        self.result: asyncio.Future[ResumableStream | None] = (
+            asyncio.get_running_loop().create_future()
+        )
+
+
+class IdempotencyClaim:
+    """一次请求对幂等键的占用结果。
+
+    replay 不为 None 时，调用方应直接回放该流；否则调用方拥有该键，
+    须在产生流时调用 resolve()，并在结束时调用 release()（已 resolve 时为空操作）。
+    未携带幂等键的请求得到一个空占用，所有方法均为空操作。
+    """
+
+    def __init__(
+        self,
+        store: IdempotencyStore | None = None,
+        scope: tuple[int, str] | None = None,
+        entry: _Entry | None = None,
+        replay: ResumableStream | None = None,
+    ) -> None:
+        self._store = store
+        self._scope = scope
+        self._entry = entry
+        self.replay = replay
+
+    def resolve(self, stream: ResumableStream) -> None:
+        """登记首个请求的结果。"""
+        if self._entry is not None and not self._entry.result.done():
+            self._entry.result.set_result(stream)
+
+    def release(self) -> None:
+        """首个请求未产生结果时释放该键（已 resolve 时为空操作）。"""
+        entry = self._entry
+        if entry is None or entry.result.done():
+            return
+        entry.result.set_result(None)
+        if self._store is not None and self._scope is not None:
+            self._store._discard(self._scope, entry)
+
+
+class IdempotencyStore:
+    """进程内幂等键存储（TTL + 条目数上限，按创建顺序淘汰）。"""
+
+    def __init__(self) -> None:
+        self._entries: OrderedDict[tuple[int, str], _Entry] = OrderedDict()
+        self.hits = 0
+        self.conflicts = 0
+        self.evictions = 0
+
+    async def claim(self, user_id: int, key: str | None, fingerprint: str) -> IdempotencyClaim:
+        """占用幂等键，或取得同键首个请求的结果。
+
+        Args:
+            user_id: 当前用户ID
+            key: Idempotency-Key 请求头（None 表示未携带）
+            fingerprint: 请求体指纹
+
+        Returns:
+            占用结果（replay 不为 None 表示重复请求）
+
+        Raises:
+            HTTPException: 422 如果同一个键对应了不同的请求体
+            HTTPException: 409 如果首个请求迟迟未产生结果
+        """
+        if key is None:
+            return IdempotencyClaim()
+
+        scope = (user_id, key)
+        while True:
+            self._purge()
+            entry = self._entries.get(scope)
+            if entry is None:
+                entry = _Entry(fingerprint)
+                self._entries[scope] = entry
+                self._evict()
+                return IdempotencyClaim(self, scope, entry)
+
+            if entry.fingerprint != fingerprint:
+                self.conflicts += 1
+                raise HTTPException(
+                    # 422：Idempotency-Key 草案对键复用的约定（常量名在不同 Starlette 版本中不同）
+                    status_code=422,
+                    detail="Idempotency-Key 已用于另一条不同的消息",
+                )
+
+            try:
+                stream = await asyncio.wait_for(
+                    asyncio.shield(entry.result), timeout=settings.CHAT_IDEMPOTENCY_WAIT
+                )
+            except TimeoutError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="相同请求仍在处理中，请稍后重试",
+                ) from e
+            if stream is None:
+                # 首个请求失败且已释放该键：重新占用
+                continue
+
+            self.hits += 1
+            logger.info(
+                "重复的对话请求，回放已有生成",
+                user_id=user_id,
+                stream_id=stream.stream_id,
+                done=stream.done,
+            )
+            return IdempotencyClaim(replay=stream)
+
+    def _discard(self, scope: tuple[int, str], entry: _Entry) -> None:
+        if self._entries.get(scope) is entry:
+            del self._entries[scope]
+
+    def _purge(self) -> None:
+        # 条目按创建顺序排列，过期条目都在头部
+        now = time.monotonic()
+        while self._entries:
+            scope, entry = next(iter(self._entries.items()))
+            if now - entry.created_at < settings.CHAT_IDEMPOTENCY_TTL:
+                break
+            del self._entries[scope]
+
+    def _evict(self) -> None:
+        while len(self._entries) > settings.CHAT_IDEMPOTENCY_MAX_KEYS:
+            _scope, entry = self._entries.popitem(last=False)
+            self.evictions += 1
+            if not entry.result.done():
+                entry.result.set_result(None)
+
+    def snapshot(self) -> dict[str, int]:
+        """导出幂等键统计。"""
+        return {
+            "keys": len(self._entries),
+            "hits": self.hits,
+            "conflicts": self.conflicts,
+            "evictions": self.evictions,
+        }
+
+
+idempotency_store = IdempotencyStore()
+
+
+__all__ = [
+    "IdempotencyClaim",
+    "IdempotencyStore",
+    "idempotency_store",
+    "request_fingerprint",
+]
@@ -0,0 +1,276 @@
+"""增量 JSON 校验（流式生成时尽早发现错误）。
+
+病例生成改为流式后，LLM 输出的增量逐段喂给 IncrementalJsonValidator，无需等待完整输出：
+- 结构错误（非法字符、缺逗号 / 冒号、括号不匹配）在出现的那个字符处报错
+- 枚举字段（如 difficulty、gender、test_type）按前缀校验：值的前几个字符已不可能
+  匹配任何允许值时立即报错，不必等字符串结束
+- 失控输出（单个字符串过长、数组元素过多，常见于小模型的重复循环）超过上限即报错
+
+校验器只判断“已经不可能合法”，不检查必需字段是否齐全（输出结束后由完整解析检查）。
+路径用元组表示，对象键为字符串，数组元素统一为 "*"，如 ("available_tests", "*", "type")。
+"""
+
+from __future__ import annotations
+
+from collections.abc import Collection, Mapping
+
+# 数组元素的路径占位
+ITEM = "*"
+
+_WHITESPACE = frozenset(" \t\r\n")
+_NUMBER_CHARS = frozenset("0123456789+-.eE")
+_LITERALS = {"t": "true", "f": "false", "n": "null"}
+_ESCAPES = frozenset('"\\/bfnrtu')
+
+# 容器帧的状态
+_OBJ_KEY_OR_END = 0  # "{" 之后
+_OBJ_KEY = 1  # "," 之后
+_OBJ_COLON = 2
+_OBJ_VALUE = 3
+_OBJ_COMMA_OR_END = 4
+_ARR_VALUE_OR_END = 5  # "[" 之后
+_ARR_VALUE = 6  # "," 之后
+_ARR_COMMA_OR_END = 7
+
+
+class StreamValidationError(ValueError):
+    """输出已不可能合法。
+
+    Args:
+        reason: 错误类别（syntax / enum / runaway）
+        message: 错误说明
+        position: 出错位置（已接收的字符数）
+    """
+
+    def __init__(self, reason: str, message: str, position: int) -> None:
+        super().__init__(message)
+        self.reason = reason
+        self.position = position
+
+
+class _Frame:
+    __slots__ = ("is_object", "state", "key", "items")
+
+    def __init__(self, is_object: bool) -> None:
+        self.is_object = is_object
+        self.state = _OBJ_KEY_OR_END if is_object else _ARR_VALUE_OR_END
+        self.key: str | None = None
+        self.items = 0
+
+
+class IncrementalJsonValidator:
+    """逐段接收 JSON 文本并增量校验。
+
+    Args:
+        enums: 路径 -> 允许的字符串取值
+        max_string: 单个字符串（键或值）的最大字符数
+        max_items: 单个数组的最大元素数
+        skip_preamble: 是否跳过第一个 "{" 之前的文本（如 ```json 代码块标记）；
+            根对象结束后的文本总是忽略
+    """
+
+    def __init__(
+        self,
+        enums: Mapping[tuple[str, ...], Collection[str]] | None = None,
+        max_string: int = 2000,
+        max_items: int = 100,
+        skip_preamble: bool = False,
+    ) -> None:
+        self._enums = {path: tuple(values) for path, values in (enums or {}).items()}
+        self._max_string = max_string
+        self._max_items = max_items
+        self._started = not skip_preamble
+        self._stack: list[_Frame] = []
+        self._position = 0
+        # 正在读取的标量：字符串 / 数字 / 字面量
+        self._string: list[str] | None = None
+        self._string_is_key = False
+        self._string_enum: tuple[str, ...] | None = None
+        self._escape = False
+        self._unicode = 0
+        self._number: list[str] | None = None
+        self._literal: str | None = None
+        self._literal_at = 0
+        self.complete = False
+
+    def feed(self, text: str) -> None:
+        """接收一段输出。
+
+        Raises:
+            StreamValidationError: 已接收的内容不可能构成合法输出
+        """
+        for char in text:
+            if self.complete:
+                return
+            self._position += 1
+            self._step(char)
+
+    def _fail(self, reason: str, message: str) -> None:
+        raise StreamValidationError(reason, message, self._position)
+
+    def _path(self) -> tuple[str, ...]:
+        return tuple((frame.key or "") if frame.is_object else ITEM for frame in self._stack)
+
+    def _step(self, char: str) -> None:
+        if self._string is not None:
+            self._string_char(char)
+            return
+        if self._number is not None:
+            if char in _NUMBER_CHARS:
+                self._number.append(char)
+                return
+            self._end_number()
+        if self._literal is not None:
+            self._literal_char(char)
+            return
+        if char in _WHITESPACE:
+            return
+        if not self._started:
+            if char == "{":
+                self._started = True
+                self._stack.append(_Frame(is_object=True))
+            return
+        if not self._stack:
+            if char != "{":
+                self._fail("syntax", f"输出应以对象开始，遇到 {char!r}")
+            self._stack.append(_Frame(is_object=True))
+            return
+        self._structural(char)
+
+    def _structural(self, char: str) -> None:
+        frame = self._stack[-1]
+        state = frame.state
+        if frame.is_object:
+            if state in (_OBJ_KEY_OR_END, _OBJ_KEY):
+                if char == '"':
+                    self._open_string(is_key=True)
+                elif char == "}" and state == _OBJ_KEY_OR_END:
+                    self._close()
+                else:
+                    self._fail("syntax", f"对象中应为键，遇到 {char!r}")
+            elif state == _OBJ_COLON:
+                if char != ":":
+                    self._fail("syntax", f"键之后应为冒号，遇到 {char!r}")
+                frame.state = _OBJ_VALUE
+            elif state == _OBJ_VALUE:
+                self._open_value(char)
+            elif char == ",":
+                frame.state = _OBJ_KEY
+            elif char == "}":
+                self._close()
+            else:
+                self._fail("syntax", f"对象成员之后应为逗号或右花括号，遇到 {char!r}")
+            return
+
+        if state in (_ARR_VALUE_OR_END, _ARR_VALUE):
+            if char == "]" and state == _ARR_VALUE_OR_END:
+                self._close()
+                return
+            frame.items += 1
+            if frame.items > self._max_items:
+                self._fail(
+                    "runaway", f"{'.'.join(self._path()[:-1])} 数组元素超过 {self._max_items} 个"
+                )
+            self._open_value(char)
+        elif char == ",":
+            frame.state = _ARR_VALUE
+        elif char == "]":
+            self._close()
+        else:
+            self._fail("syntax", f"数组元素之后应为逗号或右方括号，遇到 {char!r}")
+
+    def _open_value(self, char: str) -> None:
+        frame = self._stack[-1]
+        frame.state = _OBJ_COMMA_OR_END if frame.is_object else _ARR_COMMA_OR_END
+        path = self._path()
+        enum = self._enums.get(path)
+        if enum is not None and char != '"':
+            self._fail("enum", f"{'.'.join(path)} 应为字符串枚举值")
+        if char == '"':
+            self._open_string(is_key=False, enum=enum)
+        elif char == "{":
+            self._stack.append(_Frame(is_object=True))
+        elif char == "[":
+            self._stack.append(_Frame(is_object=False))
+        elif char in _NUMBER_CHARS and char not in "+.eE":
+            self._number = [char]
+        elif char in _LITERALS:
+            self._literal = _LITERALS[char]
+            self._literal_at = 1
+        else:
+            self._fail("syntax", f"应为值，遇到 {char!r}")
+
+    def _close(self) -> None:
+        self._stack.pop()
+        if not self._stack:
+            self.complete = True
+
+    def _open_string(self, is_key: bool, enum: tuple[str, ...] | None = None) -> None:
+        self._string = []
+        self._string_is_key = is_key
+        self._string_enum = enum
+
+    def _string_char(self, char: str) -> None:
+        assert self._string is not None
+        if self._unicode:
+            if char not in "0123456789abcdefABCDEF":
+                self._fail("syntax", "\\u 转义之后应为 4 位十六进制数")
+            self._unicode -= 1
+            return
+        if self._escape:
+            if char not in _ESCAPES:
+                self._fail("syntax", f"非法转义 \\{char}")
+            self._escape = False
+            if char == "u":
+                self._unicode = 4
+            self._string.append(char)
+            return
+        if char == "\\":
+            self._escape = True
+            return
+        if char == '"':
+            self._end_string()
+            return
+        if char < " ":
+            self._fail("syntax", "字符串中出现未转义的控制字符")
+        self._string.append(char)
+        if len(self._string) > self._max_string:
+            self._fail("runaway", f"{'.'.join(self._path())} 字符串超过 {self._max_string} 字符")
+        if self._string_enum is not None:
+            prefix = "".join(self._string)
+            if not any(value.startswith(prefix) for value in self._string_enum):
+                self._fail("enum", f"{'.'.join(self._path())} 的取值 {prefix!r} 不在允许范围内")
+
+    def _end_string(self) -> None:
+        value = "".join(self._string or ())
+        self._string = None
+        frame = self._stack[-1]
+        if self._string_is_key:
+            frame.key = value
+            frame.state = _OBJ_COLON
+            return
+        if self._string_enum is not None and value not in self._string_enum:
+            self._fail("enum", f"{'.'.join(self._path())} 的取值 {value!r} 不在允许范围内")
+
+    def _end_number(self) -> None:
+        text = "".join(self._number or ())
+        self._number = None
+        try:
+            float(text)
+        except ValueError:
+            self._fail("syntax", f"非法数字 {text!r}")
+
+    def _literal_char(self, char: str) -> None:
+        assert self._literal is not None
+        if char != self._literal[self._literal_at]:
+            self._fail("syntax", f"非法字面量，应为 {self._literal}")
+        self._literal_at += 1
+        if self._literal_at == len(self._literal):
+            self._literal = None
+
+
+__all__ = [
+    "ITEM",
+    "IncrementalJsonValidator",
+    "StreamValidationError",
+]
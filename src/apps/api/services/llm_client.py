@@ -0,0 +1,217 @@
+"""LLM HTTP 客户端。
+
+应用级共享一个 httpx.AsyncClient：
+- 在 FastAPI lifespan 中创建与关闭
+- keep-alive 连接池复用到 vLLM 的 TCP（及 TLS）连接，避免每轮对话重新建连
+- 可选 HTTP/2（需要安装 h2，未安装时自动回退到 HTTP/1.1）
+
+多副本部署时（LLM_BACKEND_URLS）由 LLMBackendPool 选择副本（见 llm_pool）：
+- 携带亲和键（静态前缀哈希）的请求优先路由到同一副本，
+  使同一病例的系统提示词前缀命中该副本的 vLLM 前缀 KV 缓存
+- 其余请求（摘要、病例生成等）按最少在途请求分发
+- PrefixCacheStats 按副本记录最近见过的前缀，估算前缀命中率
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Sequence
+from contextlib import asynccontextmanager
+from typing import Any
+
+import httpx
+
+from src.apps.api.config import settings
+from src.apps.api.logging_config import logger
+from src.apps.api.services.llm_pool import Backend, LLMBackendPool, backend_urls
+
+CHAT_COMPLETIONS_PATH = "/v1/chat/completions"
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # type: ignore  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def build_http_client() -> httpx.AsyncClient:
+    """按配置构建带连接池的 httpx.AsyncClient。"""
+    http2 = settings.LLM_HTTP2
+    if http2 and not _http2_available():
+        logger.warning("未安装 h2，LLM 客户端回退到 HTTP/1.1")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=settings.LLM_POOL_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        settings.LLM_TIMEOUT,
+        connect=settings.LLM_CONNECT_TIMEOUT,
+        pool=settings.LLM_POOL_TIMEOUT,
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
+
+
+class PrefixCacheStats:
+    """按后端统计静态前缀的（估算）命中率。
+
+    每个后端记录最近见过的前缀哈希（LRU）；请求的前缀已在该后端出现过即视为命中。
+    vLLM 的前缀缓存可能已被淘汰，因此这是命中率的上界估计。
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self._capacity = capacity
+        self._seen: dict[str, OrderedDict[str, None]] = {}
+        self.requests = 0
+        self.hits = 0
+        self.per_backend: dict[str, dict[str, int]] = {}
+
+    def record(self, backend: str, prefix_key: str) -> bool:
+        """记录一次带前缀的请求，返回是否（估算）命中。"""
+        seen = self._seen.setdefault(backend, OrderedDict())
+        counters = self.per_backend.setdefault(backend, {"requests": 0, "hits": 0})
+        hit = prefix_key in seen
+        if hit:
+            seen.move_to_end(prefix_key)
+        else:
+            seen[prefix_key] = None
+            while len(seen) > self._capacity:
+                seen.popitem(last=False)
+
+        self.requests += 1
+        counters["requests"] += 1
+        if hit:
+            self.hits += 1
+            counters["hits"] += 1
+        return hit
+
+    def snapshot(self) -> dict[str, Any]:
+        """导出统计快照。"""
+        return {
+            "requests": self.requests,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.requests, 4) if self.requests else 0.0,
+            "backends": {
+                backend: {
+                    **counters,
+                    "distinct_prefixes": len(self._seen.get(backend, ())),
+                }
+                for backend, counters in self.per_backend.items()
+            },
+        }
+
+
+class LLMClient:
+    """OpenAI 兼容接口（vLLM）的薄封装，复用同一个连接池，按后端池选择副本。"""
+
+    def __init__(self, http_client: httpx.AsyncClient, base_urls: Sequence[str]) -> None:
+        self._http = http_client
+        self.pool = LLMBackendPool(base_urls)
+        self.prefix_stats = PrefixCacheStats(settings.LLM_PREFIX_STATS_SIZE)
+
+    @property
+    def backends(self) -> list[str]:
+        return [backend.url for backend in self.pool.backends]
+
+    @property
+    def base_url(self) -> str:
+        return self.pool.backends[0].url
+
+    def _prepare(self, affinity_key: str | None, backend: Backend) -> str:
+        if affinity_key is not None:
+            self.prefix_stats.record(backend.url, affinity_key)
+        return f"{backend.url}{CHAT_COMPLETIONS_PATH}"
+
+    @asynccontextmanager
+    async def stream_chat(
+        self,
+        payload: dict[str, Any],
+        affinity_key: str | None = None,
+    ) -> AsyncIterator[httpx.Response]:
+        """以流式方式调用 chat completions。
+
+        退出上下文时关闭响应，连接归还连接池（而不是断开）。
+
+        Args:
+            payload: 请求体
+            affinity_key: 可选亲和键（通常为静态前缀哈希），用于优先路由到同一后端
+        """
+        async with self.pool.lease(affinity_key) as backend:
+            url = self._prepare(affinity_key, backend)
+            async with self._http.stream("POST", url, json=payload) as response:
+                self.pool.report_status(backend, response.status_code)
+                yield response
+
+    async def post_chat(
+        self,
+        payload: dict[str, Any],
+        affinity_key: str | None = None,
+    ) -> httpx.Response:
+        """以非流式方式调用 chat completions。"""
+        async with self.pool.lease(affinity_key) as backend:
+            url = self._prepare(affinity_key, backend)
+            response = await self._http.post(url, json=payload)
+            self.pool.report_status(backend, response.status_code)
+            return response
+
+    def start_health_checks(self) -> None:
+        """启动后端池的主动健康检查。"""
+        self.pool.start_health_checks(self._http)
+
+    async def aclose(self) -> None:
+        await self.pool.stop_health_checks()
+        await self._http.aclose()
+
+
+# 应用级单例（由 lifespan 管理）
+_llm_client: LLMClient | None = None
+
+
+async def init_llm_client() -> LLMClient:
+    """创建全局 LLM 客户端（应用启动时调用）。"""
+    global _llm_client
+    if _llm_client is None:
+        _llm_client = LLMClient(build_http_client(), backend_urls())
+        _llm_client.start_health_checks()
+        logger.info(
+            "LLM 客户端已初始化",
+            backends=_llm_client.backends,
+            prefix_affinity=settings.LLM_PREFIX_AFFINITY,
+            max_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+            http2=settings.LLM_HTTP2,
+        )
+    return _llm_client
+
+
+async def close_llm_client() -> None:
+    """关闭全局 LLM 客户端（应用关闭时调用）。"""
+    global _llm_client
+    if _llm_client is not None:
+        await _llm_client.aclose()
+        _llm_client = None
+        logger.info("LLM 客户端已关闭")
+
+
+def get_llm_client() -> LLMClient:
+    """获取全局 LLM 客户端。
+
+    正常情况下由 lifespan 预先创建；脚本等未经过 lifespan 的场景按需懒创建。
+    """
+    global _llm_client
+    if _llm_client is None:
+        _llm_client = LLMClient(build_http_client(), backend_urls())
+    return _llm_client
+
+
+__all__ = [
+    "LLMClient",
+    "PrefixCacheStats",
+    "build_http_client",
+    "close_llm_client",
+    "get_llm_client",
+    "init_llm_client",
+]
@@ -0,0 +1,217 @@
+"""vLLM 多后端池。
+
+在应用内对多个 vLLM 副本做负载均衡，无需外部代理：
+- 最少在途请求（least outstanding requests）路由；带亲和键（静态前缀哈希）的请求
+  优先落到 rendezvous 哈希选中的副本，除非它明显比最空闲的副本更忙，
+  或已达到 LLM_MAX_IN_FLIGHT_PER_BACKEND（单副本在途上限）
+- 被动摘除：连续 LLM_EJECT_FAILURES 次连接错误或 5xx 后摘除该副本
+- 主动健康检查：后台定期请求 LLM_HEALTH_CHECK_PATH，失败摘除、恢复后重新加入
+- 冷却期后摘除的副本可被再次试探（半开），一次成功即恢复
+- 按副本统计请求数、失败数、摘除次数与在途请求数
+
+所有状态只在事件循环线程中读写，无需加锁。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import itertools
+import time
+from collections.abc import AsyncIterator, Sequence
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any
+
+import httpx
+
+from src.apps.api.config import settings
+from src.apps.api.logging_config import logger
+
+
+def backend_urls() -> list[str]:
+    """配置的 vLLM 副本地址（LLM_BACKEND_URLS 为空时仅使用 LLM_BASE_URL）。"""
+    urls = settings.LLM_BACKEND_URLS or [settings.LLM_BASE_URL]
+    return [url.rstrip("/") for url in urls]
+
+
+def rendezvous_pick(key: str, backends: Sequence[str]) -> str:
+    """rendezvous（最高随机权重）哈希：同一 key 总是落到同一后端。
+
+    增删副本时只有原本落在该副本上的 key 会迁移，其余前缀缓存不受影响。
+    """
+    return max(
+        backends,
+        key=lambda backend: hashlib.blake2b(f"{key}|{backend}".encode(), digest_size=8).digest(),
+    )
+
+
+@dataclass
+class Backend:
+    """单个 vLLM 副本的运行状态。"""
+
+    url: str
+    healthy: bool = True
+    in_flight: int = 0
+    consecutive_failures: int = 0
+    ejected_at: float | None = None
+    requests: int = 0
+    failures: int = 0
+    ejections: int = 0
+    last_error: str | None = None
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+        }
+
+
+class LLMBackendPool:
+    """vLLM 副本池：选择后端、记录结果、维护健康状态。"""
+
+    def __init__(self, urls: Sequence[str]) -> None:
+        if not urls:
+            raise ValueError("至少需要一个 LLM 后端地址")
+        self.backends = [Backend(url=url.rstrip("/")) for url in urls]
+        self._by_url = {backend.url: backend for backend in self.backends}
+        self._tie_breaker = itertools.count()
+        self._health_task: asyncio.Task[None] | None = None
+
+    def _eligible(self, now: float) -> list[Backend]:
+        eligible = [
+            backend
+            for backend in self.backends
+            if backend.healthy
+            or (
+                backend.ejected_at is not None
+                and now - backend.ejected_at >= settings.LLM_EJECT_COOLDOWN
+            )
+        ]
+        # 全部被摘除时仍然尝试全部副本，比直接拒绝请求更可取
+        return eligible or self.backends
+
+    def choose(self, affinity_key: str | None = None) -> Backend:
+        """选择一个后端。
+
+        Args:
+            affinity_key: 可选亲和键（静态前缀哈希）
+
+        Returns:
+            选中的后端
+        """
+        candidates = self._eligible(time.monotonic())
+        if len(candidates) == 1:
+            return candidates[0]
+
+        least = min(backend.in_flight for backend in candidates)
+        if affinity_key is not None and settings.LLM_PREFIX_AFFINITY:
+            preferred = self._by_url[rendezvous_pick(affinity_key, [b.url for b in candidates])]
+            # 亲和只在副本未满时生效：准入控制保证总在途数不超过上限 × 健康副本数，
+            # 最空闲的副本必然未满，单个副本的在途数因此不会超过上限
+            if (
+                preferred.in_flight <= least + settings.LLM_AFFINITY_MAX_SKEW
+                and preferred.in_flight < settings.LLM_MAX_IN_FLIGHT_PER_BACKEND
+            ):
+                return preferred
+
+        idle = [backend for backend in candidates if backend.in_flight == least]
+        return idle[next(self._tie_breaker) % len(idle)]
+
+    @asynccontextmanager
+    async def lease(self, affinity_key: str | None = None) -> AsyncIterator[Backend]:
+        """选择后端并在上下文内计入在途请求；传输层异常计为该后端失败。"""
+        backend = self.choose(affinity_key)
+        backend.in_flight += 1
+        backend.requests += 1
+        try:
+            yield backend
+        except httpx.TransportError as e:
+            self.mark_failure(backend, f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            backend.in_flight -= 1
+
+    def report_status(self, backend: Backend, status_code: int) -> None:
+        """根据响应状态码记录结果（4xx 属于请求问题，不计入后端失败）。"""
+        if status_code >= 500:
+            self.mark_failure(backend, f"HTTP {status_code}")
+        else:
+            self.mark_success(backend)
+
+    def mark_success(self, backend: Backend) -> None:
+        backend.consecutive_failures = 0
+        if not backend.healthy:
+            backend.healthy = True
+            backend.ejected_at = None
+            logger.info("LLM 后端已恢复", backend=backend.url)
+
+    def mark_failure(self, backend: Backend, error: str) -> None:
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        backend.last_error = error
+        if backend.healthy and backend.consecutive_failures >= settings.LLM_EJECT_FAILURES:
+            backend.healthy = False
+            backend.ejections += 1
+            logger.warning("LLM 后端已摘除", backend=backend.url, error=error)
+        if not backend.healthy:
+            # 半开试探失败时重新计算冷却期
+            backend.ejected_at = time.monotonic()
+
+    async def check_backend(self, http_client: httpx.AsyncClient, backend: Backend) -> bool:
+        """主动探测单个后端。"""
+        try:
+            resp = await http_client.get(
+                f"{backend.url}{settings.LLM_HEALTH_CHECK_PATH}",
+                timeout=settings.LLM_HEALTH_CHECK_TIMEOUT,
+            )
+        except httpx.HTTPError as e:
+            self.mark_failure(backend, f"health check: {type(e).__name__}: {e}")
+            return False
+        if resp.status_code != 200:
+            self.mark_failure(backend, f"health check: HTTP {resp.status_code}")
+            return False
+        self.mark_success(backend)
+        return True
+
+    async def _health_loop(self, http_client: httpx.AsyncClient) -> None:
+        while True:
+            await asyncio.gather(
+                *(self.check_backend(http_client, backend) for backend in self.backends)
+            )
+            await asyncio.sleep(settings.LLM_HEALTH_CHECK_INTERVAL)
+
+    def start_health_checks(self, http_client: httpx.AsyncClient) -> None:
+        """启动后台健康检查（LLM_HEALTH_CHECK_INTERVAL <= 0 时不启动）。"""
+        if settings.LLM_HEALTH_CHECK_INTERVAL <= 0 or self._health_task is not None:
+            return
+        self._health_task = asyncio.create_task(self._health_loop(http_client))
+
+    async def stop_health_checks(self) -> None:
+        """停止后台健康检查。"""
+        task, self._health_task = self._health_task, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        """导出各后端状态与统计。"""
+        return [backend.snapshot() for backend in self.backends]
+
+
+__all__ = [
+    "Backend",
+    "LLMBackendPool",
+    "backend_urls",
+    "rendezvous_pick",
+]
@@ -0,0 +1,376 @@
+"""对话消息异步落库（write-behind）。
+
+每轮对话结束时不再单独开会话、逐条 add 并 commit，而是把消息放入进程内队列，
+由后台任务攒批后通过一次 Core 批量 INSERT 写入 messages 表：
+- 同一轮对话的多条消息作为一组入队，总在同一批次（同一事务）中写入；
+  该轮的生成延迟统计（generation_stats 行）随组一起写入
+- 首组消息入队后最多等待 MESSAGE_WRITER_FLUSH_MS 凑批，或凑满 MESSAGE_WRITER_BATCH_SIZE 立即写入
+- 写入失败按错误类型处理：
+  - 数据错误（DataError / IntegrityError，如内容含 NUL 字符）重试也不会成功：批次按组二分拆开
+    重写，定位到出错的那一组后记入死信日志（error 级别，含完整插入参数）并丢弃，不阻塞其他会话
+  - 其他错误（连接断开、超时等）视为暂时性，按指数退避重试，最多 MESSAGE_WRITER_MAX_RETRIES 次，
+    耗尽后整批记入死信日志；提交结果未知（连接在 COMMIT 时断开）的批次重试后可能出现重复消息
+- 待写消息超过 MESSAGE_WRITER_QUEUE_MAX 时入队方等待（背压），内存占用有界
+- 应用关闭时在 MESSAGE_WRITER_SHUTDOWN_TIMEOUT 内写完队列，超时未写入的消息记错误日志
+- 尚未写入的消息可按会话读出（pending_rows），历史加载时合并，保证本进程内读到自己的写入；
+  写入时取回新消息的 ID（persisted_id），最近写入的 MESSAGE_WRITER_QUEUE_MAX 条保留
+  临时 ID 到真实 ID 的映射，历史加载据此识别查询期间刚落库的消息
+
+未启动后台任务（脚本、测试）或关闭该功能时，submit 直接同步写入。
+
+所有状态只在事件循环线程中读写，无需加锁。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import time
+from collections import OrderedDict, deque
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, NamedTuple
+
+from sqlalchemy import exc, insert
+
+from src.apps.api.config import settings
+from src.apps.api.dependencies import engine
+from src.apps.api.logging_config import logger
+from src.apps.api.models import GenerationStat, Message
+
+# 尚未落库消息的临时 ID 起点：大于任何真实消息 ID，按“最新”参与历史排序与摘要判断
+PENDING_ID_BASE = 2**62
+
+# 重试也不会成功的数据库错误（数据本身不合法）
+_PERMANENT_ERRORS = (exc.DataError, exc.IntegrityError)
+
+
+@dataclass
+class PendingMessage:
+    """待写入 messages 表的一条消息。"""
+
+    session_id: int
+    role: str
+    content: str
+    tokens: int | None = None
+    latency_ms: int | None = None
+    finish_reason: str | None = None
+    # 入队时间（本地时钟，仅用于合并读取）
+    enqueued_at: datetime = field(default_factory=datetime.now)
+    pending_id: int = 0
+
+    def params(self) -> dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "role": self.role,
+            "content": self.content,
+            "tokens": self.tokens,
+            "latency_ms": self.latency_ms,
+            "finish_reason": self.finish_reason,
+        }
+
+
+class PendingRow(NamedTuple):
+    """尚未落库的消息，字段与历史窗口行一致。"""
+
+    id: int
+    role: str
+    content: str
+    tokens: int | None
+    created_at: datetime
+
+
+class _Group(NamedTuple):
+    messages: tuple[PendingMessage, ...]
+    stats: dict[str, Any] | None
+
+
+class MessageWriter:
+    """进程级消息写入队列。"""
+
+    def __init__(self) -> None:
+        self._groups: deque[_Group] = deque()
+        self._by_session: dict[int, list[PendingMessage]] = {}
+        # 最近落库消息的临时 ID -> 真实消息 ID（按写入顺序，条数有上限）
+        self._persisted_ids: OrderedDict[int, int] = OrderedDict()
+        self._queued = 0
+        self._ids = itertools.count(1)
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._written = asyncio.Condition()
+        self._task: asyncio.Task[None] | None = None
+        self._closing = False
+        self.batches = 0
+        self.messages_written = 0
+        self.retries = 0
+        self.dead_lettered = 0
+        self.backpressure_waits = 0
+        self.last_error: str | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """启动后台写入任务（MESSAGE_WRITER_ENABLED 关闭时不启动）。"""
+        if not settings.MESSAGE_WRITER_ENABLED or self.running:
+            return
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """写完队列中的消息并停止后台任务。"""
+        task, self._task = self._task, None
+        if task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(task, timeout=settings.MESSAGE_WRITER_SHUTDOWN_TIMEOUT)
+        except TimeoutError:
+            lost = sorted(self._by_session)
+            logger.error(
+                "消息写入队列未能在关闭前写完",
+                unwritten=self._queued,
+                session_ids=lost,
+                last_error=self.last_error,
+            )
+        finally:
+            # 唤醒等待队列空间的提交方，改为同步写入
+            self._space.set()
+
+    async def submit(
+        self,
+        messages: Sequence[PendingMessage],
+        stats: dict[str, Any] | None = None,
+    ) -> None:
+        """提交一组消息（同组消息在同一事务中写入，保持提交顺序）。
+
+        后台任务运行时仅入队，队列已满时等待；否则直接同步写入。
+
+        Args:
+            messages: 同一轮对话的消息
+            stats: 可选的生成延迟统计（generation_stats 插入参数），与消息同事务写入
+
+        Raises:
+            Exception: 同步写入失败时抛出数据库异常
+        """
+        if not messages:
+            return
+        if not self.running:
+            await self._insert([message.params() for message in messages], [stats] if stats else [])
+            return
+
+        while self._queued >= settings.MESSAGE_WRITER_QUEUE_MAX and self.running:
+            self.backpressure_waits += 1
+            self._space.clear()
+            await self._space.wait()
+
+        group = _Group(tuple(messages), stats)
+        for message in group.messages:
+            message.pending_id = PENDING_ID_BASE + next(self._ids)
+            self._by_session.setdefault(message.session_id, []).append(message)
+        self._groups.append(group)
+        self._queued += len(group.messages)
+        self._wakeup.set()
+
+    def pending_rows(self, session_id: int) -> list[PendingRow]:
+        """会话中已提交但尚未落库的消息（按提交顺序）。"""
+        return [
+            PendingRow(
+                id=message.pending_id,
+                role=message.role,
+                content=message.content,
+                tokens=message.tokens,
+                created_at=message.enqueued_at,
+            )
+            for message in self._by_session.get(session_id, ())
+        ]
+
+    def persisted_id(self, pending_id: int) -> int | None:
+        """临时 ID 对应的真实消息 ID（尚未落库、已记入死信或记录已淘汰时为 None）。"""
+        return self._persisted_ids.get(pending_id)
+
+    async def wait_persisted(self, session_id: int, timeout: float = 5.0) -> bool:
+        """等待会话的待写消息全部落库（读取完整消息列表前调用）。
+
+        Returns:
+            超时前是否已全部写入
+        """
+        if session_id not in self._by_session:
+            return True
+        try:
+            async with self._written:
+                await asyncio.wait_for(
+                    self._written.wait_for(lambda: session_id not in self._by_session),
+                    timeout=timeout,
+                )
+        except TimeoutError:
+            logger.warning("等待消息落库超时", session_id=session_id)
+            return False
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            if not self._groups:
+                if self._closing:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # 等待凑批：关闭阶段或已凑满时立即写入
+            if (
+                settings.MESSAGE_WRITER_FLUSH_MS > 0
+                and not self._closing
+                and self._queued < settings.MESSAGE_WRITER_BATCH_SIZE
+            ):
+                await asyncio.sleep(settings.MESSAGE_WRITER_FLUSH_MS / 1000)
+
+            batch: list[_Group] = []
+            size = 0
+            while self._groups and (
+                not batch
+                or size + len(self._groups[0].messages) <= settings.MESSAGE_WRITER_BATCH_SIZE
+            ):
+                group = self._groups.popleft()
+                batch.append(group)
+                size += len(group.messages)
+
+            await self._write_batch(batch)
+
+    async def _write_batch(self, batch: list[_Group]) -> None:
+        messages = [message for group in batch for message in group.messages]
+        started = time.perf_counter()
+        await self._write_groups(batch)
+
+        # 已写入或已记入死信的消息都移出队列
+        self._queued -= len(messages)
+        for message in messages:
+            session_messages = self._by_session[message.session_id]
+            session_messages.remove(message)
+            if not session_messages:
+                del self._by_session[message.session_id]
+        if self._queued < settings.MESSAGE_WRITER_QUEUE_MAX:
+            self._space.set()
+        async with self._written:
+            self._written.notify_all()
+        logger.debug(
+            "消息已批量写入",
+            batch_size=len(messages),
+            elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+        )
+
+    async def _write_groups(self, groups: list[_Group]) -> None:
+        messages = [message for group in groups for message in group.messages]
+        params = [message.params() for message in messages]
+        stats = [group.stats for group in groups if group.stats]
+        backoff = settings.MESSAGE_WRITER_RETRY_BACKOFF
+        retries = 0
+        while True:
+            try:
+                message_ids = await self._insert(params, stats)
+                self.batches += 1
+                self.messages_written += len(params)
+                self._remember_ids(messages, message_ids)
+                return
+            except _PERMANENT_ERRORS as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                if len(groups) == 1:
+                    self._dead_letter(groups, self.last_error)
+                    return
+                # 二分拆开重写，定位出错的组（同组消息仍在同一事务中）
+                logger.warning(
+                    "批量写入消息数据错误，拆分批次重试",
+                    groups=len(groups),
+                    error=self.last_error,
+                )
+                mid = len(groups) // 2
+                await self._write_groups(groups[:mid])
+                await self._write_groups(groups[mid:])
+                return
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                if retries >= settings.MESSAGE_WRITER_MAX_RETRIES:
+                    self._dead_letter(groups, self.last_error)
+                    return
+                retries += 1
+                self.retries += 1
+                logger.warning(
+                    "批量写入消息失败，稍后重试",
+                    batch_size=len(params),
+                    attempt=retries,
+                    backoff=backoff,
+                    error=self.last_error,
+                )
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, settings.MESSAGE_WRITER_RETRY_MAX_BACKOFF)
+
+    def _remember_ids(self, messages: list[PendingMessage], message_ids: list[int]) -> None:
+        for message, message_id in zip(messages, message_ids, strict=True):
+            self._persisted_ids[message.pending_id] = message_id
+        while len(self._persisted_ids) > settings.MESSAGE_WRITER_QUEUE_MAX:
+            self._persisted_ids.popitem(last=False)
+
+    def _dead_letter(self, groups: list[_Group], error: str) -> None:
+        # 死信：完整插入参数写入 error 日志，供人工补录
+        messages = [message.params() for group in groups for message in group.messages]
+        self.dead_lettered += len(messages)
+        logger.error(
+            "消息写入失败，已记入死信并丢弃",
+            session_ids=sorted({message["session_id"] for message in messages}),
+            error=error,
+            messages=messages,
+            stats=[group.stats for group in groups if group.stats],
+        )
+
+    async def _insert(
+        self,
+        params: list[dict[str, Any]],
+        stats: list[dict[str, Any]] | None = None,
+    ) -> list[int]:
+        """批量插入消息（及生成统计），返回新消息的 ID（与 params 顺序一致）。"""
+        # Core executemany：asyncpg 下合并为多行 VALUES，一个批次一次往返、一次提交
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                insert(Message).returning(Message.id, sort_by_parameter_order=True), params
+            )
+            message_ids = list(result.scalars())
+            if stats:
+                await conn.execute(insert(GenerationStat), stats)
+        return message_ids
+
+    def snapshot(self) -> dict[str, Any]:
+        """导出写入队列统计。"""
+        return {
+            "running": self.running,
+            "queued": self._queued,
+            "pending_sessions": len(self._by_session),
+            "batches": self.batches,
+            "messages_written": self.messages_written,
+            "retries": self.retries,
+            "dead_lettered": self.dead_lettered,
+            "backpressure_waits": self.backpressure_waits,
+            "last_error": self.last_error,
+        }
+
+
+_writer: MessageWriter | None = None
+
+
+def get_message_writer() -> MessageWriter:
+    """获取进程级消息写入队列。"""
+    global _writer
+    if _writer is None:
+        _writer = MessageWriter()
+    return _writer
+
+
+__all__ = [
+    "PENDING_ID_BASE",
+    "MessageWriter",
+    "PendingMessage",
+    "PendingRow",
+    "get_message_writer",
+]
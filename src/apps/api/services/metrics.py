@@ -0,0 +1,273 @@
+"""指标子系统（Prometheus）。
+
+/metrics 以 Prometheus 文本格式导出：
+- 按路由模板的请求耗时直方图（http_request_duration_seconds，流式响应计到响应头发出）
+- 进行中的 SSE 流（sse_streams_in_flight）
+- LLM 请求结果（llm_requests_total，按 chat / case_generation 与 ok/timeout/... 区分）
+- LLM token 用量（llm_tokens_total，vLLM 报告的 prompt / completion token 数）
+- 数据库连接池占用与溢出（db_pool_*，按 METRICS_POOL_SAMPLE_INTERVAL 采样）
+- 限流拒绝（rate_limit_rejections_total）
+- 生成延迟分布（见 generation_stats）
+
+多 worker 部署时在启动前把环境变量 PROMETHEUS_MULTIPROC_DIR 指向一个空目录：
+各 worker 把指标写入该目录下的 mmap 文件，任一 worker 处理 /metrics 时汇总全部 worker
+（计数与直方图求和，进行中 / 连接池等仪表取存活 worker 之和）。该变量必须是进程环境变量，
+且每次部署前清空目录。
+
+本模块的 Histogram 另在进程内保留分桶计数，供 /health/llm 展示分位数（仅当前 worker）。
+标签值应为低基数（路由模板、后端地址），高基数维度（病例、会话）写入明细表。
+所有进程内状态只在事件循环线程中读写，无需加锁。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import os
+from collections.abc import Sequence
+from typing import Any
+
+import prometheus_client
+from prometheus_client import multiprocess
+from sqlalchemy.pool import Pool, QueuePool
+from starlette.requests import Request
+
+# 多 worker 汇总目录（prometheus_client 在导入时读取同一环境变量）
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+CONTENT_TYPE_LATEST = prometheus_client.CONTENT_TYPE_LATEST
+
+# 毫秒级延迟的通用分桶
+LATENCY_MS_BUCKETS: tuple[float, ...] = (
+    10,
+    25,
+    50,
+    100,
+    200,
+    300,
+    500,
+    750,
+    1000,
+    1500,
+    2000,
+    3000,
+    5000,
+    10000,
+    30000,
+    60000,
+)
+# HTTP 请求耗时分桶（秒）
+HTTP_SECONDS_BUCKETS: tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+class _Series:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self, size: int) -> None:
+        # 最后一个桶为 +Inf
+        self.counts = [0] * (size + 1)
+        self.total = 0.0
+        self.count = 0
+
+
+class Histogram:
+    """固定分桶直方图（导出到 Prometheus，同时在进程内估算分位数）。
+
+    进程内按标签组合累计各桶计数、总和与样本数，内存占用与样本数无关；
+    分位数按桶内线性插值估算（精度取决于分桶）。
+
+    Args:
+        name: 指标名
+        documentation: 指标说明
+        buckets: 升序的桶上界（不含 +Inf）
+        labelnames: 标签名
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = LATENCY_MS_BUCKETS,
+        labelnames: Sequence[str] = (),
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._series: dict[tuple[str, ...], _Series] = {}
+        self._exported = prometheus_client.Histogram(
+            name, documentation, self.labelnames, buckets=self.buckets
+        )
+
+    def observe(self, value: float, **labels: Any) -> None:
+        """记录一个样本。"""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _Series(len(self.buckets))
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.total += value
+        series.count += 1
+        if key:
+            self._exported.labels(*key).observe(value)
+        else:
+            self._exported.observe(value)
+
+    def quantile(self, q: float, series: _Series) -> float | None:
+        """按桶内线性插值估算分位数（落在 +Inf 桶时返回最大的有限上界）。"""
+        if series.count == 0:
+            return None
+        rank = q * series.count
+        seen = 0
+        lower = 0.0
+        for idx, count in enumerate(series.counts):
+            upper = self.buckets[idx] if idx < len(self.buckets) else self.buckets[-1]
+            if count and seen + count >= rank:
+                if idx >= len(self.buckets):
+                    return upper
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return self.buckets[-1]
+
+    def series(self) -> dict[tuple[str, ...], _Series]:
+        return self._series
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        """导出各标签组合的样本数、均值与 p50/p95/p99 估算。"""
+        result = []
+        for key, series in self._series.items():
+            result.append(
+                {
+                    **dict(zip(self.labelnames, key, strict=True)),
+                    "count": series.count,
+                    "mean": round(series.total / series.count, 2) if series.count else None,
+                    "p50": _round(self.quantile(0.5, series)),
+                    "p95": _round(self.quantile(0.95, series)),
+                    "p99": _round(self.quantile(0.99, series)),
+                }
+            )
+        return result
+
+
+def _round(value: float | None) -> float | None:
+    return None if value is None else round(value, 2)
+
+
+http_request_duration = prometheus_client.Histogram(
+    "http_request_duration_seconds",
+    "HTTP 请求耗时（秒，流式响应计到响应头发出）",
+    ("method", "route", "status"),
+    buckets=HTTP_SECONDS_BUCKETS,
+)
+sse_streams_in_flight = prometheus_client.Gauge(
+    "sse_streams_in_flight",
+    "进行中的 SSE 对话流订阅",
+    multiprocess_mode="livesum",
+)
+llm_requests = prometheus_client.Counter(
+    "llm_requests",
+    "LLM 请求结果",
+    ("operation", "outcome"),
+)
+llm_tokens = prometheus_client.Counter(
+    "llm_tokens",
+    "vLLM 报告的 token 用量",
+    ("operation", "kind"),
+)
+rate_limit_rejections = prometheus_client.Counter(
+    "rate_limit_rejections",
+    "被限流拒绝的请求",
+    ("route",),
+)
+db_pool_size = prometheus_client.Gauge(
+    "db_pool_size", "数据库连接池常驻连接数", multiprocess_mode="livesum"
+)
+db_pool_checked_out = prometheus_client.Gauge(
+    "db_pool_checked_out", "已借出的数据库连接数", multiprocess_mode="livesum"
+)
+db_pool_overflow = prometheus_client.Gauge(
+    "db_pool_overflow", "超出常驻连接数的溢出连接数", multiprocess_mode="livesum"
+)
+
+# LLM 请求结果（llm_requests 的 outcome 标签）
+OUTCOME_OK = "ok"
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_CONNECTION_ERROR = "connection_error"
+OUTCOME_HTTP_ERROR = "http_error"
+OUTCOME_INVALID = "invalid_output"
+OUTCOME_CANCELLED = "cancelled"
+
+
+def route_label(request: Request) -> str:
+    """请求匹配到的路由模板（未匹配时为 unmatched，避免按原始路径产生无界标签）。"""
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def sample_pool(pool: Pool) -> None:
+    """采样数据库连接池状态（非 QueuePool，如 NullPool，不导出）。"""
+    if not isinstance(pool, QueuePool):
+        return
+    db_pool_size.set(pool.size())
+    db_pool_checked_out.set(pool.checkedout())
+    db_pool_overflow.set(max(0, pool.overflow()))
+
+
+async def run_pool_sampler(pool: Pool, interval: float) -> None:
+    """按间隔采样连接池状态，直到任务被取消。"""
+    while True:
+        sample_pool(pool)
+        await asyncio.sleep(interval)
+
+
+def render_latest() -> bytes:
+    """以 Prometheus 文本格式导出指标（多 worker 模式下汇总全部 worker）。"""
+    if MULTIPROC_DIR:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return prometheus_client.generate_latest(registry)
+    return prometheus_client.generate_latest()
+
+
+def mark_process_dead() -> None:
+    """worker 退出时清理其仪表文件（仅多 worker 模式）。"""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+__all__ = [
+    "CONTENT_TYPE_LATEST",
+    "HTTP_SECONDS_BUCKETS",
+    "LATENCY_MS_BUCKETS",
+    "OUTCOME_CANCELLED",
+    "OUTCOME_CONNECTION_ERROR",
+    "OUTCOME_HTTP_ERROR",
+    "OUTCOME_INVALID",
+    "OUTCOME_OK",
+    "OUTCOME_TIMEOUT",
+    "Histogram",
+    "http_request_duration",
+    "llm_requests",
+    "llm_tokens",
+    "mark_process_dead",
+    "rate_limit_rejections",
+    "render_latest",
+    "route_label",
+    "run_pool_sampler",
+    "sample_pool",
+    "sse_streams_in_flight",
+]
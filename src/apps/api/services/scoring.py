@@ -7,6 +7,7 @@ import re
 from dataclasses import dataclass
 
 from src.apps.api.models import Case, Message, Session, TestRequest
+from src.apps.api.services.compiled_case import get_compiled_case
 
 # 评分规则版本
 SCORING_RULE_VERSION = "1.0"
@@ -117,16 +118,14 @@ class ScoringService:
             提取到的关键词列表
         """
         keywords = []
-        key_points = case.key_points or []
 
         # 将所有消息内容合并（仅用户消息，即医生问诊内容）
         user_messages = [msg.content for msg in messages if msg.role == "user"]
         all_content = " ".join(user_messages).lower()
 
         # 检查每个关键点是否在对话中被提及
-        for point in key_points:
-            # 将关键点拆分为关键词进行模糊匹配
-            point_keywords = cls._extract_point_keywords(point)
+        # （关键点拆分出的匹配词已在病例编译时预先计算）
+        for point, point_keywords in get_compiled_case(case).key_point_keywords:
             for kw in point_keywords:
                 if kw.lower() in all_content:
                     if point not in keywords:
@@ -0,0 +1,217 @@
+"""随机会话的异步病例生成任务。
+
+病例池为空时，随机模式建会话需要调用 LLM 生成病例（数秒到数十秒）。为不让 HTTP 请求
+一直挂着占用 nginx / uvicorn 连接，路由先创建一个待定会话（status=pending，尚无病例）并立即
+返回 202，生成在后台任务中进行：
+- 阶段：queued（准入排队，附排队位置）→ generating（LLM 生成）→ validating（校验、落库）
+  → ready（会话转为 in_progress 并关联病例）/ failed（会话标记为 failed）
+- 客户端轮询 GET /api/sessions/{id}/progress 获取阶段
+- 任务结束后在内存中保留 SESSION_JOB_TTL 秒（失败原因只在内存中）；之后以及其他 worker 上
+  按会话状态推断阶段
+- 应用关闭时取消进行中的任务并把会话标记为 failed；进程崩溃遗留的 pending 会话超过
+  SESSION_JOB_STALE_AFTER 秒后在查询进度时标记为 failed
+
+所有状态只在事件循环线程中读写，无需加锁。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any
+
+from sqlalchemy import func, update
+
+from src.apps.api.config import settings
+from src.apps.api.dependencies import AsyncSessionLocal
+from src.apps.api.exceptions import BusinessError
+from src.apps.api.logging_config import logger
+from src.apps.api.models import Session
+from src.apps.api.services.admission import AdmissionTimeoutError, Ticket, get_admission
+from src.apps.api.services.case_generation import (
+    build_random_case,
+    generate_random_case_payload,
+)
+
+STAGE_QUEUED = "queued"
+STAGE_GENERATING = "generating"
+STAGE_VALIDATING = "validating"
+STAGE_READY = "ready"
+STAGE_FAILED = "failed"
+
+# 会话状态：病例生成中 / 生成失败
+SESSION_PENDING = "pending"
+SESSION_FAILED = "failed"
+
+
+@dataclass
+class SessionJob:
+    """单个待定会话的病例生成任务。"""
+
+    session_id: int
+    user_id: int
+    stage: str = STAGE_QUEUED
+    position: int | None = None
+    case_id: int | None = None
+    error: str | None = None
+    finished_at: float | None = None
+
+    def progress(self) -> dict[str, Any]:
+        """导出进度（SessionProgress 字段）。"""
+        return {
+            "session_id": self.session_id,
+            "stage": self.stage,
+            "position": self.position if self.stage == STAGE_QUEUED else None,
+            "case_id": self.case_id,
+            "error": self.error,
+        }
+
+
+class SessionJobRegistry:
+    """进程内病例生成任务登记表。"""
+
+    def __init__(self) -> None:
+        self._jobs: dict[int, SessionJob] = {}
+        self._tasks: set[asyncio.Task[None]] = set()
+        self.started = 0
+        self.succeeded = 0
+        self.failed = 0
+
+    def spawn(self, session_id: int, user_id: int, ticket: Ticket) -> SessionJob:
+        """为待定会话启动生成任务（ticket 由调用方预先申请，任务结束时归还）。"""
+        self._purge()
+        job = SessionJob(session_id, user_id)
+        self._jobs[session_id] = job
+        task = asyncio.create_task(self._run(job, ticket))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.started += 1
+        return job
+
+    def get(self, session_id: int, user_id: int) -> SessionJob | None:
+        """查找用户自己的任务（不存在、已过期或不属于该用户时返回 None）。"""
+        self._purge()
+        job = self._jobs.get(session_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+
+    async def shutdown(self) -> None:
+        """取消进行中的任务（会话标记为 failed）。"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job: SessionJob, ticket: Ticket) -> None:
+        admission = get_admission()
+        try:
+            async for position in admission.wait(ticket):
+                job.position = position
+            job.stage = STAGE_GENERATING
+            try:
+                payload, meta = await generate_random_case_payload()
+            finally:
+                admission.release(ticket)
+
+            job.stage = STAGE_VALIDATING
+            case = build_random_case(payload, meta)
+            async with AsyncSessionLocal() as db:
+                db.add(case)
+                await db.flush()
+                # 生成耗时不计入问诊时长：开始时间重置为病例就绪时
+                result = await db.execute(
+                    update(Session)
+                    .where(Session.id == job.session_id, Session.status == SESSION_PENDING)
+                    .values(case_id=case.id, status="in_progress", started_at=func.now())
+                )
+                if result.rowcount == 0:
+                    # 会话已被判定为中断（超时清理）：丢弃病例
+                    await db.rollback()
+                    raise RuntimeError("会话已失效")
+                await db.commit()
+            job.case_id = case.id
+            job.stage = STAGE_READY
+            self.succeeded += 1
+            logger.info("随机会话病例已就绪", session_id=job.session_id, case_id=case.id)
+        except asyncio.CancelledError:
+            await self._fail(job, "服务重启，病例生成中断")
+            raise
+        except AdmissionTimeoutError:
+            await self._fail(job, "排队超时，请稍后重试")
+        except Exception as e:
+            logger.warning("随机会话病例生成失败", session_id=job.session_id, error=str(e))
+            # 业务异常（LLM 不可用、输出不合法）的提示可直接展示给用户
+            error = e.message if isinstance(e, BusinessError) else "病例生成失败，请重试"
+            await self._fail(job, error)
+        finally:
+            admission.release(ticket)
+            job.finished_at = time.monotonic()
+
+    async def _fail(self, job: SessionJob, error: str) -> None:
+        job.stage = STAGE_FAILED
+        job.error = error
+        self.failed += 1
+        try:
+            await mark_failed(job.session_id)
+        except Exception as e:
+            logger.error("标记随机会话失败状态出错", session_id=job.session_id, error=str(e))
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        expired = [
+            session_id
+            for session_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at >= settings.SESSION_JOB_TTL
+        ]
+        for session_id in expired:
+            del self._jobs[session_id]
+
+    def snapshot(self) -> dict[str, int]:
+        """导出任务统计。"""
+        return {
+            "running": len(self._tasks),
+            "started": self.started,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+        }
+
+
+async def mark_failed(session_id: int, older_than: float | None = None) -> bool:
+    """把仍处于 pending 的会话标记为 failed。
+
+    Args:
+        session_id: 会话ID
+        older_than: 仅当会话创建超过该秒数时才标记（按数据库时钟比较）
+
+    Returns:
+        是否有会话被更新
+    """
+    stmt = update(Session).where(Session.id == session_id, Session.status == SESSION_PENDING)
+    if older_than is not None:
+        stmt = stmt.where(Session.started_at < func.now() - timedelta(seconds=older_than))
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(stmt.values(status=SESSION_FAILED, ended_at=func.now()))
+        await db.commit()
+    return result.rowcount > 0
+
+
+session_jobs = SessionJobRegistry()
+
+
+__all__ = [
+    "SESSION_FAILED",
+    "SESSION_PENDING",
+    "STAGE_FAILED",
+    "STAGE_GENERATING",
+    "STAGE_QUEUED",
+    "STAGE_READY",
+    "STAGE_VALIDATING",
+    "SessionJob",
+    "SessionJobRegistry",
+    "mark_failed",
+    "session_jobs",
+]
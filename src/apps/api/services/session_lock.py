@@ -0,0 +1,247 @@
+"""会话级单飞（single-flight）保护。
+
+同一会话的两轮对话重叠时，两者都会加载历史、调用 vLLM 并保存消息，落库顺序取决于时序，
+既浪费生成又会打乱历史。这里保证每个会话同一时间只有一轮对话在进行：
+- 进程内按会话ID维护 asyncio 锁，锁空闲且无人等待时即从表中移除，表大小只与活跃会话数相关
+- 会话正忙时的处理由 CHAT_SESSION_BUSY_POLICY 决定：
+  reject 立即拒绝（路由返回 409）；queue 等待上一轮结束（最多 CHAT_SESSION_LOCK_TIMEOUT 秒）；
+  cancel_replace 取消上一轮（部分回答按 truncated 保存）后接手
+- CHAT_SESSION_LOCK_BACKEND=postgres 时，进程内锁之外再持有 Postgres 会话级咨询锁，
+  多 worker 之间同样互斥。咨询锁需要在整轮对话期间（含 vLLM 流式生成）占用一个数据库连接，
+  该连接来自独立的不池化引擎（NullPool），不占用应用连接池：同时进行的对话数超过
+  DB_POOL_SIZE 时其他请求仍能取得连接；数据库 max_connections 需覆盖同时进行的对话数。
+  跨 worker 的 cancel_replace 退化为 queue
+
+一轮对话的持有者可以登记取消回调（set_cancel），供 cancel_replace 使用。
+进程内状态只在事件循环线程中读写，无需加锁。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections.abc import Callable
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from src.apps.api.config import settings
+from src.apps.api.dependencies import async_db_url
+from src.apps.api.logging_config import logger
+
+# pg_try_advisory_lock(int4, int4) 的命名空间，避免与其他用途的咨询锁冲突
+ADVISORY_LOCK_NAMESPACE = 7301
+# 跨 worker 等待咨询锁时的轮询间隔（秒）
+ADVISORY_POLL_INTERVAL = 0.2
+
+
+class SessionBusyError(Exception):
+    """会话已有一轮对话在进行。"""
+
+    def __init__(self, session_id: int) -> None:
+        super().__init__("上一轮对话尚未结束，请稍后再试")
+        self.session_id = session_id
+
+
+class SessionTurn:
+    """一轮对话对会话的占用（release 幂等）。"""
+
+    def __init__(self, guard: SessionTurnGuard, session_id: int) -> None:
+        self._guard = guard
+        self.session_id = session_id
+        self.acquired_at = time.monotonic()
+        self._cancel: Callable[[], object] | None = None
+        self._conn: AsyncConnection | None = None
+        self.released = False
+
+    def set_cancel(self, cancel: Callable[[], object] | None) -> None:
+        """登记取消回调（被新一轮对话取代时调用）；None 表示本轮已不可取消。"""
+        self._cancel = cancel
+
+    def cancel(self) -> bool:
+        """取消本轮对话；未登记回调时返回 False。"""
+        cancel, self._cancel = self._cancel, None
+        if cancel is None:
+            return False
+        cancel()
+        return True
+
+    async def release(self) -> None:
+        """释放会话占用。"""
+        if self.released:
+            return
+        self.released = True
+        self._cancel = None
+        conn, self._conn = self._conn, None
+        try:
+            if conn is not None:
+                await _advisory_unlock(conn, self.session_id)
+        finally:
+            self._guard._release(self)
+
+
+class _SessionLock:
+    __slots__ = ("lock", "holder", "waiters")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.holder: SessionTurn | None = None
+        self.waiters = 0
+
+
+class SessionTurnGuard:
+    """进程级会话单飞保护。"""
+
+    def __init__(self) -> None:
+        self._locks: dict[int, _SessionLock] = {}
+        self.acquired = 0
+        self.rejected = 0
+        self.replaced = 0
+        self.waited = 0
+
+    async def acquire(self, session_id: int) -> SessionTurn:
+        """占用会话，按 CHAT_SESSION_BUSY_POLICY 处理会话正忙的情况。
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            本轮对话的占用（结束时须 release）
+
+        Raises:
+            SessionBusyError: 会话正忙且策略为 reject，或等待超时
+        """
+        policy = settings.CHAT_SESSION_BUSY_POLICY
+        entry = self._locks.get(session_id)
+        if entry is None:
+            entry = self._locks[session_id] = _SessionLock()
+
+        if entry.lock.locked():
+            if policy == "reject":
+                self.rejected += 1
+                raise SessionBusyError(session_id)
+            if policy == "cancel_replace" and entry.holder is not None:
+                if entry.holder.cancel():
+                    self.replaced += 1
+                    logger.info("新一轮对话取代进行中的对话", session_id=session_id)
+            self.waited += 1
+
+        entry.waiters += 1
+        try:
+            await asyncio.wait_for(entry.lock.acquire(), settings.CHAT_SESSION_LOCK_TIMEOUT)
+        except TimeoutError as e:
+            self.rejected += 1
+            raise SessionBusyError(session_id) from e
+        finally:
+            entry.waiters -= 1
+            if not entry.lock.locked():
+                self._evict(session_id, entry)
+
+        turn = SessionTurn(self, session_id)
+        entry.holder = turn
+        if settings.CHAT_SESSION_LOCK_BACKEND == "postgres":
+            try:
+                turn._conn = await _advisory_lock(session_id)
+            except BaseException:
+                await turn.release()
+                raise
+        self.acquired += 1
+        return turn
+
+    def _release(self, turn: SessionTurn) -> None:
+        entry = self._locks.get(turn.session_id)
+        if entry is None or entry.holder is not turn:
+            return
+        entry.holder = None
+        entry.lock.release()
+        self._evict(turn.session_id, entry)
+
+    def _evict(self, session_id: int, entry: _SessionLock) -> None:
+        # 锁空闲且无人等待时移出表
+        if not entry.lock.locked() and entry.waiters == 0 and self._locks.get(session_id) is entry:
+            del self._locks[session_id]
+
+    def snapshot(self) -> dict[str, int | str]:
+        """导出会话占用统计。"""
+        return {
+            "backend": settings.CHAT_SESSION_LOCK_BACKEND,
+            "policy": settings.CHAT_SESSION_BUSY_POLICY,
+            "active_sessions": sum(1 for entry in self._locks.values() if entry.lock.locked()),
+            "acquired": self.acquired,
+            "rejected": self.rejected,
+            "replaced": self.replaced,
+            "waited": self.waited,
+        }
+
+
+_lock_engine: AsyncEngine | None = None
+
+
+def _get_lock_engine() -> AsyncEngine:
+    # 咨询锁专用引擎：不池化，连接随 close 断开，长时间占用不挤占应用连接池
+    global _lock_engine
+    if _lock_engine is None:
+        _lock_engine = create_async_engine(async_db_url, poolclass=NullPool)
+    return _lock_engine
+
+
+async def _advisory_lock(session_id: int) -> AsyncConnection:
+    """在独立连接（不占用应用连接池）上取得会话的咨询锁（按策略立即失败或轮询等待）。
+
+    Raises:
+        SessionBusyError: 其他 worker 正持有该会话且策略为 reject，或等待超时
+    """
+    conn = await _get_lock_engine().connect()
+    try:
+        deadline = time.monotonic() + settings.CHAT_SESSION_LOCK_TIMEOUT
+        while True:
+            result = await conn.execute(
+                text("SELECT pg_try_advisory_lock(:namespace, :session_id)"),
+                {"namespace": ADVISORY_LOCK_NAMESPACE, "session_id": session_id},
+            )
+            locked = result.scalar()
+            # 结束隐式事务：会话级咨询锁不随事务释放，连接也不会停留在事务中
+            await conn.commit()
+            if locked:
+                return conn
+            if settings.CHAT_SESSION_BUSY_POLICY == "reject" or time.monotonic() >= deadline:
+                raise SessionBusyError(session_id)
+            await asyncio.sleep(ADVISORY_POLL_INTERVAL)
+    except BaseException:
+        await conn.close()
+        raise
+
+
+async def _advisory_unlock(conn: AsyncConnection, session_id: int) -> None:
+    try:
+        await conn.execute(
+            text("SELECT pg_advisory_unlock(:namespace, :session_id)"),
+            {"namespace": ADVISORY_LOCK_NAMESPACE, "session_id": session_id},
+        )
+        await conn.commit()
+    except Exception as e:
+        # 作废该连接，咨询锁随数据库会话结束一起释放
+        logger.warning("释放会话咨询锁失败", session_id=session_id, error=str(e))
+        await conn.invalidate()
+    finally:
+        await conn.close()
+
+
+_guard: SessionTurnGuard | None = None
+
+
+def get_session_guard() -> SessionTurnGuard:
+    """获取进程级会话单飞保护。"""
+    global _guard
+    if _guard is None:
+        _guard = SessionTurnGuard()
+    return _guard
+
+
+__all__ = [
+    "SessionBusyError",
+    "SessionTurn",
+    "SessionTurnGuard",
+    "get_session_guard",
+]
@@ -0,0 +1,49 @@
+"""SSE 帧编码。
+
+对话流每秒要编码大量小帧，这里统一预编码为 bytes：
+- 安装了 orjson 时使用 orjson（直接输出 UTF-8 bytes），否则回退标准库 json
+- 中文不转义为 \\uXXXX，帧体积约为转义形式的一半
+- 帧格式保持 `data: {...}\\n\\n`，前端解析逻辑不变；可恢复的流在其前加 `id: N` 行
+"""
+
+from __future__ import annotations
+
+import json
+from collections.abc import Callable
+from typing import Any
+
+DONE_FRAME = b"data: [DONE]\n\n"
+
+
+def _load_encoder() -> tuple[str, Callable[[Any], bytes]]:
+    try:
+        import orjson  # type: ignore
+    except ImportError:
+        return "json", lambda obj: json.dumps(
+            obj, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+    return "orjson", orjson.dumps
+
+
+JSON_ENCODER, encode_json = _load_encoder()
+
+
+def sse_frame(payload: dict[str, Any], event_id: int | None = None) -> bytes:
+    """把事件载荷编码为一帧 SSE（bytes）。
+
+    Args:
+        payload: 事件载荷
+        event_id: 可选事件序号（客户端重连时通过 Last-Event-ID 回传）
+    """
+    frame = b"data: " + encode_json(payload) + b"\n\n"
+    if event_id is None:
+        return frame
+    return b"id: %d\n" % event_id + frame
+
+
+__all__ = [
+    "DONE_FRAME",
+    "JSON_ENCODER",
+    "encode_json",
+    "sse_frame",
+]
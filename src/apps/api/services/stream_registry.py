@@ -0,0 +1,263 @@
+"""可恢复的对话流。
+
+校园网络不稳定时，连接中途断开会丢失部分回答，重试又会触发一次完整的 LLM 生成。
+这里让每次生成脱离单个 HTTP 连接：
+- 生成在后台任务中进行，输出的每个 SSE 事件带递增序号（`id: N`），写入该流的
+  内存环形缓冲（最多 CHAT_RESUME_BUFFER_EVENTS 个事件）
+- HTTP 响应只是流的订阅者；客户端带 Last-Event-ID 重连（GET /api/chat/streams/{id}）
+  时从对应位置继续，挂到仍在进行的生成上，而不是重新生成
+- 所需事件已被环形缓冲淘汰时，先发送一个 resync 事件（携带被淘汰部分的完整回复文本），
+  客户端用它替换已显示的内容，再接着回放缓冲中的事件
+- 曾有订阅者、但全部断开超过 CHAT_RESUME_GRACE 秒的生成视为被放弃，中止上游生成；
+  生成结束后流再保留 CHAT_RESUME_TTL 秒以便补齐尾部事件；生成任务异常退出而未结束的流
+  在创建 CHAT_RESUME_MAX_AGE 秒后清理
+- 订阅者落后超过 CHAT_STREAM_BUFFER_SIZE 个事件时按 CHAT_SLOW_CLIENT_POLICY 处理：
+  coalesce 把积压的回复增量合并为一个事件；disconnect 停止向该客户端推送，
+  生成不再因无人订阅而中止，完整回答照常保存
+
+流只保存在当前进程内：多 worker 部署时重连需要会话粘滞，未命中返回 404，
+客户端改为重新加载会话记录。所有状态只在事件循环线程中读写，无需加锁。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any, NamedTuple
+
+from src.apps.api.config import settings
+from src.apps.api.logging_config import logger
+from src.apps.api.services.chat_stream import stream_stats
+from src.apps.api.services.metrics import sse_streams_in_flight
+from src.apps.api.services.sse import DONE_FRAME, sse_frame
+
+
+class StreamEvent(NamedTuple):
+    """环形缓冲中的一个事件。"""
+
+    event_id: int
+    frame: bytes
+    # 回复增量文本（其他事件为 None），用于合并积压与 resync
+    content: str | None
+
+
+class ResumableStream:
+    """单次生成的事件流。
+
+    Args:
+        stream_id: 流ID
+        user_id: 所属用户ID（仅本人可重连）
+        session_id: 会话ID
+    """
+
+    def __init__(self, stream_id: str, user_id: int, session_id: int) -> None:
+        self.stream_id = stream_id
+        self.user_id = user_id
+        self.session_id = session_id
+        self.created_at = time.monotonic()
+        self._events: deque[StreamEvent] = deque()
+        # 已被环形缓冲淘汰的回复增量（拼接即为淘汰部分的完整回复）
+        self._evicted: list[str] = []
+        self._last_id = 0
+        self._changed = asyncio.Event()
+        self.subscribers = 0
+        # 最后一个订阅者断开的时间；创建流的请求尚未订阅时为 None（不计入宽限期，
+        # 否则 CHAT_RESUME_GRACE=0 时生成在首个订阅者连上之前就被判定为放弃）
+        self._detached_at: float | None = None
+        # 有订阅者因落后被断开推送：生成必须跑完并保存完整回答
+        self.keep_alive = False
+        self.done = False
+        self.finished_at: float | None = None
+
+    @property
+    def last_event_id(self) -> int:
+        return self._last_id
+
+    def publish(self, payload: dict[str, Any]) -> None:
+        """追加一个事件。"""
+        self._append(payload, None)
+
+    def publish_content(self, content: str) -> None:
+        """追加一段回复增量。"""
+        self._append({"content": content, "done": False}, content)
+
+    def finish(self, send_done: bool = True) -> None:
+        """标记生成结束（可选追加 [DONE] 事件）。"""
+        if self.done:
+            return
+        if send_done:
+            self._last_id += 1
+            self._store(StreamEvent(self._last_id, b"id: %d\n" % self._last_id + DONE_FRAME, None))
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._changed.set()
+
+    def _append(self, payload: dict[str, Any], content: str | None) -> None:
+        self._last_id += 1
+        self._store(StreamEvent(self._last_id, sse_frame(payload, self._last_id), content))
+        self._changed.set()
+
+    def _store(self, event: StreamEvent) -> None:
+        if len(self._events) >= settings.CHAT_RESUME_BUFFER_EVENTS:
+            evicted = self._events.popleft()
+            if evicted.content is not None:
+                self._evicted.append(evicted.content)
+        self._events.append(event)
+
+    async def is_abandoned(self) -> bool:
+        """生成是否已无人订阅超过宽限期（用作上游断开探测）。"""
+        if self.keep_alive or self.subscribers > 0 or self._detached_at is None:
+            return False
+        return time.monotonic() - self._detached_at >= settings.CHAT_RESUME_GRACE
+
+    async def subscribe(
+        self,
+        is_disconnected: Callable[[], Awaitable[bool]],
+        last_event_id: int = 0,
+    ) -> AsyncIterator[bytes]:
+        """从 last_event_id 之后开始产出 SSE 帧，直到流结束或客户端断开。
+
+        Args:
+            is_disconnected: 当前连接的断开探测（等待新事件期间轮询）
+            last_event_id: 客户端已收到的最后一个事件序号
+        """
+        self.subscribers += 1
+        self._detached_at = None
+        sse_streams_in_flight.inc()
+        position = last_event_id
+        try:
+            while True:
+                if position >= self._last_id:
+                    if self.done:
+                        return
+                    self._changed.clear()
+                    try:
+                        await asyncio.wait_for(
+                            self._changed.wait(), settings.CHAT_DISCONNECT_POLL_INTERVAL
+                        )
+                    except TimeoutError:
+                        if await is_disconnected():
+                            return
+                    continue
+
+                oldest = self._events[0].event_id
+                if position < oldest - 1:
+                    # 所需事件已被淘汰：先用完整文本重建被淘汰部分
+                    position = oldest - 1
+                    resync = {"content": "".join(self._evicted), "resync": True, "done": False}
+                    yield sse_frame(resync, position)
+
+                backlog = self._last_id - position
+                stream_stats.buffer_high_water = max(stream_stats.buffer_high_water, backlog)
+                pending = [event for event in self._events if event.event_id > position]
+                if backlog > settings.CHAT_STREAM_BUFFER_SIZE:
+                    if settings.CHAT_SLOW_CLIENT_POLICY == "disconnect":
+                        self.keep_alive = True
+                        stream_stats.slow_client_drops += 1
+                        logger.info(
+                            "客户端接收过慢，停止推送", stream_id=self.stream_id, backlog=backlog
+                        )
+                        lag_msg = "网络较慢，已停止推送；完整回答生成后可在会话记录中查看"
+                        yield sse_frame({"error": lag_msg})
+                        yield DONE_FRAME
+                        return
+                    stream_stats.coalesced += 1
+                    frames = _coalesce(pending)
+                else:
+                    frames = [event.frame for event in pending]
+                position = pending[-1].event_id
+                for frame in frames:
+                    yield frame
+        finally:
+            sse_streams_in_flight.dec()
+            self.subscribers -= 1
+            if self.subscribers == 0:
+                self._detached_at = time.monotonic()
+
+
+def _coalesce(events: list[StreamEvent]) -> list[bytes]:
+    """把相邻的回复增量合并为一个事件（序号取合并后最后一个事件）。"""
+    frames: list[bytes] = []
+    run: list[StreamEvent] = []
+
+    def flush() -> None:
+        if len(run) == 1:
+            frames.append(run[0].frame)
+        elif run:
+            merged = {"content": "".join(event.content or "" for event in run), "done": False}
+            frames.append(sse_frame(merged, run[-1].event_id))
+        run.clear()
+
+    for event in events:
+        if event.content is not None:
+            run.append(event)
+            continue
+        flush()
+        frames.append(event.frame)
+    flush()
+    return frames
+
+
+class StreamRegistry:
+    """进程内可恢复流登记表。"""
+
+    def __init__(self) -> None:
+        self._streams: dict[str, ResumableStream] = {}
+
+    def create(self, user_id: int, session_id: int) -> ResumableStream:
+        """登记一个新的流。"""
+        self._purge()
+        stream = ResumableStream(uuid.uuid4().hex, user_id, session_id)
+        self._streams[stream.stream_id] = stream
+        return stream
+
+    def get(self, stream_id: str, user_id: int) -> ResumableStream | None:
+        """查找用户自己的流（不存在、已过期或不属于该用户时返回 None）。"""
+        self._purge()
+        stream = self._streams.get(stream_id)
+        if stream is None or stream.user_id != user_id:
+            return None
+        return stream
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        expired = [
+            stream
+            for stream in self._streams.values()
+            if (
+                now - stream.finished_at >= settings.CHAT_RESUME_TTL
+                if stream.finished_at is not None
+                else now - stream.created_at >= settings.CHAT_RESUME_MAX_AGE
+            )
+        ]
+        for stream in expired:
+            del self._streams[stream.stream_id]
+            if not stream.done:
+                # 生成任务未能结束该流：结束它以唤醒仍在等待的订阅者
+                logger.warning(
+                    "清理未结束的对话流", stream_id=stream.stream_id, session_id=stream.session_id
+                )
+                stream.finish(send_done=False)
+
+    def snapshot(self) -> dict[str, int]:
+        """导出登记表统计。"""
+        live = sum(1 for stream in self._streams.values() if not stream.done)
+        return {
+            "live": live,
+            "retained": len(self._streams) - live,
+            "subscribers": sum(stream.subscribers for stream in self._streams.values()),
+        }
+
+
+stream_registry = StreamRegistry()
+
+
+__all__ = [
+    "ResumableStream",
+    "StreamEvent",
+    "StreamRegistry",
+    "stream_registry",
+]
@@ -0,0 +1,322 @@
+"""会话滚动摘要服务。
+
+长会话超出上下文窗口时，不再让学生结束会话，而是把较早的问答压缩为
+“患者已透露的信息”摘要：
+- 摘要按会话持久化（session_summaries），watermark_message_id 之前（含）的消息已并入摘要
+- 组装提示词时使用“摘要 + watermark 之后的原文消息”，两者互不重叠
+- 摘要在后台增量更新（旧摘要 + 新消息 -> 新摘要），不阻塞当前对话轮次
+- 进程内按会话缓存最近的摘要；缓存过期只会导致使用较旧的 watermark，结果仍然一致
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+import httpx
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.apps.api.config import settings
+from src.apps.api.dependencies import AsyncSessionLocal
+from src.apps.api.logging_config import logger
+from src.apps.api.models import Message, SessionSummary
+from src.apps.api.services.admission import (
+    AdmissionRejectedError,
+    AdmissionTimeoutError,
+    get_admission,
+)
+from src.apps.api.services.chat_history import HistoryRow, history_row_tokens
+from src.apps.api.services.llm_client import get_llm_client
+from src.apps.api.services.message_writer import PENDING_ID_BASE
+from src.apps.api.services.tokenizer import MESSAGE_OVERHEAD_TOKENS, count_tokens
+
+SUMMARY_SYSTEM_PROMPT = """你是门诊病历记录助手。下面是医生（医）与患者（患）的问诊对话片段。
+请把其中患者已经透露的事实整理成简洁的要点列表，例如：症状及持续时间、诱因、伴随症状、
+既往史、用药、过敏、个人史、家族史、已完成检查及结果。
+
+要求：
+- 只记录对话中明确说过的内容，不推测、不下诊断、不给建议
+- 如果提供了【已有摘要】，在其基础上合并更新，输出完整的新摘要
+- 只输出要点列表，每条一行，以“- ”开头"""
+
+SUMMARY_BLOCK_TITLE = "【前文摘要：患者已透露的信息】"
+
+# 后台摘要在准入控制中使用的用户ID（不对应真实用户，与对话请求公平轮转）
+SUMMARY_USER_ID = -1
+
+_ROLE_LABELS = {"user": "医", "assistant": "患", "system": "检查"}
+
+
+@dataclass(frozen=True)
+class SummaryState:
+    """会话摘要快照。"""
+
+    content: str
+    tokens: int
+    watermark_message_id: int
+
+
+# 进程内摘要缓存（LRU）与后台任务
+_cache: OrderedDict[int, SummaryState] = OrderedDict()
+_inflight: dict[int, asyncio.Task[None]] = {}
+
+
+def _cache_put(session_id: int, state: SummaryState) -> None:
+    current = _cache.get(session_id)
+    if current is not None and current.watermark_message_id >= state.watermark_message_id:
+        _cache.move_to_end(session_id)
+        return
+    _cache[session_id] = state
+    _cache.move_to_end(session_id)
+    while len(_cache) > settings.CHAT_SUMMARY_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+async def get_summary(db: AsyncSession, session_id: int) -> SummaryState | None:
+    """获取会话摘要（优先进程内缓存）。"""
+    if not settings.CHAT_SUMMARY_ENABLED:
+        return None
+
+    cached = _cache.get(session_id)
+    if cached is not None:
+        _cache.move_to_end(session_id)
+        return cached
+
+    result = await db.execute(
+        select(
+            SessionSummary.content,
+            SessionSummary.tokens,
+            SessionSummary.watermark_message_id,
+        ).where(SessionSummary.session_id == session_id)
+    )
+    row = result.one_or_none()
+    if row is None:
+        return None
+    state = SummaryState(
+        content=row.content,
+        tokens=row.tokens,
+        watermark_message_id=row.watermark_message_id,
+    )
+    _cache_put(session_id, state)
+    return state
+
+
+def build_summary_message(summary: SummaryState) -> dict[str, str]:
+    """构建插入提示词的摘要 system 消息。"""
+    return {"role": "system", "content": f"{SUMMARY_BLOCK_TITLE}\n{summary.content}"}
+
+
+def unsummarized_history(
+    history: Sequence[HistoryRow],
+    summary: SummaryState | None,
+) -> list[HistoryRow]:
+    """过滤掉已并入摘要的消息（检查结果 system 消息始终保留原文）。"""
+    if summary is None:
+        return list(history)
+    watermark = summary.watermark_message_id
+    return [row for row in history if row.id > watermark or row.role == "system"]
+
+
+def plan_summary_update(
+    history: Sequence[HistoryRow],
+    packed: Sequence[HistoryRow],
+    summary: SummaryState | None,
+) -> int | None:
+    """判断是否需要后台更新摘要。
+
+    触发条件（任一）：
+    - 未摘要的原文历史超过 CHAT_SUMMARY_TRIGGER_TOKENS
+    - 打包时有未摘要的消息因预算不足被丢弃
+
+    Returns:
+        本次摘要应覆盖到的已落库消息ID（保留最近 CHAT_SUMMARY_KEEP_RECENT 条原文），
+        无需更新或尚无可摘要的已落库消息时为 None
+    """
+    if not settings.CHAT_SUMMARY_ENABLED:
+        return None
+
+    watermark = summary.watermark_message_id if summary is not None else 0
+    pending = [row for row in history if row.id > watermark and row.role != "system"]
+    if len(pending) <= settings.CHAT_SUMMARY_KEEP_RECENT:
+        return None
+
+    pending_tokens = sum(history_row_tokens(row) for row in pending)
+    packed_ids = {row.id for row in packed}
+    dropped = any(row.id not in packed_ids for row in pending)
+    if pending_tokens <= settings.CHAT_SUMMARY_TRIGGER_TOKENS and not dropped:
+        return None
+
+    # 摘要目标只能是已落库的消息：写入队列中消息的临时 ID（PENDING_ID_BASE 起）
+    # 不能作为 watermark，此时退到最近一条已落库的消息
+    candidates = pending[: len(pending) - settings.CHAT_SUMMARY_KEEP_RECENT]
+    persisted = [row.id for row in candidates if row.id < PENDING_ID_BASE]
+    return persisted[-1] if persisted else None
+
+
+def schedule_summary_update(session_id: int, up_to_message_id: int) -> None:
+    """在后台增量更新会话摘要（同一会话同时只运行一个任务）。"""
+    task = _inflight.get(session_id)
+    if task is not None and not task.done():
+        return
+    task = asyncio.create_task(_update_summary(session_id, up_to_message_id))
+    _inflight[session_id] = task
+    task.add_done_callback(lambda _t: _inflight.pop(session_id, None))
+
+
+async def shutdown_summarizer() -> None:
+    """取消尚未完成的后台摘要任务（应用关闭时调用）。"""
+    tasks = list(_inflight.values())
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    _inflight.clear()
+
+
+def _format_transcript(rows: Sequence[tuple[str, str]]) -> str:
+    return "\n".join(f"{_ROLE_LABELS.get(role, role)}：{content}" for role, content in rows)
+
+
+async def _summarize(previous: str | None, rows: Sequence[tuple[str, str]]) -> str | None:
+    """调用 LLM 生成合并后的摘要。"""
+    user_parts = []
+    if previous:
+        user_parts.append(f"【已有摘要】\n{previous}")
+    user_parts.append(f"【新增对话】\n{_format_transcript(rows)}")
+
+    try:
+        async with get_admission().slot(SUMMARY_USER_ID):
+            resp = await get_llm_client().post_chat(
+                {
+                    "model": settings.LLM_MODEL,
+                    "messages": [
+                        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                        {"role": "user", "content": "\n\n".join(user_parts)},
+                    ],
+                    "stream": False,
+                    "temperature": 0.2,
+                    "max_tokens": settings.CHAT_SUMMARY_MAX_TOKENS,
+                }
+            )
+    except (AdmissionRejectedError, AdmissionTimeoutError):
+        # LLM 繁忙时跳过本次摘要，下一轮对话会再次触发
+        logger.info("LLM 繁忙，跳过会话摘要")
+        return None
+    except httpx.HTTPError as e:
+        logger.warning("会话摘要生成失败", error=str(e))
+        return None
+
+    if resp.status_code != 200:
+        logger.warning("会话摘要生成失败", status_code=resp.status_code)
+        return None
+
+    data = resp.json()
+    content = (data.get("choices") or [{}])[0].get("message", {}).get("content", "")
+    return content.strip() or None
+
+
+async def _update_summary(session_id: int, up_to_message_id: int) -> None:
+    """把 (watermark, up_to_message_id] 区间的消息增量并入摘要。"""
+    # 单次摘要的输入预算：上下文 - 输出 - 提示词开销
+    input_budget = (
+        settings.LLM_MAX_CONTEXT_LEN
+        - settings.CHAT_SUMMARY_MAX_TOKENS
+        - count_tokens(SUMMARY_SYSTEM_PROMPT)
+        - 4 * MESSAGE_OVERHEAD_TOKENS
+    )
+
+    try:
+        while True:
+            async with AsyncSessionLocal() as db:
+                current = await get_summary(db, session_id)
+                watermark = current.watermark_message_id if current is not None else 0
+                if watermark >= up_to_message_id:
+                    return
+
+                result = await db.execute(
+                    select(Message.id, Message.role, Message.content, Message.tokens)
+                    .where(
+                        Message.session_id == session_id,
+                        Message.id > watermark,
+                        Message.id <= up_to_message_id,
+                    )
+                    .order_by(Message.id)
+                    .limit(settings.CHAT_SUMMARY_BATCH_SIZE)
+                )
+                rows = result.all()
+            if not rows:
+                return
+
+            # 按输入预算截取本批消息（至少一条，保证推进 watermark）
+            budget = input_budget - (current.tokens if current is not None else 0)
+            batch: list[tuple[str, str]] = []
+            last_id = watermark
+            for row in rows:
+                cost = (
+                    row.tokens if row.tokens is not None else count_tokens(row.content)
+                ) + MESSAGE_OVERHEAD_TOKENS
+                if batch and cost > budget:
+                    break
+                budget -= cost
+                batch.append((row.role, row.content))
+                last_id = row.id
+
+            content = await _summarize(current.content if current else None, batch)
+            if content is None:
+                return
+
+            state = SummaryState(
+                content=content,
+                tokens=count_tokens(content),
+                watermark_message_id=last_id,
+            )
+            async with AsyncSessionLocal() as db:
+                await _save_summary(db, session_id, state)
+            _cache_put(session_id, state)
+            logger.debug(
+                "会话摘要已更新",
+                session_id=session_id,
+                watermark_message_id=last_id,
+                summary_tokens=state.tokens,
+            )
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error("会话摘要更新异常", session_id=session_id, error=str(e))
+
+
+async def _save_summary(db: AsyncSession, session_id: int, state: SummaryState) -> None:
+    """写入摘要；并发写入时只保留 watermark 更大的版本。"""
+    stmt = insert(SessionSummary).values(
+        session_id=session_id,
+        content=state.content,
+        tokens=state.tokens,
+        watermark_message_id=state.watermark_message_id,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SessionSummary.session_id],
+        set_={
+            "content": stmt.excluded.content,
+            "tokens": stmt.excluded.tokens,
+            "watermark_message_id": stmt.excluded.watermark_message_id,
+            "updated_at": stmt.excluded.updated_at,
+        },
+        where=SessionSummary.watermark_message_id < stmt.excluded.watermark_message_id,
+    )
+    await db.execute(stmt)
+    await db.commit()
+
+
+__all__ = [
+    "SummaryState",
+    "build_summary_message",
+    "get_summary",
+    "plan_summary_update",
+    "schedule_summary_update",
+    "shutdown_summarizer",
+    "unsummarized_history",
+]
@@ -10,6 +10,7 @@
 from __future__ import annotations
 
 import re
+from collections.abc import Set
 from dataclasses import dataclass
 
 
@@ -35,7 +36,7 @@ _ORDER_VERBS = (
 _RESULT_WORDS = ("结果", "报告", "片子", "片", "单")
 
 
-def extract_test_intent(message: str, available_test_types: set[str]) -> TestIntent | None:
+def extract_test_intent(message: str, available_test_types: Set[str]) -> TestIntent | None:
     """从医生消息中提取检查相关意图。
 
     Args:
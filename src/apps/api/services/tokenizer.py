@@ -0,0 +1,178 @@
+"""Token 计数服务。
+
+提示词预算需要与实际部署的模型一致：
+- 从本地路径加载所部署模型的 tokenizer（tokenizer.json），进程内只加载一次
+- 按文本缓存 token 数（系统提示词、开发者提示词、历史消息每轮都会重复计数）
+- 未配置路径或加载失败时回退到快速启发式估算（偏保守，宁多勿少）
+
+说明：
+- 优先使用 `tokenizers`（vLLM/transformers 的依赖，加载快、编码快），
+  不可用时再尝试 transformers 的 AutoTokenizer。
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from collections.abc import Callable, Iterable
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+from src.apps.api.config import settings
+from src.apps.api.logging_config import logger
+
+# 聊天模板开销（Qwen ChatML：<|im_start|>role\n ... <|im_end|>\n）
+MESSAGE_OVERHEAD_TOKENS = 5
+# 生成前的 assistant 引导（<|im_start|>assistant\n）
+REPLY_PRIMING_TOKENS = 3
+
+
+def _is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return (
+        0x4E00 <= code <= 0x9FFF  # CJK 统一表意文字
+        or 0x3400 <= code <= 0x4DBF  # 扩展 A
+        or 0x3000 <= code <= 0x303F  # CJK 标点
+        or 0xFF00 <= code <= 0xFFEF  # 全角字符
+    )
+
+
+def heuristic_token_count(text: str) -> int:
+    """启发式估算 token 数。
+
+    中文字符（含全角标点）按 1 字符 1 token，其余按约 3 字符 1 token。
+    对 Qwen 等中文词表而言这是一个略偏高的上界。
+    """
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if _is_cjk(ch))
+    other = len(text) - cjk
+    return cjk + math.ceil(other / 3)
+
+
+def _resolve_tokenizer_path() -> Path | None:
+    """确定 tokenizer 所在路径。
+
+    优先使用 LLM_TOKENIZER_PATH；未配置时，若 LLM_MODEL 本身是本地模型目录
+    （vLLM 直接以路径启动的常见做法），则复用该目录。
+    """
+    candidates = [settings.LLM_TOKENIZER_PATH, settings.LLM_MODEL]
+    for candidate in candidates:
+        if not candidate:
+            continue
+        path = Path(candidate).expanduser()
+        if path.exists():
+            return path
+    return None
+
+
+def _load_encoder(path: Path) -> Callable[[str], int]:
+    """加载 tokenizer，返回“文本 -> token 数”函数。"""
+    tokenizer_file = path / "tokenizer.json" if path.is_dir() else path
+    try:
+        from tokenizers import Tokenizer  # type: ignore
+
+        fast = Tokenizer.from_file(str(tokenizer_file))
+        return lambda text: len(fast.encode(text, add_special_tokens=False).ids)
+    except Exception as e:
+        logger.debug("tokenizers 加载失败，尝试 transformers", error=str(e))
+
+    from transformers import AutoTokenizer  # type: ignore
+
+    hf: Any = AutoTokenizer.from_pretrained(
+        str(path if path.is_dir() else path.parent),
+        local_files_only=True,
+        trust_remote_code=False,
+    )
+    return lambda text: len(hf.encode(text, add_special_tokens=False))
+
+
+class TokenizerService:
+    """进程级 token 计数服务。"""
+
+    def __init__(self, cache_size: int) -> None:
+        self._encode: Callable[[str], int] | None = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._cached_count = lru_cache(maxsize=cache_size)(self._count_uncached)
+        self.source = "heuristic"
+
+    def load(self) -> None:
+        """加载 tokenizer（幂等；失败时保留启发式回退）。"""
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            path = _resolve_tokenizer_path()
+            if path is None:
+                logger.info("未配置本地 tokenizer，使用启发式 token 估算")
+                return
+            try:
+                self._encode = _load_encoder(path)
+            except Exception as e:
+                logger.warning(
+                    "tokenizer 加载失败，使用启发式 token 估算", path=str(path), error=str(e)
+                )
+                return
+            self.source = str(path)
+            self._cached_count.cache_clear()
+            logger.info("tokenizer 已加载", path=str(path))
+
+    def _count_uncached(self, text: str) -> int:
+        if self._encode is not None:
+            try:
+                return self._encode(text)
+            except Exception:
+                pass
+        return heuristic_token_count(text)
+
+    def count(self, text: str) -> int:
+        """计算文本 token 数（带缓存）。"""
+        if not self._loaded:
+            self.load()
+        if not text:
+            return 0
+        return self._cached_count(text)
+
+    def count_messages(self, messages: Iterable[dict[str, Any]]) -> int:
+        """计算 OpenAI 风格消息列表的 prompt token 数（含聊天模板开销）。"""
+        total = REPLY_PRIMING_TOKENS
+        for m in messages:
+            total += self.count(str(m.get("content", ""))) + MESSAGE_OVERHEAD_TOKENS
+        return total
+
+
+_tokenizer: TokenizerService | None = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer() -> TokenizerService:
+    """获取进程级 TokenizerService 单例。"""
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                _tokenizer = TokenizerService(settings.TOKENIZER_CACHE_SIZE)
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    """计算单段文本的 token 数。"""
+    return get_tokenizer().count(text)
+
+
+def count_message_tokens(messages: Iterable[dict[str, Any]]) -> int:
+    """计算消息列表的 prompt token 数。"""
+    return get_tokenizer().count_messages(messages)
+
+
+__all__ = [
+    "MESSAGE_OVERHEAD_TOKENS",
+    "REPLY_PRIMING_TOKENS",
+    "TokenizerService",
+    "count_message_tokens",
+    "count_tokens",
+    "get_tokenizer",
+    "heuristic_token_count",
+]
@@ -1,6 +1,7 @@
 import request from "./request";
 import type {
   SessionResponse,
+  SessionProgress,
   SessionListResponse,
   SessionListItem,
   SessionDetail,
@@ -19,10 +20,14 @@ export function getSessions(params?: {
   return request.get<any, SessionListResponse>("/sessions/", { params });
 }
 
-// 创建会话（随机模式需要 LLM 生成病例，耗时较长，使用更大超时）
+// 创建会话（随机模式在病例池为空时返回 status=pending，需轮询 getSessionProgress）
 export function createSession(data: { mode?: "fixed" | "random"; case_id?: number }) {
-  const timeout = data.mode === "random" ? 120000 : 10000;
-  return request.post<any, SessionResponse>("/sessions/", data, { timeout });
+  return request.post<any, SessionResponse>("/sessions/", data);
+}
+
+// 查询随机会话的病例生成进度
+export function getSessionProgress(sessionId: number) {
+  return request.get<any, SessionProgress>(`/sessions/${sessionId}/progress`);
 }
 
 // 获取会话详情
@@ -57,6 +62,7 @@ export function submitDiagnosis(
 // Re-export types for convenience
 export type {
   SessionResponse,
+  SessionProgress,
   SessionListResponse,
   SessionListItem,
   SessionDetail,
@@ -55,11 +55,20 @@ export interface AvailableTestsResponse {
 // ==================== Sessions ====================
 export interface SessionResponse {
   id: number;
-  case_id: number;
+  case_id: number | null; // 随机病例生成中（status=pending）时为空
   status: string;
   started_at: string;
 }
 
+// 随机会话病例生成进度（POST /sessions/ 返回 202 后轮询）
+export interface SessionProgress {
+  session_id: number;
+  stage: "queued" | "generating" | "validating" | "ready" | "failed";
+  position: number | null;
+  case_id: number | null;
+  error: string | null;
+}
+
 export interface SessionCreateRequest {
   mode?: "fixed" | "random";
   case_id?: number;
@@ -94,9 +103,9 @@ export interface MessageItem {
 
 export interface SessionDetail {
   id: number;
-  case_id: number;
-  case_title: string;
-  case_difficulty: string;
+  case_id: number | null;
+  case_title: string | null;
+  case_difficulty: string | null;
   status: string;
   started_at: string;
   ended_at: string | null;
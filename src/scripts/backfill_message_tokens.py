@@ -0,0 +1,115 @@
+"""历史消息 token 数回填脚本。
+
+早期的 messages.tokens 由启发式估算得到，按 token 统计的报表与预算因此失真。
+本脚本用本地 tokenizer（LLM_TOKENIZER_PATH，与所部署模型一致）重新计数，
+按主键分批更新有差异的行：每批一个事务，中断后可用 --start-id 从上次的位置继续。
+
+上线 vLLM usage 记账（LLM_STREAM_INCLUDE_USAGE）后应尽快运行一次：默认只处理启动时
+已存在的消息（id 不超过当时的最大值），之后写入的消息已使用精确的 token 数。
+
+用法：
+    uv run python src/scripts/backfill_message_tokens.py --dry-run
+    uv run python src/scripts/backfill_message_tokens.py --batch-size 2000
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+from sqlalchemy import bindparam, func, select, update
+
+# 添加项目根目录到路径
+project_root = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(project_root))
+
+from src.apps.api.dependencies import engine  # noqa: E402
+from src.apps.api.models import Message  # noqa: E402
+from src.apps.api.services.tokenizer import count_tokens, get_tokenizer  # noqa: E402
+
+messages = Message.__table__
+
+UPDATE_TOKENS = (
+    update(messages)
+    .where(messages.c.id == bindparam("message_id"))
+    .values(tokens=bindparam("new_tokens"))
+)
+
+
+async def backfill(batch_size: int, start_id: int, max_id: int | None, dry_run: bool) -> None:
+    """分批重新计数并更新 messages.tokens。
+
+    Args:
+        batch_size: 每批读取的消息条数
+        start_id: 从该 ID 之后开始（续跑时传入上次输出的最后 ID）
+        max_id: 处理到该 ID 为止（None 表示启动时的最大 ID）
+        dry_run: 只统计差异，不写入
+    """
+    async with engine.connect() as conn:
+        if max_id is None:
+            max_id = (await conn.execute(select(func.max(messages.c.id)))).scalar() or 0
+
+    last_id = start_id
+    scanned = changed = 0
+    delta = 0
+    started = time.perf_counter()
+    while last_id < max_id:
+        async with engine.begin() as conn:
+            rows = (
+                await conn.execute(
+                    select(messages.c.id, messages.c.content, messages.c.tokens)
+                    .where(messages.c.id > last_id, messages.c.id <= max_id)
+                    .order_by(messages.c.id)
+                    .limit(batch_size)
+                )
+            ).all()
+            if not rows:
+                break
+
+            updates = []
+            for row in rows:
+                tokens = count_tokens(row.content)
+                if tokens != row.tokens:
+                    updates.append({"message_id": row.id, "new_tokens": tokens})
+                    delta += tokens - (row.tokens or 0)
+            if updates and not dry_run:
+                await conn.execute(UPDATE_TOKENS, updates)
+
+        scanned += len(rows)
+        changed += len(updates)
+        last_id = rows[-1].id
+        print(f"已处理至 id={last_id}（扫描 {scanned}，需更新 {changed}）")
+
+    action = "需更新" if dry_run else "已更新"
+    print(
+        f"完成：扫描 {scanned} 条，{action} {changed} 条，token 合计变化 {delta:+d}，"
+        f"耗时 {time.perf_counter() - started:.1f}s"
+    )
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="用本地 tokenizer 回填 messages.tokens")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每批处理的消息条数")
+    parser.add_argument("--start-id", type=int, default=0, help="从该消息 ID 之后开始（续跑）")
+    parser.add_argument("--max-id", type=int, default=None, help="处理到该消息 ID（默认当前最大）")
+    parser.add_argument("--dry-run", action="store_true", help="只统计差异，不写入")
+    parser.add_argument(
+        "--allow-heuristic",
+        action="store_true",
+        help="未加载到 tokenizer 时仍按启发式估算回填",
+    )
+    args = parser.parse_args()
+
+    tokenizer = get_tokenizer()
+    tokenizer.load()
+    if tokenizer.source == "heuristic" and not args.allow_heuristic:
+        sys.exit("未加载到本地 tokenizer（检查 LLM_TOKENIZER_PATH），回填结果不会比现有数据更准确")
+    print(f"使用 tokenizer：{tokenizer.source}")
+
+    asyncio.run(backfill(args.batch_size, args.start_id, args.max_id, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""随机病例生成重试率基准（录制 / 回放）。
+
+比较引导解码（LLM_CASE_GEN_GUIDED_JSON，按 CASE_JSON_SCHEMA 约束）与仅 json_object 时，
+每个成功病例平均需要多少次 LLM 请求、浪费多少 completion token。
+
+- record：按当前配置向 vLLM 发起病例生成请求（与服务相同的请求体），逐条录制原始输出；
+  分别在开启 / 关闭引导解码时各录制一次，追加到同一个文件
+- replay：离线回放录制文件（录制的输出作为 vLLM 替身），按服务的解析校验
+  （parse_case_content）与重试策略（LLM_CASE_GEN_RETRIES）统计，无需 GPU，结果可复现；
+  另按流式增量校验（build_case_validator）回放一遍：被中止的输出只计中止位置之前的
+  completion token（按字符比例估算），对比提前中止节省的 GPU 用量
+
+用法：
+    uv run python src/scripts/bench_case_generation.py record --out cases.jsonl -n 50
+    LLM_CASE_GEN_GUIDED_JSON=false \\
+        uv run python src/scripts/bench_case_generation.py record --out cases.jsonl -n 50
+    uv run python src/scripts/bench_case_generation.py replay cases.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(project_root))
+
+from src.apps.api.config import settings  # noqa: E402
+from src.apps.api.exceptions import BusinessError  # noqa: E402
+from src.apps.api.services.case_generation import (  # noqa: E402
+    DISEASE_LIST,
+    build_case_request,
+    build_case_validator,
+    parse_case_content,
+)
+from src.apps.api.services.json_stream import StreamValidationError  # noqa: E402
+from src.apps.api.services.llm_client import close_llm_client, init_llm_client  # noqa: E402
+
+
+async def record(out: Path, count: int, seed: int) -> None:
+    """录制 count 次病例生成请求的原始输出（不重试，每次请求一条记录）。"""
+    guided = settings.LLM_CASE_GEN_GUIDED_JSON
+    rng = random.Random(seed)
+    client = await init_llm_client()
+    try:
+        with out.open("a", encoding="utf-8") as f:
+            for idx in range(count):
+                case_number = rng.randint(1, len(DISEASE_LIST))
+                request = build_case_request(DISEASE_LIST[case_number], case_number)
+                resp = await client.post_chat(request)
+                if resp.status_code != 200:
+                    print(f"[{idx + 1}/{count}] HTTP {resp.status_code}，跳过")
+                    continue
+                data = resp.json()
+                choice = (data.get("choices") or [{}])[0]
+                usage = data.get("usage") or {}
+                row = {
+                    "guided": guided,
+                    "case_number": case_number,
+                    "finish_reason": choice.get("finish_reason"),
+                    "completion_tokens": usage.get("completion_tokens"),
+                    "content": (choice.get("message") or {}).get("content") or "",
+                }
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                print(f"[{idx + 1}/{count}] {DISEASE_LIST[case_number]} {row['finish_reason']}")
+    finally:
+        await close_llm_client()
+
+
+def _accepted(row: dict, guided: bool) -> bool:
+    content = row["content"].strip()
+    if not content:
+        return False
+    try:
+        parse_case_content(content, guided)
+    except (json.JSONDecodeError, BusinessError):
+        return False
+    return True
+
+
+def _streamed(row: dict, guided: bool) -> tuple[bool, float]:
+    """按流式增量校验回放一条输出，返回 (是否通过, 消耗的 completion token)。"""
+    content = row["content"]
+    tokens = int(row.get("completion_tokens") or 0)
+    try:
+        build_case_validator(guided).feed(content)
+    except StreamValidationError as e:
+        return False, tokens * e.position / max(len(content), 1)
+    return _accepted(row, guided), tokens
+
+
+def _simulate(outcomes: list[tuple[bool, float]], retries: int) -> tuple[int, int, int, float]:
+    """依次消费输出（每个病例最多请求 retries + 1 次），返回 (无效, 成功, 失败, token)。"""
+    invalid = succeeded = failed = 0
+    tokens = 0.0
+    attempts = 0
+    for accepted, used in outcomes:
+        attempts += 1
+        tokens += used
+        if accepted:
+            succeeded += 1
+            attempts = 0
+            continue
+        invalid += 1
+        if attempts > retries:
+            failed += 1
+            attempts = 0
+    return invalid, succeeded, failed, tokens
+
+
+def replay(path: Path, retries: int) -> None:
+    """按服务的重试策略回放录制的输出，分别统计两种解码方式（及是否流式中止）。"""
+    rows_by_mode: dict[bool, list[dict]] = defaultdict(list)
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                rows_by_mode[bool(row["guided"])].append(row)
+
+    for guided in (False, True):
+        rows = rows_by_mode.get(guided)
+        if not rows:
+            continue
+        name = "json_schema" if guided else "json_object"
+        for streamed in (False, True):
+            if streamed:
+                outcomes = [_streamed(row, guided) for row in rows]
+            else:
+                outcomes = [
+                    (_accepted(row, guided), float(row.get("completion_tokens") or 0))
+                    for row in rows
+                ]
+            invalid, succeeded, failed, tokens = _simulate(outcomes, retries)
+            per_success = len(rows) / succeeded if succeeded else float("inf")
+            tokens_per_success = tokens / succeeded if succeeded else float("inf")
+            label = f"{name}{'+stream' if streamed else ''}"
+            print(
+                f"{label:<19} 请求 {len(rows)}，无效 {invalid}（{invalid / len(rows):.1%}），"
+                f"成功病例 {succeeded}，失败病例 {failed}，"
+                f"请求/成功 {per_success:.2f}，completion token/成功 {tokens_per_success:.0f}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="随机病例生成重试率基准")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record", help="向 vLLM 录制病例生成输出")
+    rec.add_argument("--out", type=Path, required=True, help="录制文件（JSONL，追加写入）")
+    rec.add_argument("-n", "--count", type=int, default=50, help="请求次数")
+    rec.add_argument("--seed", type=int, default=0, help="疾病抽样的随机种子")
+    rep = sub.add_parser("replay", help="离线回放录制文件并统计")
+    rep.add_argument("recording", type=Path, help="录制文件")
+    rep.add_argument(
+        "--retries",
+        type=int,
+        default=settings.LLM_CASE_GEN_RETRIES,
+        help="每个病例的最大重试次数（默认 LLM_CASE_GEN_RETRIES）",
+    )
+    args = parser.parse_args()
+
+    if args.command == "record":
+        asyncio.run(record(args.out, args.count, args.seed))
+    else:
+        replay(args.recording, args.retries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""对话链路微基准脚本。
+
+在本地（无需数据库与 vLLM）测量对话链路中纯 CPU 环节的开销，
+用于验证优化效果并防止回退。
+
+用法：
+    uv run python src/scripts/bench_chat.py history-packer
+    uv run python src/scripts/bench_chat.py sse-frames
+    uv run python src/scripts/bench_chat.py stream-parser
+    uv run python src/scripts/bench_chat.py all
+"""
+
+import argparse
+import json
+import sys
+import timeit
+from collections.abc import Callable
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(project_root))
+
+from src.apps.api.services.chat_history import pack_history  # noqa: E402
+from src.apps.api.services.chat_stream import parse_chunk_json, scan_chunk  # noqa: E402
+from src.apps.api.services.sse import JSON_ENCODER, sse_frame  # noqa: E402
+
+# 典型患者回复：vLLM 每个增量一个汉字
+_ANSWER_DELTAS = list("大概三天了，昨天晚上有点发烧，肚子一阵一阵地疼，吃了点东西就想吐。" * 6)
+
+
+class _Row:
+    """与 HistoryRow 字段一致的轻量行对象。"""
+
+    __slots__ = ("id", "role", "content", "tokens", "created_at")
+
+    def __init__(self, idx: int, role: str, content: str, tokens: int) -> None:
+        self.id = idx
+        self.role = role
+        self.content = content
+        self.tokens = tokens
+        self.created_at = datetime(2026, 1, 1) + timedelta(seconds=idx)
+
+
+def _make_history(size: int) -> list[_Row]:
+    rows: list[_Row] = []
+    for idx in range(size):
+        if idx % 15 == 14:
+            rows.append(_Row(idx, "system", "[检查结果] 血常规:\nWBC: 12.5", 20))
+        elif idx % 2 == 0:
+            rows.append(_Row(idx, "user", "疼了多久了？有没有发热？", 12))
+        else:
+            rows.append(_Row(idx, "assistant", "大概三天了，昨天晚上有点发烧。", 15))
+    return rows
+
+
+def _report(name: str, func: Callable[[], object], number: int) -> None:
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    print(f"{name:<40} {seconds / number * 1e6:>10.2f} µs/op")
+
+
+def bench_history_packer() -> None:
+    """pack_history：不同窗口大小下的单次打包耗时（应随窗口线性增长）。"""
+    print("pack_history（预算 400 tokens）")
+    for size in (10, 40, 160, 640):
+        rows = _make_history(size)
+        _report(f"  window={size}", lambda rows=rows: pack_history(rows, 400), 2000)
+
+
+def _frames_per_delta_legacy() -> list[str]:
+    return [
+        f"data: {json.dumps({'content': delta, 'done': False})}\n\n" for delta in _ANSWER_DELTAS
+    ]
+
+
+def _frames_coalesced(per_frame: int) -> list[bytes]:
+    return [
+        sse_frame({"content": "".join(_ANSWER_DELTAS[i : i + per_frame]), "done": False})
+        for i in range(0, len(_ANSWER_DELTAS), per_frame)
+    ]
+
+
+def bench_sse_frames() -> None:
+    """SSE 帧编码：逐增量 json.dumps 与合并后预编码 bytes 的单次回答开销。"""
+    print(f"单次回答 {len(_ANSWER_DELTAS)} 个增量（编码器：{JSON_ENCODER}）")
+
+    def report(name: str, func: Callable[[], list], number: int = 500) -> None:
+        frames = func()
+        size = sum(len(f.encode() if isinstance(f, str) else f) for f in frames)
+        seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+        print(
+            f"  {name:<34} {seconds * 1e6:>9.1f} µs/answer"
+            f" {len(frames):>5} frames {size:>7} bytes"
+            f" {len(frames) / seconds:>12,.0f} frames/s"
+        )
+
+    report("per-delta json.dumps (legacy)", _frames_per_delta_legacy)
+    for per_frame in (1, 4, 16):
+        report(f"coalesced x{per_frame} sse_frame", lambda n=per_frame: _frames_coalesced(n))
+
+
+def _vllm_chunk_lines() -> list[bytes]:
+    """与 vLLM 输出格式一致的流式数据行（紧凑 JSON，中文不转义）。"""
+    lines = []
+    for delta in _ANSWER_DELTAS:
+        chunk = {
+            "id": "chatcmpl-8f3c2a1b9d7e4f60",
+            "object": "chat.completion.chunk",
+            "created": 1760000000,
+            "model": "qwen2.5-1.5b-instruct",
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": {"content": delta},
+                    "logprobs": None,
+                    "finish_reason": None,
+                }
+            ],
+        }
+        line = json.dumps(chunk, ensure_ascii=False, separators=(",", ":"))
+        lines.append(f"data: {line}".encode())
+    return lines
+
+
+def bench_stream_parser() -> None:
+    """上游流解析：逐行 json.loads 与 passthrough 字节扫描的单 token 开销。"""
+    lines = _vllm_chunk_lines()
+    print(f"单次回答 {len(lines)} 行 vLLM 流式数据")
+
+    def json_path() -> str:
+        parts = []
+        for line in lines:
+            # 与 json 模式一致：先解码为 str 行，再完整解析
+            content, _finish = parse_chunk_json(line.decode()[6:])
+            if content:
+                parts.append(content)
+        return "".join(parts)
+
+    def passthrough_path() -> str:
+        parts = []
+        for line in lines:
+            content, _finish = scan_chunk(line[6:])
+            if content:
+                parts.append(content)
+        return "".join(parts)
+
+    assert json_path() == passthrough_path()
+    for name, func in (
+        ("json.loads (json)", json_path),
+        ("byte scan (passthrough)", passthrough_path),
+    ):
+        seconds = min(timeit.repeat(func, number=500, repeat=5)) / 500
+        print(
+            f"  {name:<34} {seconds * 1e6:>9.1f} µs/answer"
+            f" {seconds / len(lines) * 1e9:>8.0f} ns/token"
+        )
+
+
+BENCHMARKS: dict[str, Callable[[], None]] = {
+    "history-packer": bench_history_packer,
+    "sse-frames": bench_sse_frames,
+    "stream-parser": bench_stream_parser,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="对话链路微基准")
+    parser.add_argument("name", choices=[*BENCHMARKS, "all"], help="基准名称")
+    args = parser.parse_args()
+
+    names = list(BENCHMARKS) if args.name == "all" else [args.name]
+    for name in names:
+        BENCHMARKS[name]()
+        print()
+
+
+if __name__ == "__main__":
+    main()
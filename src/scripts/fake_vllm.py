@@ -0,0 +1,143 @@
+"""本地 vLLM 替身服务。
+
+实现 vLLM OpenAI 兼容接口的最小子集（/health、/v1/models、/v1/chat/completions，
+含 SSE 流式），用于在没有 GPU 的环境中联调后端池、准入控制与流式链路。
+
+用法（启动两个副本，其中一个健康检查失败）：
+    uv run python src/scripts/fake_vllm.py --port 8101
+    uv run python src/scripts/fake_vllm.py --port 8102 --unhealthy
+    LLM_BACKEND_URLS='["http://127.0.0.1:8101","http://127.0.0.1:8102"]' uv run uvicorn ...
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections.abc import AsyncGenerator
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+REPLY = "大概三天了，昨天晚上有点发烧，肚子一阵一阵地疼。"
+
+
+def create_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI(title="fake-vllm")
+    state = {"in_flight": 0, "requests": 0}
+
+    @app.get("/health")
+    async def health() -> Response:
+        return Response(status_code=503 if args.unhealthy else 200)
+
+    @app.get("/v1/models")
+    async def models() -> dict:
+        return {"object": "list", "data": [{"id": args.model, "object": "model"}]}
+
+    @app.get("/stats")
+    async def stats() -> dict:
+        return state
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request) -> Response:
+        body = await request.json()
+        state["requests"] += 1
+        if args.fail_rate and state["requests"] % args.fail_rate == 0:
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+
+        max_tokens = int(body.get("max_tokens") or len(REPLY))
+        pieces = list(REPLY)[:max_tokens]
+        created = int(time.time())
+        # 粗略的 prompt token 数（按字符计），仅用于联调 usage 记账
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", []))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(pieces),
+            "total_tokens": prompt_tokens + len(pieces),
+        }
+
+        if not body.get("stream"):
+            state["in_flight"] += 1
+            try:
+                await asyncio.sleep(args.ttft + args.token_delay * len(pieces))
+            finally:
+                state["in_flight"] -= 1
+            return JSONResponse(
+                {
+                    "id": "fake",
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": args.model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": "".join(pieces)},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                }
+            )
+
+        async def stream() -> AsyncGenerator[str, None]:
+            state["in_flight"] += 1
+            try:
+                await asyncio.sleep(args.ttft)
+                finish_reason = "length" if len(pieces) < len(REPLY) else "stop"
+                for idx, piece in enumerate(pieces):
+                    last = idx == len(pieces) - 1
+                    chunk = {
+                        "id": "fake",
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": args.model,
+                        "choices": [
+                            {
+                                "index": 0,
+                                "delta": {"content": piece},
+                                "logprobs": None,
+                                "finish_reason": finish_reason if last else None,
+                            }
+                        ],
+                    }
+                    # 与 vLLM 一致：紧凑 JSON，中文不转义
+                    line = json.dumps(chunk, ensure_ascii=False, separators=(",", ":"))
+                    yield f"data: {line}\n\n"
+                    await asyncio.sleep(args.token_delay)
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    # 与 vLLM 一致：最后一个数据块 choices 为空，携带整次请求的 usage
+                    chunk = {
+                        "id": "fake",
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": args.model,
+                        "choices": [],
+                        "usage": usage,
+                    }
+                    line = json.dumps(chunk, ensure_ascii=False, separators=(",", ":"))
+                    yield f"data: {line}\n\n"
+                yield "data: [DONE]\n\n"
+            finally:
+                state["in_flight"] -= 1
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="本地 vLLM 替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--model", default="fake-model")
+    parser.add_argument("--ttft", type=float, default=0.05, help="首 token 延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="每 token 间隔（秒）")
+    parser.add_argument("--fail-rate", type=int, default=0, help="每 N 个请求返回一次 500")
+    parser.add_argument("--unhealthy", action="store_true", help="/health 返回 503")
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
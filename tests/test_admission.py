@@ -0,0 +1,134 @@
+"""LLM 准入控制与副本选择测试。"""
+
+import asyncio
+
+import pytest
+
+from src.apps.api.config import settings
+from src.apps.api.services.admission import (
+    AdmissionController,
+    AdmissionRejectedError,
+    AdmissionTimeoutError,
+)
+from src.apps.api.services.llm_pool import LLMBackendPool, rendezvous_pick
+
+
+@pytest.fixture(autouse=True)
+def queue_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "LLM_QUEUE_MAX", 10)
+    monkeypatch.setattr(settings, "LLM_QUEUE_MAX_PER_USER", 3)
+    monkeypatch.setattr(settings, "LLM_QUEUE_TIMEOUT", 30.0)
+
+
+def test_admits_up_to_capacity_then_queues() -> None:
+    admission = AdmissionController(lambda: 2)
+    first, second, third = (admission.reserve(user_id) for user_id in (1, 2, 3))
+
+    assert first.granted
+    assert second.granted
+    assert not third.granted
+    assert admission.position(third) == 1
+
+    admission.release(first)
+    assert third.granted
+    assert admission.in_flight == 2
+    assert admission.queued == 0
+
+
+def test_queue_is_round_robin_between_users() -> None:
+    admission = AdmissionController(lambda: 1)
+    running = admission.reserve(99)
+    # 用户 1 连续提问三次，用户 2、3 各一次
+    tickets = [admission.reserve(user_id) for user_id in (1, 1, 1, 2, 3)]
+
+    order = []
+    for _ in tickets:
+        admission.release(running)
+        running = next(t for t in tickets if t.granted and t not in order)
+        order.append(running)
+
+    assert [t.user_id for t in order] == [1, 2, 3, 1, 1]
+
+
+def test_full_queue_is_rejected_with_retry_after() -> None:
+    admission = AdmissionController(lambda: 1)
+    admission.reserve(1)
+    for _ in range(settings.LLM_QUEUE_MAX_PER_USER):
+        admission.reserve(2)
+
+    with pytest.raises(AdmissionRejectedError) as info:
+        admission.reserve(2)
+    assert info.value.retry_after >= 1
+    assert admission.rejected == 1
+    # 其他用户仍可排队
+    assert not admission.reserve(3).granted
+
+
+def test_release_of_queued_ticket_leaves_queue() -> None:
+    admission = AdmissionController(lambda: 1)
+    admission.reserve(1)
+    queued = admission.reserve(2)
+
+    admission.release(queued)
+    admission.release(queued)
+    assert admission.queued == 0
+    assert admission.in_flight == 1
+
+
+async def test_wait_times_out(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "LLM_QUEUE_TIMEOUT", 0.05)
+    monkeypatch.setattr(settings, "LLM_QUEUE_POSITION_INTERVAL", 0.01)
+    admission = AdmissionController(lambda: 1)
+    admission.reserve(1)
+    ticket = admission.reserve(2)
+
+    positions: list[int] = []
+
+    async def collect() -> None:
+        async for position in admission.wait(ticket):
+            positions.append(position)
+
+    with pytest.raises(AdmissionTimeoutError):
+        await collect()
+    assert positions == [1]
+    assert admission.queued == 0
+    assert admission.timeouts == 1
+
+
+async def test_slot_waits_for_capacity() -> None:
+    admission = AdmissionController(lambda: 1)
+    holder = admission.reserve(1)
+    entered = asyncio.Event()
+
+    async def background() -> None:
+        async with admission.slot(-1):
+            entered.set()
+
+    task = asyncio.create_task(background())
+    await asyncio.sleep(0)
+    assert not entered.is_set()
+    admission.release(holder)
+    await asyncio.wait_for(task, timeout=1.0)
+    assert entered.is_set()
+    assert admission.in_flight == 0
+
+
+def test_affinity_never_exceeds_per_backend_cap(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "LLM_PREFIX_AFFINITY", True)
+    monkeypatch.setattr(settings, "LLM_MAX_IN_FLIGHT_PER_BACKEND", 3)
+    monkeypatch.setattr(settings, "LLM_AFFINITY_MAX_SKEW", 100)
+    pool = LLMBackendPool(["http://a", "http://b"])
+    admission = AdmissionController(
+        lambda: settings.LLM_MAX_IN_FLIGHT_PER_BACKEND * len(pool.backends)
+    )
+
+    # 所有请求使用同一亲和键（同一病例），按准入放行后再选择副本
+    preferred = rendezvous_pick("case-1", [b.url for b in pool.backends])
+    picks = []
+    while admission.reserve(1).granted:
+        backend = pool.choose("case-1")
+        backend.in_flight += 1
+        picks.append(backend.url)
+
+    assert picks[:3] == [preferred] * 3
+    assert all(b.in_flight == settings.LLM_MAX_IN_FLIGHT_PER_BACKEND for b in pool.backends)
@@ -0,0 +1,89 @@
+"""随机病例池测试：领取语句、疾病分散与空闲判断。"""
+
+from collections import Counter
+from typing import Any
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from src.apps.api.config import settings
+from src.apps.api.services import case_pool
+from src.apps.api.services.admission import AdmissionController
+from src.apps.api.services.case_generation import DISEASE_LIST
+from src.apps.api.services.case_pool import CasePool
+
+
+class _Result:
+    def __init__(self, case_id: int | None) -> None:
+        self._case_id = case_id
+
+    def scalar_one_or_none(self) -> int | None:
+        return self._case_id
+
+
+class _Db:
+    def __init__(self, case_id: int | None) -> None:
+        self.case_id = case_id
+        self.statements: list[Any] = []
+
+    async def execute(self, stmt: Any) -> _Result:
+        self.statements.append(stmt)
+        return _Result(self.case_id)
+
+
+@pytest.fixture(autouse=True)
+def pool_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CASE_POOL_SIZE", 4)
+    monkeypatch.setattr(settings, "CASE_POOL_IDLE_UTILIZATION", 0.5)
+
+
+async def test_claim_is_a_single_skip_locked_update() -> None:
+    pool = CasePool()
+    db = _Db(case_id=3)
+
+    assert await pool.claim(db) == 3  # type: ignore[arg-type]
+
+    assert len(db.statements) == 1
+    sql = str(db.statements[0].compile(dialect=postgresql.dialect())).upper()
+    # 候选行加锁并跳过其他事务已锁定的行，多 worker 并发领取不会拿到同一个病例
+    assert sql.startswith("UPDATE CASES SET SOURCE=")
+    assert "FOR UPDATE SKIP LOCKED" in sql
+    assert "RETURNING CASES.ID" in sql
+    assert pool.claimed == 1
+
+
+async def test_empty_pool_counts_miss() -> None:
+    pool = CasePool()
+
+    assert await pool.claim(_Db(case_id=None)) is None  # type: ignore[arg-type]
+    assert pool.misses == 1
+    assert pool.claimed == 0
+
+
+async def test_disabled_pool_does_not_query(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CASE_POOL_SIZE", 0)
+    db = _Db(case_id=3)
+
+    assert await CasePool().claim(db) is None  # type: ignore[arg-type]
+    assert db.statements == []
+
+
+def test_refill_prefers_diseases_missing_from_pool() -> None:
+    missing, *present = DISEASE_LIST
+    pooled = Counter(dict.fromkeys(present, 1))
+
+    assert {CasePool._pick_disease(pooled) for _ in range(20)} == {missing}
+    assert CasePool._pick_disease(Counter(dict.fromkeys(DISEASE_LIST, 1))) in DISEASE_LIST
+
+
+def test_refill_only_when_llm_is_idle(monkeypatch: pytest.MonkeyPatch) -> None:
+    admission = AdmissionController(lambda: 4)
+    monkeypatch.setattr(case_pool, "get_admission", lambda: admission)
+    pool = CasePool()
+
+    assert pool._idle()
+    admission.reserve(1)
+    assert pool._idle()
+    admission.reserve(2)
+    # 在途达到容量的 CASE_POOL_IDLE_UTILIZATION
+    assert not pool._idle()
@@ -0,0 +1,160 @@
+"""对话历史加载与打包测试。"""
+
+from datetime import datetime
+from typing import Any
+
+import pytest
+
+from src.apps.api.services import chat_history
+from src.apps.api.services.chat_history import (
+    history_row_tokens,
+    load_history_window,
+    pack_history,
+)
+from src.apps.api.services.message_writer import PENDING_ID_BASE, PendingRow
+
+NOW = datetime(2026, 1, 1)
+
+
+def _row(id_: int, role: str, content: str) -> PendingRow:
+    return PendingRow(id=id_, role=role, content=content, tokens=10, created_at=NOW)
+
+
+class _Writer:
+    def __init__(self, pending: list[PendingRow]) -> None:
+        self.pending = pending
+        self.persisted: dict[int, int] = {}
+
+    def pending_rows(self, session_id: int) -> list[PendingRow]:
+        return list(self.pending)
+
+    def persisted_id(self, pending_id: int) -> int | None:
+        return self.persisted.get(pending_id)
+
+    def commit(self, *message_ids: int) -> None:
+        """模拟写入队列提交开头的若干条消息（记录真实 ID 并移出队列）。"""
+        for row, message_id in zip(self.pending, message_ids, strict=False):
+            self.persisted[row.id] = message_id
+        del self.pending[: len(message_ids)]
+
+
+class _Result:
+    def __init__(self, rows: list[PendingRow]) -> None:
+        self._rows = rows
+
+    def all(self) -> list[PendingRow]:
+        return self._rows
+
+
+class _Db:
+    """查询期间可模拟写入队列提交一个批次。"""
+
+    def __init__(self, rows: list[PendingRow], on_execute: Any = None) -> None:
+        self.rows = rows
+        self.on_execute = on_execute
+
+    async def execute(self, stmt: Any) -> _Result:
+        if self.on_execute is not None:
+            self.on_execute()
+        return _Result(self.rows)
+
+
+async def test_batch_committed_after_query_snapshot_is_not_lost(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    persisted = [_row(1, "user", "哪里不舒服"), _row(2, "assistant", "头痛")]
+    queued = [
+        _row(PENDING_ID_BASE + 1, "user", "多久了"),
+        _row(PENDING_ID_BASE + 2, "assistant", "三天"),
+    ]
+    writer = _Writer(queued)
+    monkeypatch.setattr(chat_history, "get_message_writer", lambda: writer)
+
+    # 查询快照不含该批次，而批次在查询返回前提交并移出写入队列
+    db = _Db(persisted, on_execute=lambda: writer.commit(3, 4))
+
+    rows = await load_history_window(db, session_id=1, limit=20)  # type: ignore[arg-type]
+
+    assert [row.content for row in rows] == ["哪里不舒服", "头痛", "多久了", "三天"]
+
+
+async def test_batch_committed_before_query_snapshot_is_not_duplicated(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    persisted = [_row(1, "user", "哪里不舒服"), _row(2, "assistant", "头痛")]
+    queued = [
+        _row(PENDING_ID_BASE + 1, "user", "多久了"),
+        _row(PENDING_ID_BASE + 2, "assistant", "三天"),
+    ]
+    writer = _Writer(queued)
+    monkeypatch.setattr(chat_history, "get_message_writer", lambda: writer)
+
+    # 查询快照已包含刚提交的批次，且该批次已移出写入队列
+    committed = [_row(3, "user", "多久了"), _row(4, "assistant", "三天")]
+    db = _Db(persisted + committed, on_execute=lambda: writer.commit(3, 4))
+
+    rows = await load_history_window(db, session_id=1, limit=20)  # type: ignore[arg-type]
+
+    assert [row.content for row in rows] == ["哪里不舒服", "头痛", "多久了", "三天"]
+    assert [row.id for row in rows] == [1, 2, 3, 4]
+
+
+async def test_repeated_question_in_queue_is_kept(monkeypatch: pytest.MonkeyPatch) -> None:
+    # 学生连续两次问同一句话：上一轮已落库，这一轮仍在写入队列中
+    persisted = [_row(1, "user", "还有吗？"), _row(2, "assistant", "没有了")]
+    queued = [
+        _row(PENDING_ID_BASE + 1, "user", "还有吗？"),
+        _row(PENDING_ID_BASE + 2, "assistant", "没有了"),
+    ]
+    monkeypatch.setattr(chat_history, "get_message_writer", lambda: _Writer(queued))
+
+    rows = await load_history_window(_Db(persisted), session_id=1, limit=20)  # type: ignore[arg-type]
+
+    assert [row.id for row in rows] == [1, 2, PENDING_ID_BASE + 1, PENDING_ID_BASE + 2]
+
+
+async def test_pending_rows_are_appended(monkeypatch: pytest.MonkeyPatch) -> None:
+    persisted = [_row(1, "user", "哪里不舒服"), _row(2, "assistant", "头痛")]
+    queued = [
+        _row(PENDING_ID_BASE + 1, "user", "多久了"),
+        _row(PENDING_ID_BASE + 2, "assistant", "三天"),
+    ]
+    monkeypatch.setattr(chat_history, "get_message_writer", lambda: _Writer(queued))
+
+    rows = await load_history_window(_Db(persisted), session_id=1, limit=3)  # type: ignore[arg-type]
+
+    assert [row.content for row in rows] == ["头痛", "多久了", "三天"]
+
+
+def _dialog(count: int) -> list[PendingRow]:
+    return [_row(i, "user" if i % 2 else "assistant", f"第{i}句") for i in range(1, count + 1)]
+
+
+def test_pack_keeps_newest_suffix_within_budget() -> None:
+    rows = _dialog(6)
+    cost = history_row_tokens(rows[0])
+
+    assert pack_history(rows, cost * 6) == rows
+    assert pack_history(rows, cost * 3) == rows[-3:]
+    assert pack_history(rows, cost * 3 + cost - 1) == rows[-3:]
+    assert pack_history(rows, cost - 1) == []
+    assert pack_history(rows, 0) == []
+
+
+def test_pack_stops_at_first_message_that_does_not_fit() -> None:
+    rows = _dialog(4)
+    rows[1] = PendingRow(id=2, role="assistant", content="很长", tokens=1000, created_at=NOW)
+    cost = history_row_tokens(rows[0])
+
+    # 放不下第 2 条后不再继续往前取，保证历史是连续的后缀
+    assert pack_history(rows, cost * 3) == rows[2:]
+
+
+def test_pack_pins_system_messages() -> None:
+    rows = _dialog(6)
+    rows[1] = _row(2, "system", "血常规：白细胞升高")
+    cost = history_row_tokens(rows[0])
+
+    packed = pack_history(rows, cost * 3)
+
+    assert [row.id for row in packed] == [2, 5, 6]
@@ -0,0 +1,204 @@
+"""并发流式对话不占满数据库连接池的测试。
+
+对话只在准备阶段短暂使用数据库连接，vLLM 流式生成期间不持有连接（见 routes/chat.py）。
+这里用带连接池语义的会话工厂替身（pool_size 个连接，等待超时即报错）替换
+AsyncSessionLocal，让超过 pool_size 个对话流同时处于生成中，检查没有等待连接超时、
+同时借出的连接数从未超过 pool_size。
+"""
+
+import asyncio
+import json
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any
+
+import pytest
+from sqlalchemy import exc
+
+from src.apps.api.config import settings
+from src.apps.api.models import Case, Session
+from src.apps.api.routes import chat
+from src.apps.api.schemas.chat import ChatRequest
+from src.apps.api.services import chat_stream
+from src.apps.api.services.admission import AdmissionController
+from src.apps.api.services.idempotency import IdempotencyClaim
+
+POOL_SIZE = 3
+STREAMS = POOL_SIZE * 3
+REPLY = ["您好", "，我", "头痛", "三天了"]
+# 生成耗时明显长于等待连接的超时：若流式阶段仍持有连接，排在后面的请求必然超时
+POOL_TIMEOUT = 0.3
+CHUNK_INTERVAL = 0.2
+
+
+class _DbStandIn:
+    async def round_trip(self) -> None:
+        # 模拟一次查询往返，期间持有连接
+        await asyncio.sleep(0.01)
+
+
+class _PoolStandIn:
+    """数据库连接池替身：最多 size 个连接同时借出，等待超过 timeout 报 TimeoutError。"""
+
+    def __init__(self, size: int, timeout: float) -> None:
+        self._slots = asyncio.Semaphore(size)
+        self._timeout = timeout
+        self.checked_out = 0
+        self.peak = 0
+        self.timeouts = 0
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[_DbStandIn]:
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self._timeout)
+        except TimeoutError as e:
+            self.timeouts += 1
+            raise exc.TimeoutError("QueuePool limit reached, connection timed out") from e
+        self.checked_out += 1
+        self.peak = max(self.peak, self.checked_out)
+        try:
+            yield _DbStandIn()
+        finally:
+            self.checked_out -= 1
+            self._slots.release()
+
+
+class _LLMResponse:
+    status_code = 200
+
+    def __init__(self, llm: "_LLMStandIn") -> None:
+        self._llm = llm
+        self.request = type("Request", (), {"url": "http://llm/v1/chat/completions"})()
+
+    async def aiter_lines(self) -> AsyncIterator[str]:
+        # 所有对话流都开始生成后才输出，确保它们同时处于流式阶段
+        await asyncio.wait_for(self._llm.all_streaming.wait(), timeout=5.0)
+        for piece in REPLY:
+            chunk = {"choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}"
+            await asyncio.sleep(CHUNK_INTERVAL)
+        yield 'data: {"choices":[{"index":0,"delta":{},"finish_reason":"stop"}]}'
+        yield "data: [DONE]"
+
+
+class _LLMStandIn:
+    def __init__(self, expected: int, pool: _PoolStandIn) -> None:
+        self._expected = expected
+        self._pool = pool
+        self.active = 0
+        self.peak = 0
+        self.checked_out_while_streaming: int | None = None
+        self.all_streaming = asyncio.Event()
+
+    @asynccontextmanager
+    async def stream_chat(
+        self, payload: dict[str, Any], affinity_key: str | None = None
+    ) -> AsyncIterator[_LLMResponse]:
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        if self.active >= self._expected:
+            self.checked_out_while_streaming = self._pool.checked_out
+            self.all_streaming.set()
+        try:
+            yield _LLMResponse(self)
+        finally:
+            self.active -= 1
+
+
+class _WriterStandIn:
+    def __init__(self) -> None:
+        self.turns: list[list[Any]] = []
+
+    async def submit(self, messages: Any, stats: Any = None) -> None:
+        self.turns.append(list(messages))
+
+
+class _Request:
+    async def is_disconnected(self) -> bool:
+        return False
+
+
+def _case() -> Case:
+    return Case(
+        id=1,
+        title="偏头痛",
+        difficulty="easy",
+        department="神经内科",
+        patient_info={"age": 30, "gender": "female", "occupation": "教师"},
+        chief_complaint="反复头痛三天",
+        present_illness="三天前无明显诱因出现头痛",
+        past_history={"diseases": [], "allergies": [], "medications": []},
+        physical_exam={"visible": {}, "on_request": {}},
+        available_tests=[{"type": "ct", "name": "头颅CT", "result": {"结论": "未见异常"}}],
+        standard_diagnosis={"primary": "偏头痛", "differential": []},
+        key_points=["头痛"],
+        recommended_tests=["ct"],
+    )
+
+
+@pytest.fixture
+def writer() -> _WriterStandIn:
+    return _WriterStandIn()
+
+
+@pytest.fixture
+def pool(monkeypatch: pytest.MonkeyPatch, writer: _WriterStandIn) -> _PoolStandIn:
+    pool = _PoolStandIn(POOL_SIZE, timeout=POOL_TIMEOUT)
+    case = _case()
+
+    async def load_chat_session(db: _DbStandIn, session_id: int, user_id: int) -> Session:
+        await db.round_trip()
+        session = Session(id=session_id, user_id=user_id, case_id=case.id, status="in_progress")
+        session.case = case
+        return session
+
+    async def load_history_window(db: _DbStandIn, *args: Any, **kwargs: Any) -> list:
+        await db.round_trip()
+        return []
+
+    async def get_summary(db: _DbStandIn, session_id: int) -> None:
+        await db.round_trip()
+
+    monkeypatch.setattr(chat, "AsyncSessionLocal", pool.session)
+    monkeypatch.setattr(chat, "load_chat_session", load_chat_session)
+    monkeypatch.setattr(chat, "load_history_window", load_history_window)
+    monkeypatch.setattr(chat, "get_summary", get_summary)
+    monkeypatch.setattr(chat, "get_message_writer", lambda: writer)
+    admission = AdmissionController(lambda: STREAMS)
+    monkeypatch.setattr(chat, "get_admission", lambda: admission)
+    monkeypatch.setattr(settings, "CHAT_STREAM_PARSER", "json")
+    return pool
+
+
+async def test_streams_beyond_pool_size_do_not_exhaust_pool(
+    pool: _PoolStandIn, writer: _WriterStandIn, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    llm = _LLMStandIn(expected=STREAMS, pool=pool)
+    monkeypatch.setattr(chat_stream, "get_llm_client", lambda: llm)
+
+    async def one_stream(session_id: int) -> str:
+        data = ChatRequest(session_id=session_id, message="您哪里不舒服？")
+        response = await chat.start_chat_turn(
+            _Request(),  # type: ignore[arg-type]
+            data,
+            user_id=session_id,
+            claim=IdempotencyClaim(),
+        )
+        body = b"".join([frame async for frame in response.body_iterator])  # type: ignore[misc]
+        return body.decode()
+
+    bodies = await asyncio.wait_for(
+        asyncio.gather(*(one_stream(session_id) for session_id in range(1, STREAMS + 1))),
+        timeout=10.0,
+    )
+    await chat_stream.drain_background()
+
+    assert llm.peak == STREAMS
+    assert llm.checked_out_while_streaming == 0
+    assert pool.timeouts == 0
+    assert pool.peak <= POOL_SIZE
+    assert pool.checked_out == 0
+    for body in bodies:
+        assert '"done": true' in body or '"done":true' in body
+        assert "三天了" in body
+    assert len(writer.turns) == STREAMS
@@ -0,0 +1,148 @@
+"""流式数据块解析测试：scan_chunk 与完整解析（parse_chunk_json）结果一致，解析失败不中断转发。"""
+
+import asyncio
+import json
+import random
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any
+
+import pytest
+
+from src.apps.api.config import settings
+from src.apps.api.services import chat_stream
+from src.apps.api.services.chat_stream import (
+    ChatStreamRelay,
+    parse_chunk_json,
+    parse_usage,
+    scan_chunk,
+)
+
+_PIECES = ["头痛", "三天", "a", " ", '"', "\\", "\n", "\\n", "}", '"content":', "😀", " ", ""]
+
+
+def _chunk(rng: random.Random) -> dict:
+    delta: dict = {}
+    kind = rng.choice(["content", "role", "empty", "null"])
+    if kind == "content":
+        delta["content"] = "".join(rng.choice(_PIECES) for _ in range(rng.randint(0, 6)))
+    elif kind == "role":
+        delta["role"] = "assistant"
+    elif kind == "null":
+        delta["content"] = None
+    choice: dict = {"index": 0, "delta": delta, "logprobs": None}
+    choice["finish_reason"] = rng.choice([None, None, "stop", "length"])
+    chunk: dict = {
+        "id": "chatcmpl-1",
+        "object": "chat.completion.chunk",
+        "model": "m",
+        "choices": [choice],
+    }
+    if rng.random() < 0.1:
+        chunk["usage"] = {"prompt_tokens": 10, "completion_tokens": 5}
+    return chunk
+
+
+@pytest.mark.parametrize("compact", [True, False], ids=["compact", "spaced"])
+def test_scan_chunk_matches_full_parse(compact: bool) -> None:
+    rng = random.Random(20260101)
+    separators = (",", ":") if compact else (", ", ": ")
+    for _ in range(5000):
+        chunk = _chunk(rng)
+        payload = json.dumps(chunk, ensure_ascii=rng.random() < 0.5, separators=separators)
+        raw = payload.encode()
+        assert scan_chunk(raw) == parse_chunk_json(raw), payload
+
+
+def test_spaced_finish_after_role_only_delta() -> None:
+    payload = (
+        b'{"choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": "length"}]}'
+    )
+    assert scan_chunk(payload) == (None, "length")
+
+
+def test_usage_chunk() -> None:
+    payload = b'{"choices":[],"usage":{"prompt_tokens":12,"completion_tokens":34}}'
+    assert scan_chunk(payload) == (None, None)
+    assert parse_usage(payload) == {"prompt_tokens": 12, "completion_tokens": 34}
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b'{"choices":[{"index":0,"delta":{"content":"\\x"},"finish_reason":null}]}',
+        b'{"choices":[{"index":0,"delta":{"content":"\\n\xff"},"finish_reason":null}]}',
+        b'{"choices":[{"index":0,"delta":{},"finish_reason":"\\q"}]}',
+    ],
+    ids=["bad-escape", "invalid-utf8", "bad-finish-escape"],
+)
+def test_undecodable_string_falls_back(payload: bytes) -> None:
+    assert scan_chunk(payload) == parse_chunk_json(payload) == (None, None)
+
+
+class _Response:
+    status_code = 200
+
+    def __init__(self, lines: list[str]) -> None:
+        self._lines = lines
+        self.request = type("Request", (), {"url": "http://llm/v1/chat/completions"})()
+        self.sent = 0
+
+    async def aiter_bytes(self) -> AsyncIterator[bytes]:
+        for line in self._lines:
+            self.sent += 1
+            yield line.encode() + b"\n"
+
+
+class _LLM:
+    def __init__(self, lines: list[str]) -> None:
+        self.response = _Response(lines)
+
+    @asynccontextmanager
+    async def stream_chat(self, payload: dict[str, Any], affinity_key: Any = None) -> Any:
+        yield self.response
+
+
+def _content_line(content: str) -> str:
+    chunk = {"choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}]}
+    return "data: " + json.dumps(chunk, ensure_ascii=False)
+
+
+async def _never_disconnected() -> bool:
+    return False
+
+
+async def test_unexpected_chunk_ends_stream_with_error(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_STREAM_PARSER", "passthrough")
+    monkeypatch.setattr(settings, "CHAT_SSE_FLUSH_MS", 0)
+    lines = [_content_line("头痛"), "data: []", _content_line("三天"), "data: [DONE]"]
+    monkeypatch.setattr(chat_stream, "get_llm_client", lambda: _LLM(lines))
+    relay = ChatStreamRelay(_never_disconnected, {"max_tokens": 16})
+
+    received = [content async for content in relay.deltas()]
+
+    assert "".join(received) == "头痛"
+    assert relay.error is not None
+
+
+async def test_relay_buffer_is_bounded(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_STREAM_PARSER", "passthrough")
+    monkeypatch.setattr(settings, "CHAT_SSE_FLUSH_MS", 0)
+    monkeypatch.setattr(settings, "CHAT_RELAY_BUFFER_BYTES", 12)
+    lines = [_content_line("头痛") for _ in range(40)] + ["data: [DONE]"]
+    llm = _LLM(lines)
+    monkeypatch.setattr(chat_stream, "get_llm_client", lambda: llm)
+    waits = chat_stream.stream_stats.relay_buffer_waits
+    relay = ChatStreamRelay(_never_disconnected, {"max_tokens": 256})
+
+    deltas = relay.deltas()
+    received = [await anext(deltas)]
+    # 消费方停滞：生产者读满缓冲后暂停，不再继续读取上游
+    await asyncio.sleep(0.05)
+    assert llm.response.sent < len(lines)
+    assert relay._buffered_bytes < 12 + len("头痛".encode())
+    assert chat_stream.stream_stats.relay_buffer_waits > waits
+
+    received += [content async for content in deltas]
+    assert "".join(received) == "头痛" * 40
+    assert relay.error is None
@@ -0,0 +1,129 @@
+"""生成延迟统计测试：单次生成的延迟分解与直方图分位数估算。"""
+
+import pytest
+
+from src.apps.api.services import generation_stats
+from src.apps.api.services.generation_stats import GenerationTiming, record_generation
+from src.apps.api.services.metrics import Histogram
+
+
+def _timing(**overrides: object) -> GenerationTiming:
+    # 时间点取二进制可精确表示的值，毫秒换算没有舍入误差
+    values: dict = {
+        "queue_wait": 0.5,
+        "started_at": 0.0,
+        "connected_at": 0.125,
+        "first_token_at": 0.25,
+        "last_token_at": 0.625,
+        "finished_at": 0.75,
+        "tokens": 4,
+        "gaps": [0.125, 0.125, 0.125],
+        "backend": "http://vllm-a:8000",
+    }
+    values.update(overrides)
+    return GenerationTiming(**values)
+
+
+def test_summary_breakdown() -> None:
+    assert _timing().summary() == {
+        "backend": "http://vllm-a:8000",
+        "completion_tokens": 4,
+        "queue_wait_ms": 500,
+        "connect_ms": 125,
+        "ttft_ms": 250,
+        "itl_mean_ms": 125.0,
+        "itl_p95_ms": 125.0,
+        "tokens_per_s": 8.0,
+        "total_ms": 750,
+    }
+
+
+def test_summary_itl_p95_is_nearest_rank() -> None:
+    gaps = [i / 1000 for i in range(20, 0, -1)]
+    summary = _timing(gaps=gaps, last_token_at=0.25 + sum(gaps)).summary()
+
+    # 20 个间隔：p95 取升序第 19 个（19ms），均值 10.5ms
+    assert summary["itl_p95_ms"] == 19.0
+    assert summary["itl_mean_ms"] == 10.5
+    assert summary["tokens_per_s"] == 95.24
+
+
+def test_summary_without_tokens() -> None:
+    # 建连后未收到任何增量即失败
+    summary = _timing(first_token_at=None, last_token_at=None, tokens=0, gaps=[]).summary()
+
+    assert summary["connect_ms"] == 125
+    assert summary["ttft_ms"] is None
+    assert summary["itl_mean_ms"] is None
+    assert summary["itl_p95_ms"] is None
+    assert summary["tokens_per_s"] is None
+    assert summary["total_ms"] == 750
+
+
+def test_summary_single_token_has_no_rate() -> None:
+    summary = _timing(last_token_at=0.25, tokens=1, gaps=[]).summary()
+
+    assert summary["ttft_ms"] == 250
+    assert summary["tokens_per_s"] is None
+
+
+def test_record_generation_observes_per_backend() -> None:
+    backend = "http://vllm-record:8000"
+
+    row = record_generation(_timing(backend=backend), session_id=3, case_id=7, finish_reason="stop")
+
+    assert row["session_id"] == 3
+    assert row["case_id"] == 7
+    assert row["finish_reason"] == "stop"
+    assert row["ttft_ms"] == 250
+    snapshot = generation_stats.snapshot()
+    [ttft] = [entry for entry in snapshot["llm_ttft_ms"] if entry["backend"] == backend]
+    assert ttft["count"] == 1
+    [itl] = [entry for entry in snapshot["llm_itl_ms"] if entry["backend"] == backend]
+    assert itl["count"] == 3
+
+
+def _histogram(name: str) -> Histogram:
+    return Histogram(f"test_{name}_ms", "测试", buckets=(10, 20, 40), labelnames=("backend",))
+
+
+def test_quantile_interpolates_within_bucket() -> None:
+    histogram = _histogram("interpolate")
+    for value in (5, 10, 12, 14, 16, 18, 30, 35):
+        histogram.observe(value, backend="a")
+    [series] = histogram.series().values()
+
+    # 桶 (0,10]：2 个，(10,20]：4 个，(20,40]：2 个
+    assert histogram.quantile(0.25, series) == 10.0
+    assert histogram.quantile(0.5, series) == 15.0
+    assert histogram.quantile(0.875, series) == 30.0
+    assert histogram.quantile(1.0, series) == 40.0
+
+
+def test_quantile_in_inf_bucket_returns_largest_bound() -> None:
+    histogram = _histogram("overflow")
+    for value in (5, 15, 100, 1000):
+        histogram.observe(value, backend="a")
+    [series] = histogram.series().values()
+
+    assert histogram.quantile(0.5, series) == 20.0
+    assert histogram.quantile(0.99, series) == 40.0
+
+
+def test_snapshot_per_label() -> None:
+    histogram = _histogram("snapshot")
+    histogram.observe(15, backend="a")
+    histogram.observe(25, backend="a")
+    histogram.observe(500, backend="b")
+
+    snapshot = {entry["backend"]: entry for entry in histogram.snapshot()}
+
+    assert snapshot["a"] == {
+        "backend": "a",
+        "count": 2,
+        "mean": 20.0,
+        "p50": 20.0,
+        "p95": pytest.approx(38.0),
+        "p99": pytest.approx(39.6),
+    }
+    assert snapshot["b"]["p50"] == snapshot["b"]["p99"] == 40.0
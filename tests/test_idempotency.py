@@ -0,0 +1,113 @@
+"""对话请求幂等键测试。"""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from src.apps.api.config import settings
+from src.apps.api.services.idempotency import IdempotencyStore, request_fingerprint
+from src.apps.api.services.stream_registry import ResumableStream
+
+FP = request_fingerprint(1, "哪里不舒服")
+
+
+@pytest.fixture(autouse=True)
+def idempotency_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_IDEMPOTENCY_TTL", 600)
+    monkeypatch.setattr(settings, "CHAT_IDEMPOTENCY_MAX_KEYS", 100)
+    monkeypatch.setattr(settings, "CHAT_IDEMPOTENCY_WAIT", 1.0)
+
+
+async def test_no_key_is_a_noop_claim() -> None:
+    store = IdempotencyStore()
+    claim = await store.claim(1, None, FP)
+    claim.release()
+    assert claim.replay is None
+    assert store.snapshot()["keys"] == 0
+
+
+async def test_duplicate_replays_resolved_stream() -> None:
+    store = IdempotencyStore()
+    first = await store.claim(1, "k", FP)
+    stream = ResumableStream("s1", user_id=1, session_id=1)
+    first.resolve(stream)
+    first.release()
+
+    duplicate = await store.claim(1, "k", FP)
+
+    assert first.replay is None
+    assert duplicate.replay is stream
+    assert store.hits == 1
+
+
+async def test_duplicate_waits_for_first_request() -> None:
+    store = IdempotencyStore()
+    first = await store.claim(1, "k", FP)
+    waiter = asyncio.create_task(store.claim(1, "k", FP))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    stream = ResumableStream("s1", user_id=1, session_id=1)
+    first.resolve(stream)
+
+    duplicate = await asyncio.wait_for(waiter, timeout=1.0)
+    assert duplicate.replay is stream
+
+
+async def test_released_key_is_claimed_again() -> None:
+    store = IdempotencyStore()
+    first = await store.claim(1, "k", FP)
+    waiter = asyncio.create_task(store.claim(1, "k", FP))
+    await asyncio.sleep(0)
+
+    # 首个请求失败（如 503）：等待中的重复请求按新请求处理
+    first.release()
+    retry = await asyncio.wait_for(waiter, timeout=1.0)
+
+    assert retry.replay is None
+    assert store.hits == 0
+    assert store.snapshot()["keys"] == 1
+
+
+async def test_same_key_different_body_is_rejected() -> None:
+    store = IdempotencyStore()
+    await store.claim(1, "k", FP)
+
+    with pytest.raises(HTTPException) as info:
+        await store.claim(1, "k", request_fingerprint(1, "多久了"))
+    assert info.value.status_code == 422
+    assert store.conflicts == 1
+
+
+async def test_keys_are_scoped_per_user() -> None:
+    store = IdempotencyStore()
+    (await store.claim(1, "k", FP)).resolve(ResumableStream("s1", user_id=1, session_id=1))
+
+    other = await store.claim(2, "k", FP)
+
+    assert other.replay is None
+
+
+async def test_pending_first_request_times_out_with_409(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_IDEMPOTENCY_WAIT", 0.01)
+    store = IdempotencyStore()
+    await store.claim(1, "k", FP)
+
+    with pytest.raises(HTTPException) as info:
+        await store.claim(1, "k", FP)
+    assert info.value.status_code == 409
+
+
+async def test_oldest_key_is_evicted(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_IDEMPOTENCY_MAX_KEYS", 2)
+    store = IdempotencyStore()
+    oldest = await store.claim(1, "a", FP)
+    await store.claim(1, "b", FP)
+    await store.claim(1, "c", FP)
+
+    assert store.evictions == 1
+    # 被淘汰的键重新可用，原占用的 resolve 不再影响它
+    oldest.resolve(ResumableStream("s1", user_id=1, session_id=1))
+    reclaimed = await store.claim(1, "a", FP)
+    assert reclaimed.replay is None
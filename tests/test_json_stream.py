@@ -0,0 +1,116 @@
+"""增量 JSON 校验测试。"""
+
+import json
+
+import pytest
+
+from src.apps.api.services.json_stream import ITEM, IncrementalJsonValidator, StreamValidationError
+
+ENUMS = {
+    ("difficulty",): ("easy", "medium", "hard"),
+    ("available_tests", ITEM, "type"): ("blood", "ct"),
+}
+
+CASE = {
+    "title": "偏头痛",
+    "difficulty": "medium",
+    "patient_info": {"age": 30, "smoker": False, "note": None, "weight": 55.5e0},
+    "chief_complaint": '反复头痛三天，伴"恶心"\\呕吐\n',
+    "available_tests": [
+        {"type": "ct", "name": "头颅CT"},
+        {"type": "blood", "name": "血常规", "values": [1, -2.5, 3e2]},
+    ],
+    "key_points": [],
+}
+
+
+def _validator(**kwargs: object) -> IncrementalJsonValidator:
+    return IncrementalJsonValidator(enums=ENUMS, **kwargs)  # type: ignore[arg-type]
+
+
+def _error(text: str, **kwargs: object) -> StreamValidationError:
+    validator = _validator(**kwargs)
+    with pytest.raises(StreamValidationError) as info:
+        validator.feed(text)
+    return info.value
+
+
+@pytest.mark.parametrize("indent", [None, 2], ids=["compact", "indented"])
+def test_valid_output_in_chunks(indent: int | None) -> None:
+    text = json.dumps(CASE, ensure_ascii=False, indent=indent)
+    for size in (1, 3, 7, len(text)):
+        validator = _validator()
+        for start in range(0, len(text), size):
+            validator.feed(text[start : start + size])
+        assert validator.complete, size
+
+
+def test_enum_prefix_fails_before_string_ends() -> None:
+    text = '{"title": "偏头痛", "difficulty": "mo'
+    error = _error(text)
+    assert error.reason == "enum"
+    assert error.position == len(text)
+
+
+def test_enum_must_match_whole_value() -> None:
+    assert _error('{"difficulty": "ea"}').reason == "enum"
+    assert _error('{"difficulty": 1}').reason == "enum"
+
+
+def test_nested_enum_path() -> None:
+    text = '{"available_tests": [{"type": "ct"}, {"type": "x'
+    error = _error(text)
+    assert error.reason == "enum"
+    assert error.position == len(text)
+
+
+def test_missing_comma_is_syntax_error() -> None:
+    text = '{"title": "偏头痛" "difficulty"'
+    error = _error(text)
+    assert error.reason == "syntax"
+    assert error.position == text.index('"difficulty"') + 1
+
+
+@pytest.mark.parametrize(
+    "text",
+    ['{"a": trux', '{"a": 1.2.3}', '{"a": "\\x"}', '{"a": [1,, 2]}', '{"a": 1]', "[1]"],
+    ids=["literal", "number", "escape", "empty-item", "bracket", "root-array"],
+)
+def test_syntax_errors(text: str) -> None:
+    assert _error(text).reason == "syntax"
+
+
+def test_partial_literal_is_not_an_error() -> None:
+    validator = _validator()
+    validator.feed('{"smoker": tr')
+    assert not validator.complete
+    validator.feed("ue}")
+    assert validator.complete
+
+
+def test_runaway_string() -> None:
+    error = _error('{"chief_complaint": "' + "头痛" * 20, max_string=20)
+    assert error.reason == "runaway"
+    assert error.position == len('{"chief_complaint": "') + 21
+
+
+def test_runaway_array() -> None:
+    error = _error('{"key_points": [' + '"头痛", ' * 10, max_items=5)
+    assert error.reason == "runaway"
+
+
+def test_skip_preamble_and_trailing_text() -> None:
+    text = "好的，以下是病例：\n```json\n" + json.dumps(CASE, ensure_ascii=False) + "\n```\n完毕"
+    validator = _validator(skip_preamble=True)
+    validator.feed(text)
+    assert validator.complete
+
+
+def test_preamble_rejected_by_default() -> None:
+    assert _error("```json\n{}").reason == "syntax"
+
+
+def test_incomplete_output_is_not_complete() -> None:
+    validator = _validator()
+    validator.feed('{"title": "偏头痛", "key_points": ["头痛"')
+    assert not validator.complete
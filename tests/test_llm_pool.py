@@ -0,0 +1,209 @@
+"""vLLM 多后端池测试：亲和路由、失败摘除与恢复、主动健康检查。"""
+
+import asyncio
+from collections.abc import Callable
+
+import httpx
+import pytest
+
+from src.apps.api.config import settings
+from src.apps.api.services.llm_client import LLMClient
+from src.apps.api.services.llm_pool import LLMBackendPool, rendezvous_pick
+
+A = "http://vllm-a:8000"
+B = "http://vllm-b:8000"
+C = "http://vllm-c:8000"
+
+
+@pytest.fixture(autouse=True)
+def pool_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "LLM_PREFIX_AFFINITY", True)
+    monkeypatch.setattr(settings, "LLM_AFFINITY_MAX_SKEW", 2)
+    monkeypatch.setattr(settings, "LLM_EJECT_FAILURES", 2)
+    monkeypatch.setattr(settings, "LLM_EJECT_COOLDOWN", 60.0)
+    monkeypatch.setattr(settings, "LLM_HEALTH_CHECK_PATH", "/health")
+    monkeypatch.setattr(settings, "LLM_HEALTH_CHECK_INTERVAL", 0.01)
+
+
+class _Upstream:
+    """按主机返回固定状态码的 vLLM 替身（httpx.MockTransport）。"""
+
+    def __init__(self) -> None:
+        self.status = {A: 200, B: 200, C: 200}
+        self.down: set[str] = set()
+        self.hits: dict[str, int] = {A: 0, B: 0, C: 0}
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        backend = f"{request.url.scheme}://{request.url.host}:{request.url.port}"
+        if backend in self.down:
+            raise httpx.ConnectError("connection refused", request=request)
+        if request.url.path == "/health":
+            return httpx.Response(self.status[backend])
+        self.hits[backend] += 1
+        return httpx.Response(self.status[backend], json={"choices": []})
+
+    def client(self, urls: list[str]) -> LLMClient:
+        return LLMClient(httpx.AsyncClient(transport=httpx.MockTransport(self.handle)), urls)
+
+
+def test_rendezvous_only_moves_keys_of_removed_backend() -> None:
+    keys = [f"prefix-{i}" for i in range(300)]
+    before = {key: rendezvous_pick(key, [A, B, C]) for key in keys}
+    after = {key: rendezvous_pick(key, [A, C]) for key in keys}
+
+    assert set(before.values()) == {A, B, C}
+    for key in keys:
+        if before[key] != B:
+            assert after[key] == before[key]
+    # 与后端顺序无关
+    assert all(rendezvous_pick(key, [C, B, A]) == before[key] for key in keys)
+
+
+def test_affinity_key_sticks_to_its_backend() -> None:
+    pool = LLMBackendPool([A, B, C])
+    key = "prefix-1"
+    preferred = rendezvous_pick(key, [A, B, C])
+
+    assert {pool.choose(key).url for _ in range(10)} == {preferred}
+
+
+def test_affinity_yields_to_idle_backend_beyond_skew() -> None:
+    pool = LLMBackendPool([A, B])
+    key = "prefix-1"
+    preferred = pool.choose(key)
+    other = next(backend for backend in pool.backends if backend is not preferred)
+
+    preferred.in_flight = 2
+    assert pool.choose(key) is preferred
+
+    preferred.in_flight = 3
+    assert pool.choose(key) is other
+
+
+def test_without_affinity_routes_to_least_in_flight(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "LLM_PREFIX_AFFINITY", False)
+    pool = LLMBackendPool([A, B, C])
+    pool.backends[0].in_flight = 1
+
+    # 亲和关闭时忽略亲和键；在途数相同的副本轮流选择
+    picks = [pool.choose("prefix-1").url for _ in range(4)]
+    assert picks == [B, C, B, C]
+
+
+async def test_5xx_responses_eject_backend() -> None:
+    upstream = _Upstream()
+    upstream.status[B] = 503
+    client = upstream.client([A, B])
+    pool = client.pool
+
+    # 无亲和键时在途数相同的副本轮流选择：第 2、4 个请求发往 B
+    for _ in range(4):
+        await client.post_chat({"messages": []})
+
+    b = pool.backends[1]
+    assert not b.healthy
+    assert b.ejections == 1
+    assert b.last_error == "HTTP 503"
+
+    # 摘除后的请求只发往健康副本
+    for _ in range(2):
+        await client.post_chat({"messages": []})
+    assert upstream.hits == {A: 4, B: 2, C: 0}
+
+    await client.aclose()
+
+
+async def test_client_errors_do_not_eject() -> None:
+    upstream = _Upstream()
+    upstream.status[A] = 400
+    client = upstream.client([A])
+
+    for _ in range(3):
+        await client.post_chat({"messages": []})
+
+    assert client.pool.backends[0].healthy
+    assert client.pool.backends[0].failures == 0
+    await client.aclose()
+
+
+async def test_connection_errors_eject_and_cooldown_readmits(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    upstream = _Upstream()
+    upstream.down.add(B)
+    client = upstream.client([A, B])
+    b = client.pool.backends[1]
+    key = next(f"prefix-{i}" for i in range(100) if rendezvous_pick(f"prefix-{i}", [A, B]) == B)
+
+    for _ in range(2):
+        with pytest.raises(httpx.ConnectError):
+            await client.post_chat({"messages": []}, affinity_key=key)
+    assert not b.healthy
+    assert b.in_flight == 0
+
+    # 冷却期内亲和键也不再选择 B
+    await client.post_chat({"messages": []}, affinity_key=key)
+    assert upstream.hits[A] == 1
+
+    # 冷却期过后半开试探：失败则重新计算冷却期，成功一次即恢复
+    monkeypatch.setattr(settings, "LLM_EJECT_COOLDOWN", 0.0)
+    with pytest.raises(httpx.ConnectError):
+        await client.post_chat({"messages": []}, affinity_key=key)
+    assert not b.healthy
+    upstream.down.clear()
+    await client.post_chat({"messages": []}, affinity_key=key)
+    assert b.healthy
+    assert upstream.hits[B] == 1
+    assert b.consecutive_failures == 0
+    assert b.ejections == 1
+    await client.aclose()
+
+
+def test_all_ejected_still_routes() -> None:
+    pool = LLMBackendPool([A, B])
+    for backend in pool.backends:
+        for _ in range(2):
+            pool.mark_failure(backend, "HTTP 503")
+
+    assert not any(backend.healthy for backend in pool.backends)
+    assert pool.choose().url in {A, B}
+
+
+async def _until(predicate: Callable[[], bool], timeout: float = 1.0) -> None:
+    async def wait() -> None:
+        while not predicate():
+            await asyncio.sleep(0.005)
+
+    await asyncio.wait_for(wait(), timeout)
+
+
+async def test_health_loop_ejects_and_readmits() -> None:
+    upstream = _Upstream()
+    client = upstream.client([A, B])
+    a, b = client.pool.backends
+    client.start_health_checks()
+
+    upstream.status[B] = 503
+    await _until(lambda: not b.healthy)
+    assert b.last_error == "health check: HTTP 503"
+
+    upstream.status[B] = 200
+    upstream.down.add(A)
+    await _until(lambda: b.healthy and not a.healthy)
+    assert a.last_error is not None
+    assert a.last_error.startswith("health check: ConnectError")
+    # 健康检查不计入请求
+    assert upstream.hits == {A: 0, B: 0, C: 0}
+
+    await client.aclose()
+    assert client.pool._health_task is None
+
+
+async def test_health_checks_disabled(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "LLM_HEALTH_CHECK_INTERVAL", 0)
+    pool = LLMBackendPool([A])
+
+    pool.start_health_checks(httpx.AsyncClient())
+
+    assert pool._health_task is None
+    await pool.stop_health_checks()
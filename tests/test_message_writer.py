@@ -0,0 +1,127 @@
+"""消息写入队列（write-behind）的重试、死信与真实 ID 记录测试。"""
+
+from typing import Any
+
+import pytest
+from sqlalchemy import exc
+
+from src.apps.api.config import settings
+from src.apps.api.services.message_writer import MessageWriter, PendingMessage
+
+
+@pytest.fixture(autouse=True)
+def fast_writer(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "MESSAGE_WRITER_ENABLED", True)
+    monkeypatch.setattr(settings, "MESSAGE_WRITER_FLUSH_MS", 0)
+    monkeypatch.setattr(settings, "MESSAGE_WRITER_RETRY_BACKOFF", 0.001)
+    monkeypatch.setattr(settings, "MESSAGE_WRITER_RETRY_MAX_BACKOFF", 0.001)
+    monkeypatch.setattr(settings, "MESSAGE_WRITER_MAX_RETRIES", 2)
+
+
+def _turn(session_id: int, content: str) -> list[PendingMessage]:
+    return [
+        PendingMessage(session_id=session_id, role="user", content=content),
+        PendingMessage(session_id=session_id, role="assistant", content="好的"),
+    ]
+
+
+async def _drain(writer: MessageWriter, *session_ids: int) -> None:
+    for session_id in session_ids:
+        assert await writer.wait_persisted(session_id, timeout=2.0)
+    await writer.stop()
+
+
+async def test_data_error_dead_letters_only_the_bad_group(monkeypatch: pytest.MonkeyPatch) -> None:
+    writer = MessageWriter()
+    written: list[dict[str, Any]] = []
+
+    async def insert(params: list[dict[str, Any]], stats: Any = None) -> list[int]:
+        # Postgres text 列不接受 NUL 字符
+        if any("\x00" in p["content"] for p in params):
+            raise exc.DataError("INSERT INTO messages", {}, ValueError("invalid byte 0x00"))
+        written.extend(params)
+        return list(range(len(written) - len(params) + 1, len(written) + 1))
+
+    monkeypatch.setattr(writer, "_insert", insert)
+    writer.start()
+    await writer.submit(_turn(1, "头痛三天"))
+    await writer.submit(_turn(2, "bad\x00message"))
+    await writer.submit(_turn(3, "发热"))
+    await _drain(writer, 1, 2, 3)
+
+    assert sorted({p["session_id"] for p in written}) == [1, 3]
+    assert writer.messages_written == 4
+    assert writer.dead_lettered == 2
+    assert writer.snapshot()["queued"] == 0
+    assert writer.pending_rows(2) == []
+
+
+async def test_transient_error_is_retried(monkeypatch: pytest.MonkeyPatch) -> None:
+    writer = MessageWriter()
+    failures = [exc.OperationalError("INSERT", {}, ConnectionError("reset"))]
+    written: list[dict[str, Any]] = []
+
+    async def insert(params: list[dict[str, Any]], stats: Any = None) -> list[int]:
+        if failures:
+            raise failures.pop()
+        written.extend(params)
+        return list(range(1, len(params) + 1))
+
+    monkeypatch.setattr(writer, "_insert", insert)
+    writer.start()
+    await writer.submit(_turn(1, "咳嗽"))
+    await _drain(writer, 1)
+
+    assert len(written) == 2
+    assert writer.retries == 1
+    assert writer.dead_lettered == 0
+
+
+async def test_transient_retries_are_capped(monkeypatch: pytest.MonkeyPatch) -> None:
+    writer = MessageWriter()
+    calls = 0
+
+    async def insert(params: list[dict[str, Any]], stats: Any = None) -> list[int]:
+        nonlocal calls
+        calls += 1
+        raise exc.OperationalError("INSERT", {}, ConnectionError("refused"))
+
+    monkeypatch.setattr(writer, "_insert", insert)
+    writer.start()
+    await writer.submit(_turn(1, "胸痛"))
+    await _drain(writer, 1)
+
+    assert calls == settings.MESSAGE_WRITER_MAX_RETRIES + 1
+    assert writer.dead_lettered == 2
+    assert writer.snapshot()["queued"] == 0
+
+
+async def test_persisted_ids_are_recorded_and_bounded(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "MESSAGE_WRITER_QUEUE_MAX", 3)
+    writer = MessageWriter()
+    next_id = 100
+
+    async def insert(params: list[dict[str, Any]], stats: Any = None) -> list[int]:
+        nonlocal next_id
+        start, next_id = next_id, next_id + len(params)
+        return list(range(start, next_id))
+
+    monkeypatch.setattr(writer, "_insert", insert)
+    writer.start()
+    await writer.submit(_turn(1, "头痛"))
+    first = [row.id for row in writer.pending_rows(1)]
+    await writer.wait_persisted(1, timeout=2.0)
+    assert [writer.persisted_id(pending_id) for pending_id in first] == [100, 101]
+
+    await writer.submit(_turn(1, "还有吗？"))
+    second = [row.id for row in writer.pending_rows(1)]
+    assert [writer.persisted_id(pending_id) for pending_id in second] == [None, None]
+    await _drain(writer, 1)
+
+    # 只保留最近 MESSAGE_WRITER_QUEUE_MAX 条的映射
+    assert writer.persisted_id(first[0]) is None
+    assert [writer.persisted_id(pending_id) for pending_id in [first[1], *second]] == [
+        101,
+        102,
+        103,
+    ]
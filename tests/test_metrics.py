@@ -0,0 +1,100 @@
+"""Prometheus 指标导出测试：文本格式导出、多 worker 汇总、路由标签与连接池采样。"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import prometheus_client
+from sqlalchemy.pool import NullPool, QueuePool
+from starlette.requests import Request
+
+from src.apps.api.services import metrics
+from src.apps.api.services.metrics import (
+    OUTCOME_OK,
+    Histogram,
+    llm_requests,
+    render_latest,
+    route_label,
+    sample_pool,
+)
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+# 每个 worker 计 2 次请求、观测 2 个延迟样本
+_WORKER = """
+from src.apps.api.services.metrics import Histogram, llm_requests
+llm_requests.labels("chat", "ok").inc(2)
+histogram = Histogram("test_worker_ms", "测试", buckets=(10, 100), labelnames=("backend",))
+histogram.observe(5, backend="a")
+histogram.observe(50, backend="a")
+"""
+_RENDER = """
+import sys
+from src.apps.api.services.metrics import render_latest
+sys.stdout.write(render_latest().decode())
+"""
+
+
+def _run(code: str, multiproc_dir: Path) -> str:
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(multiproc_dir)}
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=PROJECT_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+        timeout=30,
+    )
+    return result.stdout
+
+
+def test_render_latest_exports_metrics() -> None:
+    assert not metrics.MULTIPROC_DIR
+    histogram = Histogram("test_render_ms", "测试", buckets=(10, 100), labelnames=("backend",))
+    histogram.observe(50, backend="a")
+    llm_requests.labels("test_render", OUTCOME_OK).inc()
+
+    text = render_latest().decode()
+
+    assert 'llm_requests_total{operation="test_render",outcome="ok"} 1.0' in text
+    assert 'test_render_ms_bucket{backend="a",le="100.0"} 1.0' in text
+    assert 'test_render_ms_count{backend="a"} 1.0' in text
+    assert "# TYPE http_request_duration_seconds histogram" in text
+
+
+def test_multiprocess_render_sums_workers(tmp_path: Path) -> None:
+    _run(_WORKER, tmp_path)
+    _run(_WORKER, tmp_path)
+
+    text = _run(_RENDER, tmp_path)
+
+    assert 'llm_requests_total{operation="chat",outcome="ok"} 4.0' in text
+    assert 'test_worker_ms_bucket{backend="a",le="10.0"} 2.0' in text
+    assert 'test_worker_ms_count{backend="a"} 4.0' in text
+    assert 'test_worker_ms_sum{backend="a"} 110.0' in text
+
+
+def test_route_label_uses_template() -> None:
+    matched = Request({"type": "http", "route": SimpleNamespace(path="/api/chat/{session_id}")})
+    unmatched = Request({"type": "http"})
+
+    assert route_label(matched) == "/api/chat/{session_id}"
+    assert route_label(unmatched) == "unmatched"
+
+
+def test_sample_pool() -> None:
+    pool = QueuePool(lambda: None, pool_size=4, max_overflow=2)
+
+    sample_pool(pool)
+
+    registry = prometheus_client.REGISTRY
+    assert registry.get_sample_value("db_pool_size") == 4
+    assert registry.get_sample_value("db_pool_checked_out") == 0
+    assert registry.get_sample_value("db_pool_overflow") == 0
+
+    # NullPool 没有常驻连接，不覆盖已采样的值
+    sample_pool(NullPool(lambda: None))
+    assert registry.get_sample_value("db_pool_size") == 4
@@ -0,0 +1,197 @@
+"""随机会话病例生成任务的阶段流转测试。"""
+
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any
+
+import pytest
+
+from src.apps.api.config import settings
+from src.apps.api.exceptions import BusinessError
+from src.apps.api.services import session_jobs
+from src.apps.api.services.admission import AdmissionController
+from src.apps.api.services.session_jobs import (
+    STAGE_FAILED,
+    STAGE_GENERATING,
+    STAGE_QUEUED,
+    STAGE_READY,
+    STAGE_VALIDATING,
+    SessionJobRegistry,
+)
+
+CASE_ID = 42
+
+
+class _Case:
+    id: int | None = None
+
+
+class _Result:
+    def __init__(self, rowcount: int) -> None:
+        self.rowcount = rowcount
+
+
+class _Db:
+    def __init__(self, rowcount: int) -> None:
+        self.rowcount = rowcount
+        self.committed = False
+        self.rolled_back = False
+
+    def add(self, case: _Case) -> None:
+        self.case = case
+
+    async def flush(self) -> None:
+        self.case.id = CASE_ID
+
+    async def execute(self, stmt: Any) -> _Result:
+        return _Result(self.rowcount)
+
+    async def commit(self) -> None:
+        self.committed = True
+
+    async def rollback(self) -> None:
+        self.rolled_back = True
+
+
+class _Harness:
+    """替换准入、LLM 生成与数据库，记录任务经过的阶段。"""
+
+    def __init__(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        self.admission = AdmissionController(lambda: 1)
+        self.db = _Db(rowcount=1)
+        self.generate_error: Exception | None = None
+        self.release_generation = asyncio.Event()
+        self.release_generation.set()
+        self.stages: list[str] = []
+        self.marked_failed: list[int] = []
+        self.job: session_jobs.SessionJob | None = None
+
+        @asynccontextmanager
+        async def session_local() -> AsyncIterator[_Db]:
+            yield self.db
+
+        async def generate() -> tuple[dict, dict]:
+            self._record()
+            await self.release_generation.wait()
+            if self.generate_error is not None:
+                raise self.generate_error
+            return {"title": "偏头痛"}, {}
+
+        def build(payload: dict, meta: dict) -> _Case:
+            self._record()
+            return _Case()
+
+        async def mark_failed(session_id: int, older_than: float | None = None) -> bool:
+            self.marked_failed.append(session_id)
+            return True
+
+        monkeypatch.setattr(session_jobs, "get_admission", lambda: self.admission)
+        monkeypatch.setattr(session_jobs, "AsyncSessionLocal", session_local)
+        monkeypatch.setattr(session_jobs, "generate_random_case_payload", generate)
+        monkeypatch.setattr(session_jobs, "build_random_case", build)
+        monkeypatch.setattr(session_jobs, "mark_failed", mark_failed)
+
+    def _record(self) -> None:
+        assert self.job is not None
+        self.stages.append(self.job.stage)
+
+    async def run(self, registry: SessionJobRegistry) -> session_jobs.SessionJob:
+        ticket = self.admission.reserve(1)
+        self.job = registry.spawn(session_id=7, user_id=1, ticket=ticket)
+        await asyncio.wait_for(asyncio.gather(*registry._tasks), timeout=1.0)
+        return self.job
+
+
+@pytest.fixture
+def harness(monkeypatch: pytest.MonkeyPatch) -> _Harness:
+    monkeypatch.setattr(settings, "LLM_QUEUE_TIMEOUT", 1.0)
+    monkeypatch.setattr(settings, "LLM_QUEUE_POSITION_INTERVAL", 0.01)
+    monkeypatch.setattr(settings, "SESSION_JOB_TTL", 600)
+    return _Harness(monkeypatch)
+
+
+async def test_job_reaches_ready(harness: _Harness) -> None:
+    registry = SessionJobRegistry()
+
+    job = await harness.run(registry)
+
+    assert harness.stages == [STAGE_GENERATING, STAGE_VALIDATING]
+    assert job.progress() == {
+        "session_id": 7,
+        "stage": STAGE_READY,
+        "position": None,
+        "case_id": CASE_ID,
+        "error": None,
+    }
+    assert harness.db.committed
+    assert harness.admission.in_flight == 0
+    assert registry.snapshot() == {"running": 0, "started": 1, "succeeded": 1, "failed": 0}
+    assert registry.get(7, user_id=1) is job
+    assert registry.get(7, user_id=2) is None
+
+
+async def test_queued_job_reports_position(harness: _Harness) -> None:
+    registry = SessionJobRegistry()
+    holder = harness.admission.reserve(99)
+    job = registry.spawn(session_id=7, user_id=1, ticket=harness.admission.reserve(1))
+    harness.job = job
+
+    await asyncio.sleep(0.02)
+    assert job.progress()["stage"] == STAGE_QUEUED
+    assert job.progress()["position"] == 1
+
+    harness.admission.release(holder)
+    await asyncio.wait_for(asyncio.gather(*registry._tasks), timeout=1.0)
+    assert job.stage == STAGE_READY
+    assert job.progress()["position"] is None
+
+
+@pytest.mark.parametrize(
+    ("error", "message"),
+    [
+        (BusinessError("LLM 服务暂不可用", status_code=503), "LLM 服务暂不可用"),
+        (ValueError("difficulty 不合法"), "病例生成失败，请重试"),
+    ],
+    ids=["business", "unexpected"],
+)
+async def test_generation_failure_marks_session_failed(
+    harness: _Harness, error: Exception, message: str
+) -> None:
+    harness.generate_error = error
+    registry = SessionJobRegistry()
+
+    job = await harness.run(registry)
+
+    assert job.stage == STAGE_FAILED
+    assert job.error == message
+    assert harness.marked_failed == [7]
+    assert harness.admission.in_flight == 0
+    assert registry.failed == 1
+
+
+async def test_expired_session_discards_case(harness: _Harness) -> None:
+    harness.db.rowcount = 0
+    registry = SessionJobRegistry()
+
+    job = await harness.run(registry)
+
+    assert job.stage == STAGE_FAILED
+    assert harness.db.rolled_back
+    assert not harness.db.committed
+
+
+async def test_shutdown_fails_running_jobs(harness: _Harness) -> None:
+    harness.release_generation.clear()
+    registry = SessionJobRegistry()
+    job = registry.spawn(session_id=7, user_id=1, ticket=harness.admission.reserve(1))
+    harness.job = job
+    await asyncio.sleep(0.02)
+    assert job.stage == STAGE_GENERATING
+
+    await registry.shutdown()
+
+    assert job.stage == STAGE_FAILED
+    assert job.error == "服务重启，病例生成中断"
+    assert harness.marked_failed == [7]
+    assert harness.admission.in_flight == 0
@@ -0,0 +1,260 @@
+"""会话单飞保护测试：忙碌策略（reject / queue / cancel_replace）与跨 worker 咨询锁。"""
+
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any
+
+import pytest
+from fastapi import HTTPException
+
+from src.apps.api.config import settings
+from src.apps.api.routes import chat
+from src.apps.api.schemas.chat import ChatRequest
+from src.apps.api.services import session_lock
+from src.apps.api.services.idempotency import IdempotencyClaim
+from src.apps.api.services.session_lock import SessionBusyError, SessionTurnGuard
+
+
+@pytest.fixture(autouse=True)
+def lock_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_SESSION_BUSY_POLICY", "reject")
+    monkeypatch.setattr(settings, "CHAT_SESSION_LOCK_TIMEOUT", 1.0)
+    monkeypatch.setattr(settings, "CHAT_SESSION_LOCK_BACKEND", "memory")
+
+
+async def test_reject_when_busy() -> None:
+    guard = SessionTurnGuard()
+    turn = await guard.acquire(1)
+
+    with pytest.raises(SessionBusyError):
+        await guard.acquire(1)
+    # 其他会话不受影响
+    other = await guard.acquire(2)
+
+    await turn.release()
+    await other.release()
+    again = await guard.acquire(1)
+    await again.release()
+    assert guard.snapshot()["rejected"] == 1
+    assert guard.snapshot()["active_sessions"] == 0
+    assert guard._locks == {}
+
+
+async def test_busy_session_returns_409(monkeypatch: pytest.MonkeyPatch) -> None:
+    guard = SessionTurnGuard()
+
+    @asynccontextmanager
+    async def session_local() -> AsyncIterator[None]:
+        yield None
+
+    async def load_chat_session(db: None, session_id: int, user_id: int) -> object:
+        return object()
+
+    monkeypatch.setattr(chat, "AsyncSessionLocal", session_local)
+    monkeypatch.setattr(chat, "load_chat_session", load_chat_session)
+    monkeypatch.setattr(chat, "get_session_guard", lambda: guard)
+    turn = await guard.acquire(1)
+
+    with pytest.raises(HTTPException) as info:
+        await chat.start_chat_turn(
+            None,  # type: ignore[arg-type]
+            ChatRequest(session_id=1, message="哪里不舒服"),
+            user_id=1,
+            claim=IdempotencyClaim(),
+        )
+
+    assert info.value.status_code == 409
+    await turn.release()
+
+
+async def test_queue_serves_waiters_in_order(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_SESSION_BUSY_POLICY", "queue")
+    guard = SessionTurnGuard()
+    holder = await guard.acquire(1)
+    order: list[int] = []
+
+    async def turn(index: int) -> None:
+        acquired = await guard.acquire(1)
+        order.append(index)
+        await asyncio.sleep(0)
+        await acquired.release()
+
+    waiters = []
+    for index in range(3):
+        waiters.append(asyncio.create_task(turn(index)))
+        await asyncio.sleep(0)
+    assert guard.snapshot()["waited"] == 3
+    assert order == []
+
+    await holder.release()
+    await asyncio.wait_for(asyncio.gather(*waiters), timeout=1.0)
+
+    assert order == [0, 1, 2]
+    assert guard._locks == {}
+
+
+async def test_queue_times_out(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_SESSION_BUSY_POLICY", "queue")
+    monkeypatch.setattr(settings, "CHAT_SESSION_LOCK_TIMEOUT", 0.01)
+    guard = SessionTurnGuard()
+    holder = await guard.acquire(1)
+
+    with pytest.raises(SessionBusyError):
+        await guard.acquire(1)
+
+    await holder.release()
+    assert guard._locks == {}
+
+
+async def test_cancel_replace_cancels_previous_turn(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_SESSION_BUSY_POLICY", "cancel_replace")
+    guard = SessionTurnGuard()
+    previous = await guard.acquire(1)
+    generating = asyncio.Event()
+
+    async def generation() -> None:
+        try:
+            generating.set()
+            await asyncio.sleep(10)
+        finally:
+            await previous.release()
+
+    task = asyncio.create_task(generation())
+    previous.set_cancel(task.cancel)
+    await generating.wait()
+
+    replacement = await asyncio.wait_for(guard.acquire(1), timeout=1.0)
+
+    assert task.cancelled()
+    assert previous.released
+    assert guard.snapshot()["replaced"] == 1
+    await replacement.release()
+
+
+async def test_cancel_replace_waits_for_uncancellable_turn(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "CHAT_SESSION_BUSY_POLICY", "cancel_replace")
+    guard = SessionTurnGuard()
+    previous = await guard.acquire(1)
+    # 已完整结束、正在保存的一轮不可取消：新一轮等待它释放
+    previous.set_cancel(None)
+
+    replacement = asyncio.create_task(guard.acquire(1))
+    await asyncio.sleep(0)
+    assert not replacement.done()
+
+    await previous.release()
+    turn = await asyncio.wait_for(replacement, timeout=1.0)
+    assert guard.snapshot()["replaced"] == 0
+    await turn.release()
+
+
+class _AdvisoryDb:
+    """Postgres 咨询锁替身：按 (命名空间, 会话ID) 记录持有锁的连接。"""
+
+    def __init__(self) -> None:
+        self.locks: dict[tuple[int, int], _Conn] = {}
+        self.open = 0
+        self.fail_unlock = False
+
+    async def connect(self) -> "_Conn":
+        self.open += 1
+        return _Conn(self)
+
+
+class _Result:
+    def __init__(self, value: bool) -> None:
+        self._value = value
+
+    def scalar(self) -> bool:
+        return self._value
+
+
+class _Conn:
+    def __init__(self, db: _AdvisoryDb) -> None:
+        self.db = db
+        self.invalidated = False
+
+    async def execute(self, stmt: Any, params: dict[str, int]) -> _Result:
+        key = (params["namespace"], params["session_id"])
+        if "pg_try_advisory_lock" in str(stmt):
+            holder = self.db.locks.setdefault(key, self)
+            return _Result(holder is self)
+        if self.db.fail_unlock:
+            raise ConnectionError("server closed the connection")
+        assert self.db.locks.pop(key) is self
+        return _Result(True)
+
+    async def commit(self) -> None:
+        pass
+
+    async def invalidate(self) -> None:
+        self.invalidated = True
+
+    async def close(self) -> None:
+        self.db.open -= 1
+        # 数据库会话结束时其持有的咨询锁随之释放
+        for key, holder in list(self.db.locks.items()):
+            if holder is self:
+                del self.db.locks[key]
+
+
+@pytest.fixture
+def advisory(monkeypatch: pytest.MonkeyPatch) -> _AdvisoryDb:
+    db = _AdvisoryDb()
+    monkeypatch.setattr(settings, "CHAT_SESSION_LOCK_BACKEND", "postgres")
+    monkeypatch.setattr(session_lock, "_get_lock_engine", lambda: db)
+    monkeypatch.setattr(session_lock, "ADVISORY_POLL_INTERVAL", 0.01)
+    return db
+
+
+async def test_advisory_lock_excludes_other_workers(advisory: _AdvisoryDb) -> None:
+    worker_a, worker_b = SessionTurnGuard(), SessionTurnGuard()
+    turn = await worker_a.acquire(1)
+    assert list(advisory.locks) == [(session_lock.ADVISORY_LOCK_NAMESPACE, 1)]
+
+    with pytest.raises(SessionBusyError):
+        await worker_b.acquire(1)
+    # 失败的一方关闭连接并释放进程内锁
+    assert advisory.open == 1
+    assert worker_b._locks == {}
+
+    await turn.release()
+    assert advisory.locks == {}
+    assert advisory.open == 0
+    other = await worker_b.acquire(1)
+    await other.release()
+
+
+async def test_advisory_lock_queue_polls_until_released(
+    advisory: _AdvisoryDb, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "CHAT_SESSION_BUSY_POLICY", "queue")
+    worker_a, worker_b = SessionTurnGuard(), SessionTurnGuard()
+    turn = await worker_a.acquire(1)
+
+    waiter = asyncio.create_task(worker_b.acquire(1))
+    await asyncio.sleep(0.03)
+    assert not waiter.done()
+
+    await turn.release()
+    queued = await asyncio.wait_for(waiter, timeout=1.0)
+    assert advisory.locks[(session_lock.ADVISORY_LOCK_NAMESPACE, 1)] is queued._conn
+    await queued.release()
+    assert advisory.open == 0
+
+
+async def test_failed_unlock_invalidates_connection(advisory: _AdvisoryDb) -> None:
+    guard = SessionTurnGuard()
+    turn = await guard.acquire(1)
+    conn = turn._conn
+    assert isinstance(conn, _Conn)
+
+    advisory.fail_unlock = True
+    await turn.release()
+
+    assert conn.invalidated
+    assert advisory.locks == {}
+    assert guard._locks == {}
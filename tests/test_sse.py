@@ -0,0 +1,107 @@
+"""SSE 输出测试：帧编码与回复增量的合并（CHAT_SSE_FLUSH_MS / CHAT_SSE_FLUSH_BYTES）。"""
+
+import asyncio
+import json
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any
+
+import pytest
+
+from src.apps.api.config import settings
+from src.apps.api.services import chat_stream
+from src.apps.api.services.chat_stream import ChatStreamRelay
+from src.apps.api.services.sse import DONE_FRAME, sse_frame
+
+
+def test_sse_frame_keeps_chinese_unescaped() -> None:
+    frame = sse_frame({"content": "头痛", "done": False})
+
+    assert frame.startswith(b"data: ")
+    assert frame.endswith(b"\n\n")
+    assert "头痛".encode() in frame
+    assert json.loads(frame[6:]) == {"content": "头痛", "done": False}
+    assert DONE_FRAME == b"data: [DONE]\n\n"
+
+
+class _TimedResponse:
+    """按给定间隔（秒）逐个输出回复增量的上游响应。"""
+
+    status_code = 200
+    request = type("Request", (), {"url": "http://llm/v1/chat/completions"})()
+
+    def __init__(self, deltas: list[tuple[float, str]]) -> None:
+        self._deltas = deltas
+
+    async def aiter_lines(self) -> AsyncIterator[str]:
+        for delay, content in self._deltas:
+            await asyncio.sleep(delay)
+            chunk = {"choices": [{"index": 0, "delta": {"content": content}}]}
+            yield "data: " + json.dumps(chunk, ensure_ascii=False)
+        yield 'data: {"choices":[{"index":0,"delta":{},"finish_reason":"stop"}]}'
+        yield "data: [DONE]"
+
+
+class _LLM:
+    def __init__(self, deltas: list[tuple[float, str]]) -> None:
+        self._deltas = deltas
+
+    @asynccontextmanager
+    async def stream_chat(self, payload: dict[str, Any], affinity_key: Any = None) -> Any:
+        yield _TimedResponse(self._deltas)
+
+
+async def _connected() -> bool:
+    return False
+
+
+async def _relay(
+    monkeypatch: pytest.MonkeyPatch, deltas: list[tuple[float, str]]
+) -> list[tuple[float, str]]:
+    """运行一次转发，返回 (相对开始的秒数, 合并后的增量)。"""
+    monkeypatch.setattr(chat_stream, "get_llm_client", lambda: _LLM(deltas))
+    relay = ChatStreamRelay(_connected, {"max_tokens": 64})
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    received = [(loop.time() - started, content) async for content in relay.deltas()]
+    assert relay.error is None
+    assert relay.content == "".join(content for _, content in deltas)
+    return received
+
+
+@pytest.fixture(autouse=True)
+def flush_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_STREAM_PARSER", "json")
+    monkeypatch.setattr(settings, "CHAT_SSE_FLUSH_MS", 100)
+    monkeypatch.setattr(settings, "CHAT_SSE_FLUSH_BYTES", 1024)
+
+
+async def test_deltas_within_window_are_merged(monkeypatch: pytest.MonkeyPatch) -> None:
+    deltas = [(0.0, "头"), (0.01, "痛"), (0.01, "三"), (0.3, "天"), (0.01, "了")]
+
+    received = await _relay(monkeypatch, deltas)
+
+    assert [content for _, content in received] == ["头痛三", "天了"]
+    # 首段在首个增量到达后约 CHAT_SSE_FLUSH_MS 产出，不等后续增量
+    assert 0.09 <= received[0][0] < 0.25
+
+
+async def test_flush_bytes_cuts_window_short(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_SSE_FLUSH_MS", 10_000)
+    monkeypatch.setattr(settings, "CHAT_SSE_FLUSH_BYTES", 6)
+    deltas = [(0.0, "头"), (0.01, "痛"), (0.01, "三"), (0.01, "天"), (0.01, "了")]
+
+    received = await _relay(monkeypatch, deltas)
+
+    # 每积累 6 字节（两个汉字）产出一次；上游结束时立即产出剩余部分
+    assert [content for _, content in received] == ["头痛", "三天", "了"]
+    assert received[-1][0] < 1.0
+
+
+async def test_zero_flush_ms_forwards_each_delta(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_SSE_FLUSH_MS", 0)
+    deltas = [(0.0, "头"), (0.01, "痛"), (0.01, "三"), (0.01, "天")]
+
+    received = await _relay(monkeypatch, deltas)
+
+    assert [content for _, content in received] == ["头", "痛", "三", "天"]
@@ -0,0 +1,225 @@
+"""可恢复对话流测试：断线重连、缓冲淘汰后的 resync 与慢客户端处理。"""
+
+import asyncio
+import json
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from typing import Any
+
+import pytest
+
+from src.apps.api.config import settings
+from src.apps.api.routes import chat
+from src.apps.api.services import chat_stream
+from src.apps.api.services.admission import AdmissionController
+from src.apps.api.services.chat_stream import ChatStreamRelay
+from src.apps.api.services.stream_registry import ResumableStream, StreamRegistry
+
+
+async def _connected() -> bool:
+    return False
+
+
+def _events(frames: list[bytes]) -> list[tuple[int | None, dict | str]]:
+    """把 SSE 帧解析为 (事件序号, 载荷)；[DONE] 的载荷为字符串。"""
+    events: list[tuple[int | None, dict | str]] = []
+    for frame in b"".join(frames).decode().split("\n\n"):
+        if not frame:
+            continue
+        event_id = None
+        for line in frame.split("\n"):
+            if line.startswith("id: "):
+                event_id = int(line[4:])
+            elif line.startswith("data: "):
+                data = line[6:]
+                events.append((event_id, data if data == "[DONE]" else json.loads(data)))
+    return events
+
+
+async def _read(stream: ResumableStream, last_event_id: int = 0) -> list:
+    frames = [frame async for frame in stream.subscribe(_connected, last_event_id)]
+    return _events(frames)
+
+
+def _text(events: list) -> str:
+    return "".join(
+        payload["content"]
+        for _, payload in events
+        if isinstance(payload, dict) and "content" in payload
+    )
+
+
+@pytest.fixture(autouse=True)
+def stream_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_RESUME_BUFFER_EVENTS", 100)
+    monkeypatch.setattr(settings, "CHAT_STREAM_BUFFER_SIZE", 100)
+    monkeypatch.setattr(settings, "CHAT_SLOW_CLIENT_POLICY", "coalesce")
+
+
+def _generate(stream: ResumableStream, pieces: list[str]) -> None:
+    stream.publish({"stream_id": stream.stream_id, "done": False})
+    for piece in pieces:
+        stream.publish_content(piece)
+    stream.publish({"content": "", "done": True, "latency_ms": 1})
+    stream.finish()
+
+
+async def test_replay_from_last_event_id() -> None:
+    stream = ResumableStream("s1", user_id=1, session_id=1)
+    _generate(stream, ["头", "痛", "三天"])
+
+    full = await _read(stream)
+    assert [event_id for event_id, _ in full] == [1, 2, 3, 4, 5, 6]
+    assert full[-1][1] == "[DONE]"
+
+    resumed = await _read(stream, last_event_id=3)
+    assert resumed == full[3:]
+    assert _text(full[:3] + resumed) == "头痛三天"
+
+
+async def test_resync_after_eviction(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_RESUME_BUFFER_EVENTS", 3)
+    stream = ResumableStream("s1", user_id=1, session_id=1)
+    _generate(stream, ["头", "痛", "三", "天"])
+
+    # 缓冲只剩最后 3 个事件：5（"天"）、6（done）、7（[DONE]）
+    events = await _read(stream, last_event_id=2)
+
+    # resync 携带被淘汰部分的完整回复，客户端用它替换已显示的内容
+    event_id, resync = events[0]
+    assert event_id == 4
+    assert resync == {"content": "头痛三", "resync": True, "done": False}
+    assert [event_id for event_id, _ in events[1:]] == [5, 6, 7]
+    assert _text(events) == "头痛三天"
+
+
+async def test_slow_client_backlog_is_coalesced(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_STREAM_BUFFER_SIZE", 3)
+    stream = ResumableStream("s1", user_id=1, session_id=1)
+    _generate(stream, ["头", "痛", "三", "天"])
+
+    events = await _read(stream)
+
+    assert events == [
+        (1, {"stream_id": "s1", "done": False}),
+        (5, {"content": "头痛三天", "done": False}),
+        (6, {"content": "", "done": True, "latency_ms": 1}),
+        (7, "[DONE]"),
+    ]
+    assert not stream.keep_alive
+
+
+async def test_slow_client_disconnect_keeps_generation_alive(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "CHAT_STREAM_BUFFER_SIZE", 3)
+    monkeypatch.setattr(settings, "CHAT_SLOW_CLIENT_POLICY", "disconnect")
+    monkeypatch.setattr(settings, "CHAT_RESUME_GRACE", 0)
+    stream = ResumableStream("s1", user_id=1, session_id=1)
+    stream.publish({"stream_id": "s1", "done": False})
+    for piece in ["头", "痛", "三", "天"]:
+        stream.publish_content(piece)
+
+    events = await _read(stream)
+
+    assert "error" in events[0][1]
+    assert events[-1] == (None, "[DONE]")
+    assert stream.keep_alive
+    assert not await stream.is_abandoned()
+
+
+async def test_registry_scopes_streams_to_owner(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_RESUME_TTL", 0)
+    registry = StreamRegistry()
+    stream = registry.create(user_id=1, session_id=1)
+
+    assert registry.get(stream.stream_id, user_id=1) is stream
+    assert registry.get(stream.stream_id, user_id=2) is None
+
+    stream.finish()
+    assert registry.get(stream.stream_id, user_id=1) is None
+
+
+async def test_registry_evicts_streams_that_never_finish(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    registry = StreamRegistry()
+    stuck = registry.create(user_id=1, session_id=1)
+    stuck.publish_content("头痛")
+    waiting = asyncio.create_task(_read(stuck))
+    await asyncio.sleep(0)
+    assert registry.get(stuck.stream_id, user_id=1) is stuck
+
+    # 生成任务异常退出、从未调用 finish() 的流到期后被清理，等待中的订阅者随之结束
+    monkeypatch.setattr(settings, "CHAT_RESUME_MAX_AGE", 0)
+    assert registry.get(stuck.stream_id, user_id=1) is None
+    assert _text(await asyncio.wait_for(waiting, timeout=1.0)) == "头痛"
+    assert registry.snapshot() == {"live": 0, "retained": 0, "subscribers": 0}
+
+
+async def test_zero_grace_waits_for_first_subscriber(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_RESUME_GRACE", 0)
+    stream = ResumableStream("s1", user_id=1, session_id=1)
+
+    # 生成任务先于 HTTP 响应启动，此时尚无订阅者
+    assert not await stream.is_abandoned()
+
+    stream.publish_content("头痛")
+    stream.finish()
+    await _read(stream)
+    assert await stream.is_abandoned()
+
+
+class _LLMResponse:
+    status_code = 200
+    request = type("Request", (), {"url": "http://llm/v1/chat/completions"})()
+
+    async def aiter_lines(self) -> AsyncIterator[str]:
+        for piece in ["头痛", "三天"]:
+            chunk = {"choices": [{"index": 0, "delta": {"content": piece}}]}
+            yield "data: " + json.dumps(chunk, ensure_ascii=False)
+        yield 'data: {"choices":[{"index":0,"delta":{},"finish_reason":"stop"}]}'
+        yield "data: [DONE]"
+
+
+class _LLM:
+    @asynccontextmanager
+    async def stream_chat(self, payload: dict[str, Any], affinity_key: Any = None) -> Any:
+        yield _LLMResponse()
+
+
+class _Turn:
+    def set_cancel(self, cancel: Callable[[], object] | None) -> None:
+        pass
+
+    async def release(self) -> None:
+        pass
+
+
+class _Writer:
+    async def submit(self, messages: Any, stats: Any = None) -> None:
+        pass
+
+
+async def test_zero_grace_generation_reaches_first_subscriber(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "CHAT_RESUME_GRACE", 0)
+    monkeypatch.setattr(settings, "CHAT_STREAM_PARSER", "json")
+    monkeypatch.setattr(chat_stream, "get_llm_client", lambda: _LLM())
+    admission = AdmissionController(lambda: 1)
+    monkeypatch.setattr(chat, "get_admission", lambda: admission)
+    monkeypatch.setattr(chat, "get_message_writer", lambda: _Writer())
+    stream = ResumableStream("s1", user_id=1, session_id=1)
+    relay = ChatStreamRelay(stream.is_abandoned, {"max_tokens": 16})
+
+    # 与 dispatch_chat_turn 相同：先启动后台生成，再由 HTTP 响应订阅
+    task = asyncio.create_task(
+        chat.run_generation(stream, relay, admission.reserve(1), _Turn(), 1, 1, "哪里不舒服")
+    )
+    await asyncio.sleep(0)
+    events = await asyncio.wait_for(_read(stream), timeout=1.0)
+    await task
+
+    assert _text(events) == "头痛三天"
+    assert events[-1][1] == "[DONE]"
@@ -0,0 +1,53 @@
+"""滚动摘要触发判断与摘要调用测试。"""
+
+from datetime import datetime
+
+import pytest
+
+from src.apps.api.config import settings
+from src.apps.api.services import summarizer
+from src.apps.api.services.admission import AdmissionController
+from src.apps.api.services.message_writer import PENDING_ID_BASE, PendingRow
+from src.apps.api.services.summarizer import plan_summary_update
+
+
+def _row(id_: int, role: str = "user") -> PendingRow:
+    return PendingRow(id=id_, role=role, content="问诊内容", tokens=100, created_at=datetime.now())
+
+
+@pytest.fixture(autouse=True)
+def summary_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_SUMMARY_ENABLED", True)
+    monkeypatch.setattr(settings, "CHAT_SUMMARY_KEEP_RECENT", 2)
+    monkeypatch.setattr(settings, "CHAT_SUMMARY_TRIGGER_TOKENS", 300)
+
+
+def test_target_keeps_recent_messages() -> None:
+    history = [_row(i) for i in range(1, 7)]
+    assert plan_summary_update(history, history, None) == 4
+
+
+def test_target_skips_unpersisted_messages() -> None:
+    # 最后四条仍在写入队列中（临时 ID），摘要目标退到最近一条已落库消息
+    history = [_row(1), _row(2)] + [_row(PENDING_ID_BASE + i) for i in range(1, 5)]
+    assert plan_summary_update(history, history, None) == 2
+
+
+def test_no_target_when_nothing_persisted() -> None:
+    history = [_row(PENDING_ID_BASE + i) for i in range(1, 7)]
+    assert plan_summary_update(history, history, None) is None
+
+
+async def test_summary_goes_through_admission(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "LLM_QUEUE_MAX", 0)
+    admission = AdmissionController(lambda: 1)
+    admission.reserve(1)
+    monkeypatch.setattr(summarizer, "get_admission", lambda: admission)
+
+    def no_llm() -> None:
+        raise AssertionError("准入已满时不应调用 LLM")
+
+    monkeypatch.setattr(summarizer, "get_llm_client", no_llm)
+
+    assert await summarizer._summarize(None, [("user", "头痛")]) is None
+    assert admission.rejected == 1
@@ -0,0 +1,237 @@
+"""token 记账测试：vLLM usage 写入消息与生成统计，历史 token 数回填可重复执行。"""
+
+import asyncio
+import json
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from typing import Any
+
+import pytest
+
+from src.apps.api.config import settings
+from src.apps.api.routes import chat
+from src.apps.api.services import chat_stream
+from src.apps.api.services.admission import AdmissionController
+from src.apps.api.services.chat_stream import ChatStreamRelay
+from src.apps.api.services.generation_stats import GenerationTiming, record_generation
+from src.apps.api.services.stream_registry import ResumableStream
+from src.scripts import backfill_message_tokens
+
+USAGE = {"prompt_tokens": 120, "completion_tokens": 34}
+
+
+async def _connected() -> bool:
+    return False
+
+
+class _LLMResponse:
+    status_code = 200
+    request = type("Request", (), {"url": "http://llm/v1/chat/completions"})()
+
+    def __init__(self, usage: dict[str, int] | None) -> None:
+        self.usage = usage
+
+    async def aiter_lines(self) -> AsyncIterator[str]:
+        for piece in ["头痛", "三天"]:
+            chunk = {"choices": [{"index": 0, "delta": {"content": piece}}]}
+            yield "data: " + json.dumps(chunk, ensure_ascii=False)
+        yield 'data: {"choices":[{"index":0,"delta":{},"finish_reason":"stop"}]}'
+        if self.usage is not None:
+            yield "data: " + json.dumps({"choices": [], "usage": self.usage})
+        yield "data: [DONE]"
+
+    async def aiter_bytes(self) -> AsyncIterator[bytes]:
+        async for line in self.aiter_lines():
+            yield line.encode() + b"\n"
+
+
+class _LLM:
+    def __init__(self, usage: dict[str, int] | None) -> None:
+        self.usage = usage
+
+    @asynccontextmanager
+    async def stream_chat(self, payload: dict[str, Any], affinity_key: Any = None) -> Any:
+        yield _LLMResponse(self.usage)
+
+
+class _Turn:
+    def set_cancel(self, cancel: Callable[[], object] | None) -> None:
+        pass
+
+    async def release(self) -> None:
+        pass
+
+
+class _Writer:
+    def __init__(self) -> None:
+        self.messages: list[Any] = []
+        self.stats: list[dict[str, Any] | None] = []
+
+    async def submit(self, messages: Any, stats: Any = None) -> None:
+        self.messages.extend(messages)
+        self.stats.append(stats)
+
+
+async def _run_turn(monkeypatch: pytest.MonkeyPatch, usage: dict[str, int] | None) -> _Writer:
+    writer = _Writer()
+    admission = AdmissionController(lambda: 1)
+    monkeypatch.setattr(chat_stream, "get_llm_client", lambda: _LLM(usage))
+    monkeypatch.setattr(chat, "get_admission", lambda: admission)
+    monkeypatch.setattr(chat, "get_message_writer", lambda: writer)
+    monkeypatch.setattr(chat, "count_tokens", len)
+    stream = ResumableStream("s1", user_id=1, session_id=1)
+    relay = ChatStreamRelay(stream.is_abandoned, {"max_tokens": 64})
+
+    task = asyncio.create_task(
+        chat.run_generation(stream, relay, admission.reserve(1), _Turn(), 1, 7, "哪里不舒服")
+    )
+    await asyncio.sleep(0)
+    [frame async for frame in stream.subscribe(_connected, 0)]
+    await task
+    return writer
+
+
+@pytest.mark.parametrize("parser", ["passthrough", "json"])
+async def test_reported_usage_is_stored(monkeypatch: pytest.MonkeyPatch, parser: str) -> None:
+    monkeypatch.setattr(settings, "CHAT_STREAM_PARSER", parser)
+
+    writer = await _run_turn(monkeypatch, USAGE)
+
+    user, assistant = writer.messages
+    assert (user.content, user.tokens) == ("哪里不舒服", 5)
+    assert (assistant.content, assistant.tokens) == ("头痛三天", 34)
+    [stats] = writer.stats
+    assert stats is not None
+    assert stats["prompt_tokens"] == 120
+    assert stats["completion_tokens"] == 34
+    assert stats["case_id"] == 7
+
+
+async def test_missing_usage_counts_locally(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "CHAT_STREAM_PARSER", "passthrough")
+    monkeypatch.setattr(chat_stream, "count_tokens", len)
+
+    writer = await _run_turn(monkeypatch, None)
+
+    assert writer.messages[1].tokens == len("头痛三天")
+    [stats] = writer.stats
+    assert stats is not None
+    assert stats["prompt_tokens"] is None
+    # 没有 usage 时按回复增量数计
+    assert stats["completion_tokens"] == 2
+
+
+def test_record_generation_prefers_usage() -> None:
+    timing = GenerationTiming(tokens=2)
+
+    row = record_generation(timing, session_id=1, case_id=7, finish_reason="stop", usage=USAGE)
+
+    assert row["prompt_tokens"] == 120
+    assert row["completion_tokens"] == 34
+
+
+@pytest.mark.parametrize(
+    ("usage", "prompt", "completion"),
+    [({"prompt_tokens": 120}, 120, 2), ({"completion_tokens": 34}, None, 34), ({}, None, 2)],
+    ids=["prompt-only", "completion-only", "empty"],
+)
+def test_record_generation_partial_usage(
+    usage: dict[str, int], prompt: int | None, completion: int
+) -> None:
+    row = record_generation(GenerationTiming(tokens=2), 1, 7, "stop", usage)
+
+    assert row["prompt_tokens"] == prompt
+    assert row["completion_tokens"] == completion
+
+
+class _Rows:
+    def __init__(self, rows: list[tuple[int, str, int | None]], scalar: int | None = None) -> None:
+        self._rows = rows
+        self._scalar = scalar
+
+    def scalar(self) -> int | None:
+        return self._scalar
+
+    def all(self) -> list[Any]:
+        return [
+            type("Row", (), {"id": id_, "content": content, "tokens": tokens})()
+            for id_, content, tokens in self._rows
+        ]
+
+
+class _Conn:
+    def __init__(self, engine: "_Engine") -> None:
+        self.engine = engine
+
+    async def execute(self, stmt: Any, params: list[dict[str, int]] | None = None) -> Any:
+        table = self.engine.table
+        if stmt is backfill_message_tokens.UPDATE_TOKENS:
+            assert params is not None
+            for update in params:
+                content, _ = table[update["message_id"]]
+                table[update["message_id"]] = (content, update["new_tokens"])
+            self.engine.updated += len(params)
+            return None
+        bound = stmt.compile().params
+        if not bound:  # select max(id)
+            return _Rows([], scalar=max(table, default=None))
+        ids = [i for i in sorted(table) if bound["id_1"] < i <= bound["id_2"]]
+        return _Rows([(i, *table[i]) for i in ids[: bound["param_1"]]])
+
+
+class _Engine:
+    """messages 表替身：只支持回填脚本用到的查询与批量更新。"""
+
+    def __init__(self, table: dict[int, tuple[str, int | None]]) -> None:
+        self.table = table
+        self.updated = 0
+
+    @asynccontextmanager
+    async def connect(self) -> AsyncIterator[_Conn]:
+        yield _Conn(self)
+
+    begin = connect
+
+    async def dispose(self) -> None:
+        pass
+
+
+@pytest.fixture
+def messages(monkeypatch: pytest.MonkeyPatch) -> _Engine:
+    engine = _Engine(
+        {
+            1: ("头痛", 1),
+            2: ("反复头痛三天", 6),
+            3: ("伴恶心", None),
+            5: ("无发热", 99),
+            8: ("睡眠差", 3),
+        }
+    )
+    monkeypatch.setattr(backfill_message_tokens, "engine", engine)
+    monkeypatch.setattr(backfill_message_tokens, "count_tokens", len)
+    return engine
+
+
+async def test_backfill_is_idempotent(messages: _Engine) -> None:
+    expected = {i: (content, len(content)) for i, (content, _) in messages.table.items()}
+
+    await backfill_message_tokens.backfill(2, start_id=0, max_id=None, dry_run=False)
+    assert messages.table == expected
+    assert messages.updated == 3
+
+    await backfill_message_tokens.backfill(2, start_id=0, max_id=None, dry_run=False)
+    assert messages.table == expected
+    assert messages.updated == 3
+
+
+async def test_backfill_dry_run_and_resume(messages: _Engine) -> None:
+    before = dict(messages.table)
+    await backfill_message_tokens.backfill(2, start_id=0, max_id=None, dry_run=True)
+    assert messages.table == before
+
+    # 从 id=2 之后续跑，且只处理到 id=5
+    await backfill_message_tokens.backfill(10, start_id=2, max_id=5, dry_run=False)
+    assert messages.table[1] == before[1]
+    assert messages.table[3] == ("伴恶心", 3)
+    assert messages.table[5] == ("无发热", 3)
+    assert messages.table[8] == before[8]